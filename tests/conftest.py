@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 root_dir_content = os.listdir(BASE_DIR)
 PROJECT_DIR_NAME = 'yatube'
@@ -37,3 +39,11 @@ pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(scope='session', autouse=True)
+def isolated_settings():
+    """Настройки тестов те же, что у раннера manage.py test."""
+    from core.runner import isolated_settings as _isolated_settings
+    with _isolated_settings():
+        yield
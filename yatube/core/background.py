@@ -0,0 +1,86 @@
+"""Фоновые пулы потоков для задач, выполняемых после ответа."""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Set
+
+from django.conf import settings
+from django.db import connections
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_futures: Set[Future] = set()
+_lock: threading.Lock = threading.Lock()
+
+
+def get_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    """Возвращает пул потоков name, создавая его при первом обращении."""
+    with _lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix=name,
+            )
+        return _executors[name]
+
+
+def _run(task: Callable[..., Any], *args: Any) -> Any:
+    try:
+        return task(*args)
+    finally:
+        # Соединения с базой принадлежат потоку пула.
+        connections.close_all()
+
+
+@contextmanager
+def _detached() -> Iterator[None]:
+    # Запросы задачи, выполняемой сразу, не относятся к запросу
+    # к странице: их не видят ни поиск N+1, ни Server-Timing.
+    wrappers = [
+        (connection, connection.execute_wrappers)
+        for connection in connections.all()
+    ]
+    for connection, _ in wrappers:
+        connection.execute_wrappers = []
+    try:
+        yield
+    finally:
+        for connection, saved in wrappers:
+            connection.execute_wrappers = saved
+
+
+def _forget(future: Future) -> None:
+    with _lock:
+        _futures.discard(future)
+
+
+def submit(name: str, max_workers: int, task: Callable[..., Any],
+           *args: Any) -> Future:
+    """
+    Ставит task(*args) в очередь пула потоков name.
+
+    С настройкой BACKGROUND_TASKS_EAGER задача выполняется сразу
+    в текущем потоке.
+    """
+    if settings.BACKGROUND_TASKS_EAGER:
+        future: Future = Future()
+        try:
+            with _detached():
+                future.set_result(task(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+    future = get_executor(name, max_workers).submit(_run, task, *args)
+    with _lock:
+        _futures.add(future)
+    future.add_done_callback(_forget)
+    return future
+
+
+def drain() -> None:
+    """Ждет завершения задач всех пулов, в том числе поставленных ими."""
+    while True:
+        with _lock:
+            futures: Set[Future] = set(_futures)
+        if not futures:
+            return
+        wait(futures)
@@ -0,0 +1,287 @@
+"""
+Двухуровневый кэш: LRU в памяти процесса перед общим файловым кэшем.
+
+Общий уровень (FileBasedCache) виден всем воркерам на машине и не
+требует внешних сервисов, локальный уровень снимает с него повторные
+чтения горячих ключей. Значения живут в локальном уровне не дольше
+LOCAL_TIMEOUT секунд, поэтому изменения, сделанные другими воркерами,
+видны с задержкой не больше этого времени.
+
+get_or_recompute защищает дорогие значения от одновременного пересчета
+многими воркерами при истечении (cache stampede).
+"""
+import math
+import os
+import pickle
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+from .timing import count_event
+
+_MISSING = object()
+
+# Значение, момент устаревания и время вычисления в секундах.
+Envelope = Tuple[Any, float, float]
+
+# Через сколько секунд блокировка add, оставшаяся от упавшего
+# процесса, считается брошенной.
+ADD_LOCK_TIMEOUT: float = 10
+
+
+def _raw_key(key: str, key_prefix: str, version: int) -> str:
+    return key
+
+
+class TieredCache(BaseCache):
+    """
+    Кэш-бэкенд с локальным и общим уровнями.
+
+    Параметры OPTIONS: LOCAL_MAX_ENTRIES - размер локального LRU,
+    LOCAL_TIMEOUT - время жизни значения в локальном уровне,
+    MAX_ENTRIES и CULL_FREQUENCY - параметры общего уровня.
+    """
+
+    def __init__(self, location: str, params: Dict[str, Any]) -> None:
+        super().__init__(params)
+        options: Dict[str, Any] = params.get('OPTIONS', {})
+        self.local_max_entries: int = int(
+            options.get('LOCAL_MAX_ENTRIES', 500)
+        )
+        self.local_timeout: float = float(options.get('LOCAL_TIMEOUT', 5))
+        self.shared: FileBasedCache = FileBasedCache(location, {
+            'TIMEOUT': params.get('TIMEOUT', 300),
+            'KEY_FUNCTION': _raw_key,
+            'OPTIONS': {
+                'MAX_ENTRIES': self._max_entries,
+                'CULL_FREQUENCY': self._cull_frequency,
+            },
+        })
+        self._local: 'OrderedDict[str, Tuple[float, bytes]]' = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._stats: Counter = Counter()
+
+    def get(self, key: str, default: Any = None,
+            version: Optional[int] = None) -> Any:
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._local.move_to_end(key)
+                self._stats['local_hits'] += 1
+                count_event('cache_hits')
+                return pickle.loads(entry[1])
+
+        value = self.shared.get(key, _MISSING)
+        if value is _MISSING:
+            self._stats['misses'] += 1
+            count_event('cache_misses')
+            self._local_delete(key)
+            return default
+
+        self._stats['shared_hits'] += 1
+        count_event('cache_hits')
+        self._local_set(key, value, self.local_timeout)
+        return value
+
+    def set(self, key: str, value: Any, timeout: Any = DEFAULT_TIMEOUT,
+            version: Optional[int] = None) -> None:
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._stats['sets'] += 1
+        self.shared.set(key, value, timeout)
+        self._local_set(key, value, self._local_ttl(timeout))
+
+    def add(self, key: str, value: Any, timeout: Any = DEFAULT_TIMEOUT,
+            version: Optional[int] = None) -> bool:
+        """
+        Сохраняет значение, если ключа нет ни у одного процесса.
+
+        FileBasedCache.add проверяет ключ и записывает значение без
+        блокировки, поэтому проверка и запись выполняются под
+        межпроцессной блокировкой ключа.
+        """
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        lock_path: str = f'{self.shared._key_to_file(key)}.lock'
+        if not self._lock_file(lock_path):
+            return False
+        try:
+            if self.shared.has_key(key):
+                return False
+            self.shared.set(key, value, timeout)
+        finally:
+            os.remove(lock_path)
+        self._stats['sets'] += 1
+        self._local_set(key, value, self._local_ttl(timeout))
+        return True
+
+    def touch(self, key: str, timeout: Any = DEFAULT_TIMEOUT,
+              version: Optional[int] = None) -> bool:
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._local_delete(key)
+        return self.shared.touch(key, timeout)
+
+    def delete(self, key: str, version: Optional[int] = None) -> None:
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._local_delete(key)
+        self.shared.delete(key)
+
+    def has_key(self, key: str, version: Optional[int] = None) -> bool:
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self) -> None:
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику обращений к кэшу в текущем процессе.
+
+        hit_ratio - доля чтений, обслуженных любым из уровней,
+        local_evictions - вытеснения из локального LRU по размеру.
+        """
+        stats: Dict[str, Any] = dict(self._stats)
+        reads: int = sum(
+            self._stats[name]
+            for name in ('local_hits', 'shared_hits', 'misses')
+        )
+        stats['hit_ratio'] = (
+            (self._stats['local_hits'] + self._stats['shared_hits']) / reads
+            if reads else 0.0
+        )
+        stats['local_entries'] = len(self._local)
+        stats['local_max_entries'] = self.local_max_entries
+        return stats
+
+    def reset_stats(self) -> None:
+        """Обнуляет статистику обращений."""
+        self._stats.clear()
+
+    def _local_ttl(self, timeout: Any) -> float:
+        backend_timeout = self.get_backend_timeout(timeout)
+        if backend_timeout is None:
+            return self.local_timeout
+        return min(self.local_timeout, backend_timeout - time.time())
+
+    def _local_set(self, key: str, value: Any, ttl: float) -> None:
+        if ttl <= 0 or self.local_max_entries <= 0:
+            self._local_delete(key)
+            return
+        pickled: bytes = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, pickled)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_max_entries:
+                self._local.popitem(last=False)
+                self._stats['local_evictions'] += 1
+
+    def _local_delete(self, key: str) -> None:
+        with self._lock:
+            self._local.pop(key, None)
+
+    def _lock_file(self, path: str) -> bool:
+        # Файл создается атомарно (O_EXCL): создать его может только
+        # один процесс.
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) < (
+                        ADD_LOCK_TIMEOUT
+                    ):
+                        return False
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return False
+
+
+def _should_refresh(expires: float, delta: float, beta: float) -> bool:
+    """
+    Вероятностное досрочное обновление (XFetch): чем ближе устаревание
+    и чем дольше вычисляется значение, тем вероятнее обновление.
+    """
+    return time.time() - delta * beta * math.log(
+        1.0 - random.random()
+    ) >= expires
+
+
+def _recompute(cache: BaseCache, key: str, compute: Callable[[], Any],
+               timeout: Optional[float], stale_timeout: float) -> Any:
+    started: float = time.time()
+    try:
+        value = compute()
+        delta: float = time.time() - started
+        if timeout is None:
+            cache.set(key, (value, math.inf, delta), None)
+        else:
+            cache.set(
+                key,
+                (value, time.time() + timeout, delta),
+                timeout + stale_timeout,
+            )
+        return value
+    finally:
+        cache.delete(f'{key}:lock')
+
+
+def get_or_recompute(key: str, compute: Callable[[], Any],
+                     timeout: Optional[float] = DEFAULT_TIMEOUT,
+                     using: str = 'default',
+                     stale_timeout: Optional[float] = None,
+                     beta: Optional[float] = None) -> Any:
+    """
+    Возвращает значение из кэша, вычисляя его не более чем одним
+    воркером одновременно.
+
+    Значение свежо timeout секунд и еще stale_timeout секунд отдается
+    устаревшим, пока его пересчитывает воркер, захвативший блокировку.
+    Незадолго до устаревания значение с вероятностью, растущей по мере
+    приближения к сроку, обновляется досрочно. При отсутствии значения
+    остальные воркеры ждут результата не дольше CACHE_LOCK_TIMEOUT.
+    """
+    cache: BaseCache = caches[using]
+    if timeout is DEFAULT_TIMEOUT:
+        timeout = cache.default_timeout
+    if stale_timeout is None:
+        stale_timeout = settings.CACHE_STALE_TIMEOUT
+    if beta is None:
+        beta = settings.CACHE_EARLY_REFRESH_BETA
+    lock_key: str = f'{key}:lock'
+    lock_timeout: int = settings.CACHE_LOCK_TIMEOUT
+
+    envelope: Optional[Envelope] = cache.get(key)
+    if envelope is not None:
+        value, expires, delta = envelope
+        if _should_refresh(expires, delta, beta) and cache.add(
+            lock_key, True, lock_timeout,
+        ):
+            return _recompute(cache, key, compute, timeout, stale_timeout)
+        return value
+
+    deadline: float = time.monotonic() + lock_timeout
+    while not cache.add(lock_key, True, lock_timeout):
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(0.05)
+        envelope = cache.get(key)
+        if envelope is not None:
+            return envelope[0]
+    return _recompute(cache, key, compute, timeout, stale_timeout)
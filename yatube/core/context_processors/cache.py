@@ -0,0 +1,11 @@
+from typing import Dict
+
+from django.conf import settings
+from django.http import HttpRequest
+
+
+def fragment_cache_timeout(request: HttpRequest) -> Dict[str, int]:
+    """Добавляет время жизни кэшированных фрагментов страниц."""
+    return {
+        'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+    }
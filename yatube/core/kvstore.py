@@ -0,0 +1,193 @@
+"""Хранилище ключей sorl-thumbnail в общем файле SQLite."""
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.kvstores.base import KVStoreBase
+
+from .timing import count_event
+
+TABLE: str = 'kvstore'
+
+
+class SQLiteKVStore(KVStoreBase):
+    """
+    Хранилище ключей sorl-thumbnail в файле THUMBNAIL_KVSTORE_PATH.
+
+    Соединения открываются отдельно для каждого потока и процесса.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._connections: threading.local = threading.local()
+        self._local: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._stats: Counter = Counter()
+        self._local_path: Optional[str] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока с файлом хранилища."""
+        path: str = settings.THUMBNAIL_KVSTORE_PATH
+        state = self._connections
+        if getattr(state, 'key', None) != (os.getpid(), path):
+            state.connection = self._connect(path)
+            state.key = (os.getpid(), path)
+        if path != self._local_path:
+            with self._lock:
+                self._local.clear()
+                self._local_path = path
+        return state.connection
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(
+            path,
+            timeout=settings.THUMBNAIL_KVSTORE_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID'
+        )
+        return connection
+
+    def _get_raw(self, key: str) -> Optional[str]:
+        connection: sqlite3.Connection = self.connection
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._local.move_to_end(key)
+                self._stats['local_hits'] += 1
+                count_event('kvstore_hits')
+                return entry[1]
+
+        row = connection.execute(
+            f'SELECT value FROM {TABLE} WHERE key = ?',
+            (key,),
+        ).fetchone()
+        if row is None:
+            self._stats['misses'] += 1
+            count_event('kvstore_misses')
+            self._local_delete([key])
+            return None
+        self._stats['store_hits'] += 1
+        count_event('kvstore_hits')
+        self._local_set(key, row[0])
+        return row[0]
+
+    def _set_raw(self, key: str, value: str) -> None:
+        self._stats['sets'] += 1
+        self.connection.execute(
+            f'INSERT OR REPLACE INTO {TABLE} (key, value) VALUES (?, ?)',
+            (key, value),
+        )
+        self._local_set(key, value)
+
+    def _delete_raw(self, *keys: str) -> None:
+        self._stats['deletes'] += len(keys)
+        self._local_delete(keys)
+        self.connection.executemany(
+            f'DELETE FROM {TABLE} WHERE key = ?',
+            [(key,) for key in keys],
+        )
+
+    def _find_keys_raw(self, prefix: str) -> List[str]:
+        escaped: str = (
+            prefix.replace('\\', '\\\\').replace('%', '\\%')
+            .replace('_', '\\_')
+        )
+        rows = self.connection.execute(
+            f"SELECT key FROM {TABLE} WHERE key LIKE ? ESCAPE '\\'",
+            (escaped + '%',),
+        )
+        return [row[0] for row in rows]
+
+    def set_many_raw(self, items: Iterable[Tuple[str, str]],
+                     replace: bool = False) -> int:
+        """
+        Записывает пары ключ-значение одной транзакцией.
+
+        Без replace существующие ключи не перезаписываются. Возвращает
+        количество записанных ключей.
+        """
+        statement: str = 'REPLACE' if replace else 'IGNORE'
+        connection: sqlite3.Connection = self.connection
+        with self._lock:
+            self._local.clear()
+        connection.execute('BEGIN')
+        try:
+            before: int = connection.total_changes
+            connection.executemany(
+                f'INSERT OR {statement} INTO {TABLE} (key, value) '
+                'VALUES (?, ?)',
+                items,
+            )
+            written: int = connection.total_changes - before
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self._stats['sets'] += written
+        return written
+
+    def clear(self, delete_thumbnails: bool = False) -> None:
+        """Удаляет все ключи sorl-thumbnail из хранилища."""
+        if delete_thumbnails:
+            self.delete_all_thumbnail_files()
+        with self._lock:
+            self._local.clear()
+        self._delete_raw(*self._find_keys_raw(
+            thumbnail_settings.THUMBNAIL_KEY_PREFIX,
+        ))
+
+    def count(self) -> int:
+        """Возвращает количество ключей в хранилище."""
+        return self.connection.execute(
+            f'SELECT COUNT(*) FROM {TABLE}',
+        ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику обращений к хранилищу в текущем процессе.
+
+        hit_ratio - доля чтений, нашедших ключ в памяти процесса или
+        в файле.
+        """
+        stats: Dict[str, Any] = dict(self._stats)
+        reads: int = sum(
+            self._stats[name]
+            for name in ('local_hits', 'store_hits', 'misses')
+        )
+        stats['hit_ratio'] = (
+            (self._stats['local_hits'] + self._stats['store_hits']) / reads
+            if reads else 0.0
+        )
+        stats['local_entries'] = len(self._local)
+        return stats
+
+    def _local_set(self, key: str, value: str) -> None:
+        expires: float = (
+            time.monotonic() + settings.THUMBNAIL_KVSTORE_LOCAL_TIMEOUT
+        )
+        with self._lock:
+            self._local[key] = (expires, value)
+            self._local.move_to_end(key)
+            while len(self._local) > (
+                settings.THUMBNAIL_KVSTORE_LOCAL_MAX_ENTRIES
+            ):
+                self._local.popitem(last=False)
+                self._stats['local_evictions'] += 1
+
+    def _local_delete(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
@@ -0,0 +1,63 @@
+from itertools import islice
+from typing import Any, Iterator, List, Tuple
+
+from django.core.management.base import (BaseCommand, CommandError,
+                                         CommandParser)
+from sorl.thumbnail import default
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.kvstore import SQLiteKVStore
+
+
+class Command(BaseCommand):
+    """
+    Переносит ключи sorl-thumbnail из таблицы thumbnail_kvstore
+    в файловое хранилище ключей.
+    """
+
+    help = (
+        'Заполняет хранилище ключей sorl-thumbnail записями из базы '
+        'данных, чтобы после переключения бэкенда не пересчитывать '
+        'размеры изображений и списки миниатюр'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество ключей, записываемых одной транзакцией',
+        )
+        parser.add_argument(
+            '--replace',
+            action='store_true',
+            help='Перезаписывать ключи, уже существующие в хранилище',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        kvstore = default.kvstore
+        if not isinstance(kvstore, SQLiteKVStore):
+            raise CommandError(
+                'THUMBNAIL_KVSTORE не указывает на core.kvstore.SQLiteKVStore'
+            )
+
+        rows: Iterator[Tuple[str, str]] = KVStoreModel.objects.order_by(
+            'key',
+        ).values_list('key', 'value').iterator(
+            chunk_size=options['batch_size'],
+        )
+        read: int = 0
+        written: int = 0
+        while True:
+            batch: List[Tuple[str, str]] = list(
+                islice(rows, options['batch_size'])
+            )
+            if not batch:
+                break
+            read += len(batch)
+            written += kvstore.set_many_raw(batch, options['replace'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано ключей: {read}, записано: {written}, '
+            f'всего в хранилище: {kvstore.count()}'
+        ))
@@ -0,0 +1,331 @@
+"""Метрики Prometheus, общие для всех воркеров на машине."""
+import atexit
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TABLE: str = 'metrics'
+
+# Имя метрики и метки в виде JSON отсортированных пар.
+Series = Tuple[str, str]
+Labels = Dict[str, str]
+
+# Тип и описание метрик для комментариев # TYPE и # HELP.
+METRICS: Dict[str, Tuple[str, str]] = {
+    'yatube_http_requests_total': (
+        'counter',
+        'Запросы по представлениям и классам статусов ответа',
+    ),
+    'yatube_http_request_duration_seconds': (
+        'histogram',
+        'Время обработки запроса',
+    ),
+    'yatube_request_phase_seconds_total': (
+        'counter',
+        'Суммарное время фаз обработки запросов (core.timing)',
+    ),
+    'yatube_db_queries_total': (
+        'counter',
+        'SQL-запросы, выполненные при обработке запросов',
+    ),
+    'yatube_cache_requests_total': (
+        'counter',
+        'Чтения кэша страниц и хранилища ключей миниатюр',
+    ),
+    'yatube_cache_hit_ratio': (
+        'gauge',
+        'Доля чтений кэша, нашедших значение',
+    ),
+    'yatube_thumbnails_queued_total': (
+        'counter',
+        'Миниатюры, поставленные представлением в очередь генерации',
+    ),
+    'yatube_thumbnails_generated_total': (
+        'counter',
+        'Миниатюры, созданные фоновым пулом',
+    ),
+}
+# События запроса (core.timing.count_event) по кэшам и результатам.
+CACHE_EVENTS: Dict[str, Tuple[str, str]] = {
+    'cache_hits': ('default', 'hit'),
+    'cache_misses': ('default', 'miss'),
+    'kvstore_hits': ('thumbnail_kvstore', 'hit'),
+    'kvstore_misses': ('thumbnail_kvstore', 'miss'),
+}
+
+
+def _labels(labels: Labels) -> str:
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    )
+
+
+class MetricsStore:
+    """
+    Счетчики и гистограммы процесса с периодической записью в общий
+    файл METRICS_PATH.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Counter = Counter()
+        self._lock: threading.Lock = threading.Lock()
+        self._write_lock: threading.Lock = threading.Lock()
+        self._flushed_at: float = time.monotonic()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._key: Optional[Tuple[int, str]] = None
+        self._flusher_pid: Optional[int] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Соединение процесса с файлом метрик."""
+        path: str = settings.METRICS_PATH
+        if self._key != (os.getpid(), path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            connection = sqlite3.connect(
+                path,
+                timeout=settings.METRICS_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+                'name TEXT NOT NULL, labels TEXT NOT NULL, '
+                'value REAL NOT NULL, PRIMARY KEY (name, labels)'
+                ') WITHOUT ROWID'
+            )
+            self._connection = connection
+            self._key = (os.getpid(), path)
+        return self._connection
+
+    def _start_flusher(self) -> None:
+        # Поток после fork не наследуется, поэтому запускается в каждом
+        # процессе, записывающем метрики.
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(
+            target=self._flush_periodically,
+            name='metrics',
+            daemon=True,
+        ).start()
+        atexit.register(self.flush, force=True)
+
+    def _flush_periodically(self) -> None:
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush(force=True)
+            except Exception:
+                logger.exception('Не удалось записать метрики')
+
+    def inc(self, name: str, labels: Labels, amount: float = 1) -> None:
+        """Увеличивает счетчик."""
+        with self._lock:
+            self._start_flusher()
+            self._pending[(name, _labels(labels))] += amount
+
+    def observe(self, name: str, labels: Labels, value: float,
+                buckets: Iterable[float]) -> None:
+        """Добавляет наблюдение в гистограмму с границами buckets."""
+        with self._lock:
+            self._start_flusher()
+            for bound in (*buckets, math.inf):
+                if value <= bound:
+                    self._pending[(
+                        f'{name}_bucket',
+                        _labels({**labels, 'le': _format_value(bound)}),
+                    )] += 1
+            self._pending[(f'{name}_sum', _labels(labels))] += value
+            self._pending[(f'{name}_count', _labels(labels))] += 1
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Записывает накопленные приращения в общий файл, если с прошлой
+        записи прошло METRICS_FLUSH_INTERVAL секунд.
+
+        Ошибки записи не прерывают обработку запроса: приращения
+        остаются в памяти до следующей попытки.
+        """
+        with self._lock:
+            interval: float = time.monotonic() - self._flushed_at
+            if not self._pending or (
+                not force and interval < settings.METRICS_FLUSH_INTERVAL
+            ):
+                return
+            pending: Counter = self._pending
+            self._pending = Counter()
+            self._flushed_at = time.monotonic()
+        try:
+            self._write(pending)
+        except sqlite3.Error:
+            logger.exception('Не удалось записать метрики')
+            with self._lock:
+                self._pending.update(pending)
+
+    def _write(self, pending: Counter) -> None:
+        with self._write_lock:
+            connection: sqlite3.Connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(
+                    f'INSERT INTO {TABLE} (name, labels, value) '
+                    'VALUES (?, ?, ?) ON CONFLICT (name, labels) '
+                    'DO UPDATE SET value = value + excluded.value',
+                    [
+                        (name, labels, value)
+                        for (name, labels), value in pending.items()
+                    ],
+                )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def collect(self) -> Dict[Series, float]:
+        """Возвращает значения метрик всех воркеров."""
+        self.flush(force=True)
+        return self.read()
+
+    def read(self) -> Dict[Series, float]:
+        """Возвращает значения, уже записанные в общий файл."""
+        with self._write_lock:
+            rows = self.connection.execute(
+                f'SELECT name, labels, value FROM {TABLE}',
+            ).fetchall()
+        return {(name, labels): value for name, labels, value in rows}
+
+    def clear(self) -> None:
+        """Удаляет все метрики."""
+        with self._lock:
+            self._pending.clear()
+        with self._write_lock:
+            self.connection.execute(f'DELETE FROM {TABLE}')
+
+
+metrics = MetricsStore()
+
+
+def record_request(view: str, status: int, duration: float,
+                   timings: Any = None) -> None:
+    """
+    Записывает метрики обработанного запроса.
+
+    timings - замеры core.timing.RequestTimings, если они велись.
+    """
+    labels: Labels = {'view': view}
+    metrics.inc(
+        'yatube_http_requests_total',
+        {**labels, 'status': f'{status // 100}xx'},
+    )
+    metrics.observe(
+        'yatube_http_request_duration_seconds',
+        labels,
+        duration,
+        settings.METRICS_LATENCY_BUCKETS,
+    )
+    if timings is not None:
+        metrics.inc('yatube_db_queries_total', labels, timings.counts['db'])
+        for phase, seconds in timings.durations.items():
+            metrics.inc(
+                'yatube_request_phase_seconds_total',
+                {**labels, 'phase': phase},
+                seconds,
+            )
+        _record_events(labels, timings.events)
+    metrics.flush()
+
+
+def _record_events(labels: Labels, events: Counter) -> None:
+    for event, (cache, result) in CACHE_EVENTS.items():
+        if events[event]:
+            metrics.inc(
+                'yatube_cache_requests_total',
+                {**labels, 'cache': cache, 'result': result},
+                events[event],
+            )
+    if events['thumbnails_queued']:
+        metrics.inc(
+            'yatube_thumbnails_queued_total',
+            labels,
+            events['thumbnails_queued'],
+        )
+
+
+def _hit_ratios(values: Dict[Series, float]) -> Dict[Series, float]:
+    reads: Dict[str, Counter] = defaultdict(Counter)
+    for (name, labels), value in values.items():
+        if name != 'yatube_cache_requests_total':
+            continue
+        pairs: Labels = dict(json.loads(labels))
+        result: str = pairs.pop('result')
+        reads[_labels(pairs)][result] += value
+    return {
+        ('yatube_cache_hit_ratio', labels): (
+            counts['hit'] / (counts['hit'] + counts['miss'])
+        )
+        for labels, counts in reads.items()
+    }
+
+
+def _family(name: str) -> str:
+    for suffix in ('_bucket', '_sum', '_count'):
+        base: str = name[:-len(suffix)]
+        if name.endswith(suffix) and METRICS.get(base, ('',))[0] == (
+            'histogram'
+        ):
+            return base
+    return name
+
+
+def _sort_key(series: Series) -> Tuple[str, List[List[str]], float]:
+    # Границы гистограммы сортируются как числа, а не как строки.
+    name, labels = series
+    pairs: List[List[str]] = json.loads(labels)
+    bound: float = float(dict(pairs).get('le', 0))
+    return name, [pair for pair in pairs if pair[0] != 'le'], bound
+
+
+def render(values: Dict[Series, float]) -> str:
+    """Возвращает метрики в текстовом формате Prometheus."""
+    values = {**values, **_hit_ratios(values)}
+    families: Dict[str, List[Series]] = defaultdict(list)
+    for series in sorted(values, key=_sort_key):
+        families[_family(series[0])].append(series)
+
+    lines: List[str] = []
+    for family in sorted(families):
+        kind, description = METRICS.get(family, ('untyped', ''))
+        lines.append(f'# HELP {family} {description}')
+        lines.append(f'# TYPE {family} {kind}')
+        for name, labels in families[family]:
+            pairs: str = ','.join(
+                f'{key}="{_escape(value)}"'
+                for key, value in json.loads(labels)
+            )
+            series: str = f'{name}{{{pairs}}}' if pairs else name
+            lines.append(
+                f'{series} {_format_value(values[(name, labels)])}'
+            )
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,137 @@
+import json
+import logging
+import random
+from contextlib import ExitStack
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+from .metrics import record_request
+from .queries import (MAX_SQL_LENGTH, QueryRecorder, RepeatedQuery,
+                      find_repeated)
+from .timing import RequestTimings, collect, get_current, time_query
+
+logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger('core.timing')
+
+
+def _view_name(request: HttpRequest) -> Optional[str]:
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else None
+
+
+class RepeatedQueriesError(Exception):
+    """Запрос к странице выполнил одинаковые SQL-запросы в цикле."""
+
+
+class RepeatedQueriesMiddleware:
+    """
+    Ищет в запросах к страницам повторяющиеся SQL-запросы (N+1).
+
+    Для доли запросов NPLUSONE_SAMPLE_RATE записывает SQL-запросы с
+    местом вызова. Если один запрос с разными параметрами выполнен из
+    одного места (строки шаблона или кода) больше NPLUSONE_THRESHOLD
+    раз, пишет предупреждение в лог, а при NPLUSONE_RAISE выбрасывает
+    RepeatedQueriesError, как это происходит в тестах.
+    """
+
+    def __init__(self,
+                 get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if random.random() >= settings.NPLUSONE_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response: HttpResponse = self.get_response(request)
+        repeated: List[RepeatedQuery] = find_repeated(
+            recorder.queries,
+            settings.NPLUSONE_THRESHOLD,
+        )
+        if repeated:
+            self.report(request, repeated)
+        return response
+
+    def report(self, request: HttpRequest,
+               repeated: List[RepeatedQuery]) -> None:
+        """Сообщает о повторяющихся запросах страницы."""
+        view_name: Optional[str] = _view_name(request)
+        message: str = '\n'.join(
+            [f'Повторяющиеся запросы в {view_name or request.path}:']
+            + [
+                f'{count}x из {query.origin}: {query.sql[:MAX_SQL_LENGTH]}'
+                for count, query in repeated
+            ]
+        )
+        if settings.NPLUSONE_RAISE:
+            raise RepeatedQueriesError(message)
+        logger.warning(message, extra={'view_name': view_name})
+
+
+class ServerTimingMiddleware:
+    """
+    Замеряет фазы обработки запроса (см. core.timing).
+
+    Длительности фаз отдаются в заголовке Server-Timing, если включена
+    настройка SERVER_TIMING_HEADER, и пишутся в лог core.timing строкой
+    JSON с именем представления view_name.
+    """
+
+    def __init__(self,
+                 get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with collect() as timings, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(time_query))
+            response: HttpResponse = self.get_response(request)
+
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = timings.header()
+        self.log(request, response, timings)
+        return response
+
+    def log(self, request: HttpRequest, response: HttpResponse,
+            timings: RequestTimings) -> None:
+        """Пишет замеры запроса в лог."""
+        if not timing_logger.isEnabledFor(logging.INFO):
+            return
+        record: Dict[str, Any] = {
+            'view_name': _view_name(request),
+            'method': request.method,
+            'status': response.status_code,
+            **timings.as_dict(),
+        }
+        timing_logger.info(
+            json.dumps(record, ensure_ascii=False, sort_keys=True),
+            extra=record,
+        )
+
+
+class MetricsMiddleware:
+    """
+    Пишет метрики запроса (см. core.metrics) с меткой представления.
+
+    Должен стоять после ServerTimingMiddleware, чтобы получить замеры
+    фаз текущего запроса.
+    """
+
+    def __init__(self,
+                 get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        started: float = perf_counter()
+        response: HttpResponse = self.get_response(request)
+        record_request(
+            _view_name(request) or 'unresolved',
+            response.status_code,
+            perf_counter() - started,
+            get_current(),
+        )
+        return response
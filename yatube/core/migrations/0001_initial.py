@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('size', models.PositiveIntegerField(verbose_name='Размер в байтах')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Дата сохранения')),
+            ],
+            options={
+                'verbose_name': 'Файл хранилища',
+                'verbose_name_plural': 'Файлы хранилища',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import models
+
+
+class StoredFile(models.Model):
+    """Файл хранилища с адресацией по содержимому и ссылки на него"""
+
+    name = models.CharField(
+        verbose_name='Имя файла',
+        max_length=255,
+        unique=True,
+    )
+
+    size = models.PositiveIntegerField(
+        verbose_name='Размер в байтах',
+    )
+
+    references = models.PositiveIntegerField(
+        verbose_name='Количество ссылок',
+        default=0,
+    )
+
+    created = models.DateTimeField(
+        verbose_name='Дата сохранения',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        verbose_name = 'Файл хранилища'
+        verbose_name_plural = 'Файлы хранилища'
+
+    def __str__(self) -> str:
+        """Строковое представление файла хранилища"""
+        return f'{self.name}: {self.references}'
@@ -0,0 +1,234 @@
+"""
+Запись SQL-запросов с местом их вызова.
+
+QueryRecorder подключается к соединению через execute_wrapper и для
+каждого запроса запоминает текст, отпечаток (текст без литералов и с
+свернутыми списками IN) и место вызова: строку шаблона, тег или
+переменная которого выполнили запрос, и ближайшую строку кода проекта.
+По отпечаткам одинаковые запросы с разными параметрами собираются в
+группы, что позволяет находить запросы в цикле (N+1): find_repeated
+возвращает запросы, повторенные из одного места больше заданного числа
+раз.
+"""
+import os
+import re
+import sys
+from collections import Counter, OrderedDict
+from types import FrameType
+from typing import (Any, Callable, Dict, List, NamedTuple, Optional,
+                    Sequence, Tuple)
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import timing
+
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+IN_LIST = re.compile(r'\bIN \((?:(?:%s|\?)(?:, )?)+\)')
+SAVEPOINT = re.compile(r'SAVEPOINT "\w+"')
+SPACES = re.compile(r'\s+')
+INTERNAL_PACKAGES: Tuple[str, ...] = (
+    os.path.join('django', 'db', ''),
+    os.path.join('django', 'template', ''),
+    os.path.join('django', 'test', ''),
+)
+# Модули проекта, оборачивающие выполнение запросов и шаблонов.
+INTERNAL_MODULES: Tuple[str, ...] = (__file__, timing.__file__)
+# Сколько разных мест вызова показывать для одного отпечатка.
+MAX_ORIGINS: int = 3
+MAX_SQL_LENGTH: int = 300
+
+
+class RecordedQuery(NamedTuple):
+    sql: str
+    fingerprint: str
+    origin: str
+
+
+class RepeatedQuery(NamedTuple):
+    count: int
+    query: RecordedQuery
+
+
+class QueryBudget(NamedTuple):
+    """
+    Допустимое число запросов страницы на малом наборе данных и их
+    прирост при увеличении набора данных.
+    """
+
+    queries: int
+    growth: int = 0
+
+
+def normalize_sql(sql: str) -> str:
+    """Возвращает отпечаток запроса: текст без значений параметров."""
+    sql = SAVEPOINT.sub('SAVEPOINT ?', sql)
+    sql = LITERAL.sub('?', sql)
+    sql = IN_LIST.sub('IN (...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+def _template_line(frame: FrameType) -> Optional[str]:
+    if frame.f_code.co_name != 'render_annotated':
+        return None
+    node: Any = frame.f_locals.get('self')
+    origin: Any = getattr(node, 'origin', None)
+    token: Any = getattr(node, 'token', None)
+    if origin is None or token is None:
+        return None
+    return f'{origin.template_name or origin.name}:{token.lineno}'
+
+
+def _is_project(filename: str) -> bool:
+    return (
+        filename.startswith(settings.BASE_DIR)
+        and 'site-packages' not in filename
+    )
+
+
+def _is_internal(filename: str) -> bool:
+    # ORM, шаблонизатор, тестовый клиент, замеры core.timing и сам этот
+    # модуль не интересны как место вызова.
+    return filename in INTERNAL_MODULES or any(
+        package in filename for package in INTERNAL_PACKAGES
+    )
+
+
+def _frame_line(frame: FrameType) -> str:
+    filename: str = frame.f_code.co_filename
+    if _is_project(filename):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    else:
+        filename = filename.rpartition(f'site-packages{os.sep}')[2]
+    return f'{filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+
+
+def query_origin() -> str:
+    """
+    Возвращает место выполнения запроса: строку шаблона, если запрос
+    выполнен при его отрисовке, ближайший к запросу код вне ORM
+    (например, бэкенд сессий) и ближайшую строку кода проекта.
+    """
+    lines: List[str] = []
+    caller: Optional[str] = None
+    frame: Optional[FrameType] = sys._getframe(1)
+    while frame is not None:
+        filename: str = frame.f_code.co_filename
+        template: Optional[str] = _template_line(frame)
+        if template is not None and not lines:
+            lines.append(template)
+        if caller is None and not _is_internal(filename):
+            caller = _frame_line(frame)
+        if _is_project(filename) and not _is_internal(filename):
+            lines.extend(dict.fromkeys((caller, _frame_line(frame))))
+            break
+        frame = frame.f_back
+    else:
+        lines.extend(filter(None, (caller,)))
+    return ', '.join(lines) or '?'
+
+
+class QueryRecorder:
+    """
+    Контекстный менеджер, записывающий запросы соединения using.
+
+    on_query вызывается после записи каждого запроса.
+    """
+
+    def __init__(self, using: str = DEFAULT_DB_ALIAS,
+                 on_query: Optional[Callable[[RecordedQuery], None]] = None
+                 ) -> None:
+        self.connection = connections[using]
+        self.on_query = on_query
+        self.queries: List[RecordedQuery] = []
+
+    def __call__(self, execute: Callable, sql: str, params: Any,
+                 many: bool, context: Dict[str, Any]) -> Any:
+        query = RecordedQuery(sql, normalize_sql(sql), query_origin())
+        self.queries.append(query)
+        if self.on_query is not None:
+            self.on_query(query)
+        return execute(sql, params, many, context)
+
+    def __enter__(self) -> 'QueryRecorder':
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._wrapper.__exit__(*exc_info)
+
+    def __len__(self) -> int:
+        return len(self.queries)
+
+
+def find_repeated(queries: Sequence[RecordedQuery],
+                  threshold: int) -> List[RepeatedQuery]:
+    """
+    Возвращает запросы с одинаковыми отпечатком и местом вызова,
+    выполненные больше threshold раз, начиная с самых частых.
+    """
+    counts: Counter = Counter(
+        (query.fingerprint, query.origin) for query in queries
+    )
+    first: Dict[Tuple[str, str], RecordedQuery] = {}
+    for query in queries:
+        first.setdefault((query.fingerprint, query.origin), query)
+    return [
+        RepeatedQuery(count, first[key])
+        for key, count in counts.most_common()
+        if count > threshold
+    ]
+
+
+def format_queries(queries: Sequence[RecordedQuery],
+                   baseline: Sequence[RecordedQuery] = ()) -> str:
+    """
+    Перечисляет запросы, сгруппированные по отпечаткам, с местами
+    вызова. Первыми идут запросы, число которых больше всего выросло
+    относительно baseline, затем самые частые.
+    """
+    groups: 'OrderedDict[str, List[RecordedQuery]]' = OrderedDict()
+    for query in queries:
+        groups.setdefault(query.fingerprint, []).append(query)
+    before: Counter = Counter(query.fingerprint for query in baseline)
+
+    lines: List[str] = []
+    for fingerprint, group in sorted(
+        groups.items(),
+        key=lambda item: (
+            before[item[0]] - len(item[1]),
+            -len(item[1]),
+        ),
+    ):
+        count: str = f'{len(group)}x'
+        if baseline and before[fingerprint] != len(group):
+            count += f' (было {before[fingerprint]})'
+        lines.append(f'{count} {group[0].sql[:MAX_SQL_LENGTH]}')
+        origins: List[str] = list(OrderedDict.fromkeys(
+            query.origin for query in group
+        ))
+        lines.extend(f'    {origin}' for origin in origins[:MAX_ORIGINS])
+    return '\n'.join(lines)
+
+
+def check_budget(budget: QueryBudget, small: Sequence[RecordedQuery],
+                 large: Sequence[RecordedQuery]) -> Optional[str]:
+    """
+    Сверяет запросы страницы на малом и большом наборах данных с
+    бюджетом и возвращает отчет о превышении или None.
+    """
+    problems: List[str] = []
+    if len(small) > budget.queries:
+        problems.append(
+            f'{len(small)} запросов при бюджете {budget.queries}'
+        )
+    growth: int = len(large) - len(small)
+    if growth > budget.growth:
+        problems.append(
+            f'с ростом данных +{growth} запросов, допустимо '
+            f'+{budget.growth}'
+        )
+    if not problems:
+        return None
+    return '; '.join(problems) + '\n' + format_queries(large, small)
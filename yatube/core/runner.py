@@ -0,0 +1,73 @@
+import copy
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .background import drain
+from .metrics import metrics
+
+
+def get_caches(cache_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Возвращает настройку CACHES с файловыми кэшами в cache_dir."""
+    caches: Dict[str, Dict[str, Any]] = copy.deepcopy(settings.CACHES)
+    for config in caches.values():
+        location: str = config.get('LOCATION', '')
+        if os.path.isabs(location):
+            config['LOCATION'] = os.path.join(
+                cache_dir,
+                os.path.relpath(location, settings.BASE_DIR),
+            )
+    return caches
+
+
+@contextmanager
+def isolated_settings() -> Iterator[str]:
+    """
+    Настройки тестов: каждый запрос к страницам проверяется на
+    повторяющиеся SQL-запросы, фоновые задачи выполняются сразу,
+    а файловые кэши, хранилище ключей миниатюр, файл метрик и загрузки
+    переносятся во временный каталог, который возвращается и удаляется
+    в конце.
+
+    Используется раннером manage.py test и tests/conftest.py.
+    """
+    cache_dir: str = tempfile.mkdtemp(prefix='yatube-tests-')
+    overrides = override_settings(
+        NPLUSONE_SAMPLE_RATE=1.0,
+        NPLUSONE_RAISE=True,
+        BACKGROUND_TASKS_EAGER=True,
+        CACHES=get_caches(cache_dir),
+        THUMBNAIL_KVSTORE_PATH=os.path.join(cache_dir, 'thumbnails.sqlite3'),
+        METRICS_PATH=os.path.join(cache_dir, 'metrics.sqlite3'),
+        MEDIA_ROOT=os.path.join(cache_dir, 'media'),
+    )
+    overrides.enable()
+    try:
+        yield cache_dir
+    finally:
+        # Задачи тестов, включивших пул, не должны писать в удаленный
+        # каталог.
+        drain()
+        # Иначе остаток метрик запишется при выходе в настоящий файл.
+        metrics.flush(force=True)
+        overrides.disable()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    """Раннер тестов с настройками isolated_settings."""
+
+    def setup_test_environment(self, **kwargs: Any) -> None:
+        super().setup_test_environment(**kwargs)
+        self.isolated_settings = isolated_settings()
+        self.isolated_settings.__enter__()
+
+    def teardown_test_environment(self, **kwargs: Any) -> None:
+        self.isolated_settings.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,16 @@
+"""Сессии в базе данных с замером загрузки и сохранения."""
+from typing import Any, Dict
+
+from django.contrib.sessions.backends import db
+
+from .timing import timed
+
+
+class SessionStore(db.SessionStore):
+    def load(self) -> Dict[str, Any]:
+        with timed('session'):
+            return super().load()
+
+    def save(self, must_create: bool = False) -> None:
+        with timed('session'):
+            super().save(must_create)
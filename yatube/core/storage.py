@@ -0,0 +1,128 @@
+"""
+Хранилище загруженных файлов с адресацией по содержимому.
+
+Файлы из каталогов MEDIA_CONTENT_ADDRESSED_DIRS сохраняются под именем,
+равным SHA-256 содержимого, во вложенных каталогах по первым символам
+хеша (posts/ab/cd/abcd....webp): одинаковые загрузки занимают одно
+место на диске и имеют общие миниатюры, а каталоги остаются небольшими.
+Количество ссылок на каждый файл хранится в StoredFile; приложения
+увеличивают и уменьшают его функциями acquire_file и release_file,
+а файл без ссылок удаляется вместе с миниатюрами после фиксации
+транзакции. Остальные файлы (миниатюры sorl-thumbnail и т.п.)
+сохраняются как в FileSystemStorage.
+"""
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import F
+
+from .models import StoredFile
+from .thumbnails import delete_thumbnails
+
+CHUNK_SIZE: int = 64 * 1024
+
+
+def content_hash(content: File) -> str:
+    """Возвращает SHA-256 содержимого файла."""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, именующее загрузки по их содержимому."""
+
+    def is_content_addressed(self, name: str) -> bool:
+        """Проверяет, хранится ли файл name по хешу содержимого."""
+        return name.replace('\\', '/').startswith(
+            tuple(settings.MEDIA_CONTENT_ADDRESSED_DIRS)
+        )
+
+    def get_content_name(self, name: str, digest: str) -> str:
+        """Возвращает имя файла с хешем digest в каталоге файла name."""
+        directory, filename = os.path.split(name)
+        extension: str = os.path.splitext(filename)[1].lower()
+        return '/'.join((
+            directory,
+            digest[:2],
+            digest[2:4],
+            f'{digest}{extension}',
+        ))
+
+    def _save(self, name: str, content: File) -> str:
+        if not self.is_content_addressed(name):
+            return super()._save(name, content)
+        name = self.get_content_name(name, content_hash(content))
+        if self.exists(name):
+            # Повторно использованный файл считается новым, чтобы
+            # сборщик мусора (collect_media) не удалил его до того,
+            # как на него сошлется сохраняемый пост.
+            os.utime(self.path(name))
+        else:
+            self._save_once(name, content)
+        StoredFile.objects.get_or_create(
+            name=name,
+            defaults={'size': content.size},
+        )
+        return name
+
+    def _save_once(self, name: str, content: File) -> None:
+        # Файл пишется под временным именем и появляется под
+        # постоянным атомарно; если одновременно сохраняли то же
+        # содержимое, остается первая копия.
+        temporary: str = super()._save(
+            f'{name}.{uuid.uuid4().hex}.tmp',
+            content,
+        )
+        try:
+            os.link(self.path(temporary), self.path(name))
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(self.path(temporary))
+
+
+def acquire_file(name: str) -> None:
+    """Увеличивает количество ссылок на файл хранилища."""
+    StoredFile.objects.filter(name=name).update(
+        references=F('references') + 1,
+    )
+
+
+def release_file(name: str) -> None:
+    """
+    Уменьшает количество ссылок на файл хранилища.
+
+    Файл без ссылок и его миниатюры удаляются после фиксации
+    транзакции.
+    """
+    released: int = StoredFile.objects.filter(
+        name=name,
+        references__gt=0,
+    ).update(references=F('references') - 1)
+    if released:
+        transaction.on_commit(lambda: delete_unreferenced(name))
+
+
+def delete_unreferenced(name: str) -> bool:
+    """
+    Удаляет файл с миниатюрами, если на него не осталось ссылок.
+
+    Возвращает True, если файл удален.
+    """
+    deleted, _ = StoredFile.objects.filter(name=name, references=0).delete()
+    if not deleted:
+        return False
+    delete_thumbnails(name)
+    default_storage.delete(name)
+    return True
@@ -0,0 +1,100 @@
+from typing import Any, List, Optional
+
+from django import template
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.template import (Context, Library, Node, NodeList,
+                             TemplateSyntaxError, VariableDoesNotExist)
+from django.template.base import FilterExpression, Parser, Token
+
+from ..cache import get_or_recompute
+
+register: Library = template.Library()
+
+
+class FragmentCacheNode(Node):
+    """Фрагмент шаблона, кэшируемый через get_or_recompute."""
+
+    def __init__(self, nodelist: NodeList,
+                 expire_time_var: FilterExpression, fragment_name: str,
+                 vary_on: List[FilterExpression],
+                 cache_name: Optional[FilterExpression]) -> None:
+        self.nodelist = nodelist
+        self.expire_time_var = expire_time_var
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+        self.cache_name = cache_name
+
+    def resolve(self, expression: FilterExpression, context: Context) -> Any:
+        try:
+            return expression.resolve(context)
+        except VariableDoesNotExist:
+            raise TemplateSyntaxError(
+                f'"fragmentcache" tag got an unknown variable: '
+                f'{expression.var!r}'
+            )
+
+    def render(self, context: Context) -> str:
+        expire_time = self.resolve(self.expire_time_var, context)
+        if expire_time is not None:
+            try:
+                expire_time = int(expire_time)
+            except (ValueError, TypeError):
+                raise TemplateSyntaxError(
+                    f'"fragmentcache" tag got a non-integer timeout value: '
+                    f'{expire_time!r}'
+                )
+        if self.cache_name:
+            cache_name = self.resolve(self.cache_name, context)
+            try:
+                caches[cache_name]
+            except InvalidCacheBackendError:
+                raise TemplateSyntaxError(
+                    f'Invalid cache name specified for fragmentcache tag: '
+                    f'{cache_name!r}'
+                )
+        else:
+            cache_name = 'default'
+
+        vary_on = [self.resolve(var, context) for var in self.vary_on]
+        # Значения хранятся вместе со сроком свежести, поэтому ключи
+        # не должны совпадать с ключами тега cache.
+        return get_or_recompute(
+            'stale.' + make_template_fragment_key(
+                self.fragment_name,
+                vary_on,
+            ),
+            lambda: self.nodelist.render(context),
+            expire_time,
+            using=cache_name,
+        )
+
+
+@register.tag('fragmentcache')
+def do_fragment_cache(parser: Parser, token: Token) -> FragmentCacheNode:
+    """
+    Кэширует фрагмент шаблона с защитой от одновременного пересчета.
+
+    Аргументы те же, что у тега cache:
+    {% fragmentcache timeout name [var1 var2 ...] [using="cache"] %}
+    ...
+    {% endfragmentcache %}
+    """
+    nodelist: NodeList = parser.parse(('endfragmentcache',))
+    parser.delete_first_token()
+    tokens: List[str] = token.split_contents()
+    if len(tokens) < 3:
+        raise TemplateSyntaxError(
+            f'{tokens[0]!r} tag requires at least 2 arguments.'
+        )
+    cache_name: Optional[FilterExpression] = None
+    if len(tokens) > 3 and tokens[-1].startswith('using='):
+        cache_name = parser.compile_filter(tokens[-1][len('using='):])
+        tokens = tokens[:-1]
+    return FragmentCacheNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(token) for token in tokens[3:]],
+        cache_name,
+    )
@@ -0,0 +1,81 @@
+import logging
+from typing import Any, List, Optional, Tuple
+
+from django import template
+from django.template import Library
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from ..thumbnails import (Preset, get_preset, get_thumbnail_size,
+                          get_variants, schedule_thumbnails)
+
+logger = logging.getLogger(__name__)
+
+register: Library = template.Library()
+
+
+@register.simple_tag
+def preset_thumbnail(file_: Any, preset: str) -> Optional[ImageFile]:
+    """
+    Возвращает миниатюру изображения по имени пресета.
+
+    Использование: {% preset_thumbnail post.image "post_card" as im %}
+    """
+    if not file_:
+        return None
+    geometry_string, options = get_preset(preset)
+    try:
+        return default.backend.get_thumbnail(
+            file_,
+            geometry_string,
+            **options,
+        )
+    except Exception:
+        logger.exception('Не удалось получить миниатюру %s', file_)
+        return None
+
+
+@register.simple_tag
+def preset_srcset(file_: Any, preset: str) -> str:
+    """
+    Возвращает значение атрибута srcset из готовых копий пресета.
+
+    Использование: {% preset_srcset post.image "post_card" as srcset %}
+    Недостающие копии ставятся в очередь и попадают в srcset, когда
+    будут созданы.
+    """
+    if not file_:
+        return ''
+    source: ImageFile = ImageFile(file_)
+    candidates: List[str] = []
+    missing: List[Preset] = []
+    for geometry_string, options in get_variants(preset):
+        thumbnail: Optional[ImageFile] = (
+            default.backend.get_ready_thumbnail(
+                source,
+                geometry_string,
+                options,
+            )
+        )
+        if thumbnail is None:
+            missing.append((geometry_string, options))
+        else:
+            candidates.append(f'{thumbnail.url} {thumbnail.width}w')
+    if missing:
+        schedule_thumbnails(source.name, missing)
+    return ', '.join(candidates)
+
+
+@register.simple_tag
+def preset_size(width: Optional[int], height: Optional[int],
+                preset: str) -> Optional[Tuple[int, int]]:
+    """
+    Возвращает размер миниатюры по сохраненным размерам оригинала.
+
+    Использование:
+    {% preset_size post.image_width post.image_height "post_card" as size %}
+    Если размеры оригинала неизвестны, возвращает None.
+    """
+    if not width or not height:
+        return None
+    return get_thumbnail_size(get_preset(preset), width, height)
@@ -0,0 +1,891 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.template import Context, Template, engines
+from django.http import HttpResponse
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.urls import path
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .background import drain, submit
+from .cache import TieredCache, get_or_recompute
+from .kvstore import SQLiteKVStore
+from .metrics import MetricsStore, metrics
+from .middleware import RepeatedQueriesError, RepeatedQueriesMiddleware
+from .models import StoredFile
+from .queries import (QueryBudget, QueryRecorder, check_budget,
+                      find_repeated, normalize_sql)
+from .storage import ContentAddressedStorage, delete_unreferenced
+from .thumbnails import (generate_thumbnail, get_presets, get_thumbnail_size,
+                         get_variants)
+from .timing import collect, get_current, timed
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stampede-tests',
+    },
+}
+
+
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return TieredCache(self.location, {
+            'TIMEOUT': 60,
+            'OPTIONS': {
+                'LOCAL_MAX_ENTRIES': 2,
+                'LOCAL_TIMEOUT': 5,
+                **options,
+            },
+        })
+
+    def test_values_are_shared_between_processes(self):
+        """
+        Значение, записанное одним воркером, читается другим
+        через общий уровень.
+        """
+        self.cache.set('key', {'value': 1})
+        other_worker_cache = self.make_cache()
+
+        self.assertEqual(other_worker_cache.get('key'), {'value': 1})
+        self.assertEqual(other_worker_cache.stats()['shared_hits'], 1)
+
+        self.assertEqual(other_worker_cache.get('key'), {'value': 1})
+        self.assertEqual(other_worker_cache.stats()['local_hits'], 1)
+
+    def test_local_tier_is_bounded_lru(self):
+        """
+        Локальный уровень вытесняет давно не читавшиеся ключи.
+        """
+        self.cache.set('first', 1)
+        self.cache.set('second', 2)
+        self.cache.get('first')
+        self.cache.set('third', 3)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['local_evictions'], 1)
+        self.assertEqual(stats['local_entries'], 2)
+
+        self.assertEqual(self.cache.get('second'), 2)
+        self.assertEqual(self.cache.stats()['shared_hits'], 1)
+
+    def test_local_values_expire(self):
+        """
+        Локальная копия живет не дольше LOCAL_TIMEOUT.
+        """
+        self.cache.set('key', 'old')
+        self.make_cache().set('key', 'new')
+        self.assertEqual(self.cache.get('key'), 'old')
+
+        with mock.patch('core.cache.time.monotonic', return_value=10 ** 9):
+            self.assertEqual(self.cache.get('key'), 'new')
+
+    def test_delete_and_miss(self):
+        """
+        Удаленный ключ считается промахом.
+        """
+        self.cache.set('key', 'value')
+        self.cache.delete('key')
+
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['hit_ratio'], 0.0)
+
+    def test_add_is_atomic_between_processes(self):
+        """
+        Из нескольких воркеров, одновременно добавляющих ключ,
+        его добавляет только один.
+        """
+        workers = [self.make_cache() for _ in range(4)]
+        barrier = threading.Barrier(len(workers))
+        results = []
+
+        def add(cache):
+            has_key = cache.shared.has_key
+
+            def slow_has_key(*args, **kwargs):
+                found = has_key(*args, **kwargs)
+                time.sleep(0.05)
+                return found
+
+            barrier.wait()
+            with mock.patch.object(cache.shared, 'has_key', slow_has_key):
+                results.append(cache.add('lock', True, 10))
+
+        threads = [
+            threading.Thread(target=add, args=(cache,)) for cache in workers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [False, False, False, True])
+        self.assertFalse(self.cache.add('lock', False, 10))
+        self.cache.delete('lock')
+        self.assertTrue(self.cache.add('lock', True, 10))
+
+    def test_abandoned_add_lock_is_ignored(self):
+        """
+        Блокировка add, брошенная упавшим воркером, не мешает добавлению.
+        """
+        lock_path = self.cache.shared._key_to_file(
+            self.cache.make_key('key'),
+        ) + '.lock'
+        open(lock_path, 'w').close()
+        self.assertFalse(self.cache.add('key', 'value'))
+
+        os.utime(lock_path, (0, 0))
+        self.assertTrue(self.cache.add('key', 'value'))
+        self.assertEqual(self.make_cache().get('key'), 'value')
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    CACHE_STALE_TIMEOUT=60,
+    CACHE_LOCK_TIMEOUT=5,
+    CACHE_EARLY_REFRESH_BETA=0,
+)
+class GetOrRecomputeTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches['default']
+        self.cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f'value {self.calls}'
+
+    def test_fresh_value_is_not_recomputed(self):
+        """
+        Свежее значение вычисляется один раз.
+        """
+        for _ in range(3):
+            self.assertEqual(
+                get_or_recompute('key', self.compute, 60),
+                'value 1',
+            )
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_is_served_during_recompute(self):
+        """
+        Пока другой воркер пересчитывает значение, отдается устаревшее.
+        """
+        get_or_recompute('key', self.compute, 60)
+        self.cache.add('key:lock', True)
+        stale_time = time.time() + 90
+
+        with mock.patch('core.cache.time.time', return_value=stale_time):
+            self.assertEqual(
+                get_or_recompute('key', self.compute, 60),
+                'value 1',
+            )
+        self.assertEqual(self.calls, 1)
+
+        self.cache.delete('key:lock')
+        with mock.patch('core.cache.time.time', return_value=stale_time):
+            self.assertEqual(
+                get_or_recompute('key', self.compute, 60),
+                'value 2',
+            )
+
+    def test_early_refresh(self):
+        """
+        При большом beta значение обновляется до устаревания.
+        """
+        def slow_compute():
+            time.sleep(0.01)
+            return self.compute()
+
+        get_or_recompute('key', slow_compute, 60)
+
+        with mock.patch('core.cache.random.random', return_value=0.5):
+            self.assertEqual(
+                get_or_recompute('key', self.compute, 60, beta=10 ** 9),
+                'value 2',
+            )
+
+    def test_concurrent_misses_compute_once(self):
+        """
+        При одновременных промахах значение вычисляет один воркер.
+        """
+        started = threading.Event()
+
+        def slow_compute():
+            started.set()
+            time.sleep(0.2)
+            return self.compute()
+
+        results = []
+        workers = [
+            threading.Thread(
+                target=lambda: results.append(
+                    get_or_recompute('key', slow_compute, 60)
+                ),
+            )
+            for _ in range(4)
+        ]
+        workers[0].start()
+        started.wait()
+        for worker in workers[1:]:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['value 1'] * 4)
+
+    def test_fragment_cache_tag(self):
+        """
+        Тег fragmentcache кэширует фрагмент так же, как тег cache.
+        """
+        template = Template(
+            '{% load fragment_cache %}'
+            '{% fragmentcache 60 fragment key %}{{ value }}'
+            '{% endfragmentcache %}'
+        )
+
+        self.assertEqual(
+            template.render(Context({'key': 1, 'value': 'old'})),
+            'old',
+        )
+        self.assertEqual(
+            template.render(Context({'key': 1, 'value': 'new'})),
+            'old',
+        )
+        self.assertEqual(
+            template.render(Context({'key': 2, 'value': 'new'})),
+            'new',
+        )
+
+
+class SQLiteKVStoreTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, True)
+        kvstore_override = override_settings(
+            THUMBNAIL_KVSTORE_PATH=os.path.join(self.location, 'kv.sqlite3'),
+            THUMBNAIL_KVSTORE_LOCAL_TIMEOUT=60,
+        )
+        kvstore_override.enable()
+        self.addCleanup(kvstore_override.disable)
+        self.kvstore = SQLiteKVStore()
+
+    def test_values_are_shared_between_processes(self):
+        """
+        Значение, записанное одним воркером, читается другим из файла,
+        а повторно - из памяти процесса.
+        """
+        self.kvstore._set_raw('sorl-thumbnail||image||key', 'value')
+        other_worker_kvstore = SQLiteKVStore()
+
+        self.assertEqual(
+            other_worker_kvstore._get_raw('sorl-thumbnail||image||key'),
+            'value',
+        )
+        self.assertEqual(
+            other_worker_kvstore._get_raw('sorl-thumbnail||image||key'),
+            'value',
+        )
+        self.assertIsNone(other_worker_kvstore._get_raw('missing'))
+
+        stats = other_worker_kvstore.stats()
+        self.assertEqual(stats['store_hits'], 1)
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertAlmostEqual(stats['hit_ratio'], 2 / 3)
+
+    def test_missing_keys_are_not_cached(self):
+        """
+        Ключ, записанный другим воркером после промаха, виден сразу.
+        """
+        self.assertIsNone(self.kvstore._get_raw('key'))
+        SQLiteKVStore()._set_raw('key', 'value')
+
+        self.assertEqual(self.kvstore._get_raw('key'), 'value')
+
+    def test_find_and_clear_by_prefix(self):
+        """
+        clear удаляет только ключи sorl-thumbnail.
+        """
+        self.kvstore._set_raw('sorl-thumbnail||image||a', '1')
+        self.kvstore._set_raw('sorl-thumbnail||thumbnails||a', '2')
+        self.kvstore._set_raw('sorl_thumbnail_other', '3')
+
+        self.assertEqual(
+            sorted(self.kvstore._find_keys_raw('sorl-thumbnail||image||')),
+            ['sorl-thumbnail||image||a'],
+        )
+        self.kvstore.clear()
+        self.assertEqual(self.kvstore.count(), 1)
+        self.assertIsNone(self.kvstore._get_raw('sorl-thumbnail||image||a'))
+
+    def test_warm_up_from_database(self):
+        """
+        Команда переносит ключи из таблицы sorl-thumbnail, не затирая
+        существующие.
+        """
+        KVStoreModel.objects.bulk_create([
+            KVStoreModel(key=f'sorl-thumbnail||image||{number}', value='db')
+            for number in range(5)
+        ])
+        default.kvstore._set_raw('sorl-thumbnail||image||0', 'store')
+        out = io.StringIO()
+
+        call_command('warm_thumbnail_kvstore', batch_size=2, stdout=out)
+
+        self.assertIn('записано: 4', out.getvalue())
+        self.assertEqual(
+            default.kvstore._get_raw('sorl-thumbnail||image||0'),
+            'store',
+        )
+        self.assertEqual(
+            default.kvstore._get_raw('sorl-thumbnail||image||4'),
+            'db',
+        )
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, True)
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def test_identical_uploads_are_stored_once(self):
+        """
+        Одинаковые файлы сохраняются один раз под именем по хешу
+        во вложенных каталогах.
+        """
+        first = self.storage.save('posts/a.JPG', ContentFile(b'same'))
+        second = self.storage.save('posts/b.jpg', ContentFile(b'same'))
+        other = self.storage.save('posts/c.jpg', ContentFile(b'other'))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(
+            first,
+            r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$',
+        )
+        self.assertEqual(
+            os.listdir(os.path.dirname(self.storage.path(first))),
+            [os.path.basename(first)],
+        )
+        self.assertEqual(StoredFile.objects.get(name=first).size, 4)
+
+    def test_other_directories_are_not_content_addressed(self):
+        """
+        Файлы вне MEDIA_CONTENT_ADDRESSED_DIRS сохраняются как есть.
+        """
+        self.assertEqual(
+            self.storage.save('cache/thumbnail.jpg', ContentFile(b'x')),
+            'cache/thumbnail.jpg',
+        )
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_unreferenced_files_are_deleted(self):
+        """
+        Файл удаляется, только когда на него не осталось ссылок.
+        """
+        name = self.storage.save('posts/a.jpg', ContentFile(b'data'))
+        StoredFile.objects.filter(name=name).update(references=1)
+
+        with override_settings(MEDIA_ROOT=self.location):
+            self.assertFalse(delete_unreferenced(name))
+            StoredFile.objects.filter(name=name).update(references=0)
+            self.assertTrue(delete_unreferenced(name))
+
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+
+class AsyncThumbnailBackendTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            THUMBNAIL_KVSTORE_PATH=os.path.join(
+                self.media_root,
+                'thumbnails.sqlite3',
+            ),
+        )
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+
+        image = io.BytesIO()
+        Image.new('RGB', (40, 20), 'red').save(image, 'JPEG')
+        self.name = default_storage.save(
+            'posts/original.jpg',
+            ContentFile(image.getvalue()),
+        )
+        self.template = Template(
+            '{% load thumbnail %}'
+            '{% thumbnail name "10x10" crop="center" as im %}'
+            '{{ im.url }}'
+            '{% endthumbnail %}'
+        )
+
+    def test_original_until_thumbnail_is_ready(self):
+        """
+        Пока миниатюры нет, рендеринг отдает исходное изображение
+        и ставит миниатюру в очередь.
+        """
+        with mock.patch('core.thumbnails.schedule_thumbnails') as schedule:
+            url = self.template.render(Context({'name': self.name}))
+
+        self.assertEqual(url, default_storage.url(self.name))
+        schedule.assert_called_once_with(
+            self.name,
+            [('10x10', {'crop': 'center'})],
+        )
+
+        thumbnail = generate_thumbnail(self.name, '10x10', {'crop': 'center'})
+        self.assertEqual(list(thumbnail.size), [10, 10])
+
+        with mock.patch('core.thumbnails.schedule_thumbnails') as schedule:
+            url = self.template.render(Context({'name': self.name}))
+        self.assertEqual(url, thumbnail.url)
+        schedule.assert_not_called()
+
+    def test_thumbnail_size_without_reading_file(self):
+        """
+        Размер миниатюры по размерам оригинала совпадает с размером
+        созданной миниатюры.
+        """
+        presets = [
+            ('10x10', {'crop': 'center'}),
+            ('30x30', {}),
+            ('100x100', {'upscale': False}),
+            ('80', {'upscale': True}),
+            ('x15', {'crop': 'bottom'}),
+        ]
+        for geometry_string, options in presets:
+            with self.subTest(geometry=geometry_string, options=options):
+                thumbnail = generate_thumbnail(
+                    self.name,
+                    geometry_string,
+                    options,
+                )
+                self.assertEqual(
+                    get_thumbnail_size((geometry_string, options), 40, 20),
+                    tuple(thumbnail.size),
+                )
+
+    @override_settings(
+        THUMBNAIL_PRESETS={
+            'card': ('960x339', {'crop': 'center'}),
+            'detail': ('960x339', {'crop': 'center'}),
+            'square': ('x100', {}),
+        },
+        THUMBNAIL_SRCSET_WIDTHS={
+            'card': (960, 320, 480, 2000),
+            'square': (50,),
+        },
+    )
+    def test_srcset_variants(self):
+        """
+        Копии для srcset сохраняют пропорции пресета и не шире его.
+        """
+        self.assertEqual(
+            get_variants('card'),
+            [
+                ('320x113', {'crop': 'center'}),
+                ('480x170', {'crop': 'center'}),
+                ('960x339', {'crop': 'center'}),
+            ],
+        )
+        self.assertEqual(get_variants('square'), [('x100', {})])
+        self.assertEqual(len(get_presets(['card', 'detail'])), 3)
+
+
+class BackgroundTasksTests(TestCase):
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_eager(self):
+        """
+        В режиме BACKGROUND_TASKS_EAGER задача выполняется сразу в текущем
+        потоке, а ее запросы не относятся к запросу к странице.
+        """
+        with QueryRecorder() as recorder:
+            future = submit(
+                'tests',
+                1,
+                lambda: (
+                    threading.current_thread(),
+                    get_user_model().objects.count(),
+                ),
+            )
+
+        self.assertEqual(future.result(), (threading.current_thread(), 0))
+        self.assertEqual(len(recorder), 0)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=False)
+    def test_drain(self):
+        """
+        drain ждет задачи пула, в том числе поставленные другими задачами.
+        """
+        done = []
+
+        def task(number):
+            time.sleep(0.05)
+            if number:
+                submit('tests', 1, task, number - 1)
+            done.append(number)
+
+        submit('tests', 1, task, 2)
+        drain()
+
+        self.assertEqual(done, [2, 1, 0])
+
+
+class QueryRecorderTests(TestCase):
+    def test_normalize_sql(self):
+        """
+        Отпечаток запроса не зависит от значений и длины списка IN.
+        """
+        self.assertEqual(
+            normalize_sql(
+                "SELECT * FROM t WHERE id IN (%s, %s, %s) AND  name = 'a'"
+                ' LIMIT 21'
+            ),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(
+            normalize_sql('RELEASE SAVEPOINT "s1405_x76"'),
+            'RELEASE SAVEPOINT ?',
+        )
+
+    def test_origin(self):
+        """
+        Для запроса из шаблона записываются строка шаблона и код,
+        который его отрисовал.
+        """
+        StoredFile.objects.create(name='posts/a.jpg', size=1)
+        template = Template(
+            '{% for file in files %}\n'
+            '{{ file.name }}\n'
+            '{% endfor %}'
+        )
+
+        with QueryRecorder() as recorder:
+            template.render(Context({'files': StoredFile.objects.all()}))
+
+        self.assertEqual(len(recorder), 1)
+        origin = recorder.queries[0].origin
+        self.assertTrue(origin.startswith('<unknown source>:1, '), origin)
+        self.assertIn('core/tests.py', origin)
+        self.assertIn('in test_origin', origin)
+
+    def test_check_budget(self):
+        """
+        Отчет о превышении бюджета начинается с запросов, число которых
+        растет вместе с данными.
+        """
+        def record(count):
+            with QueryRecorder() as recorder:
+                StoredFile.objects.count()
+                for number in range(count):
+                    StoredFile.objects.filter(pk=number).exists()
+            return recorder.queries
+
+        small, large = record(1), record(4)
+
+        self.assertIsNone(check_budget(QueryBudget(2, 3), small, large))
+        report = check_budget(QueryBudget(1), small, large)
+        self.assertTrue(report.startswith(
+            '2 запросов при бюджете 1; с ростом данных +3 запросов, '
+            'допустимо +0\n4x (было 1) SELECT (1) AS "a"'
+        ), report)
+        self.assertIn('in record', report)
+
+
+def _view_with_loop(request):
+    for number in range(4):
+        StoredFile.objects.filter(pk=number).exists()
+    StoredFile.objects.count()
+    return HttpResponse()
+
+
+def _view_with_template_loop(request):
+    template = engines.all()[0].from_string(
+        '{% for user in users %}\n'
+        '{{ user.follower.count }}\n'
+        '{% endfor %}'
+    )
+    return HttpResponse(template.render(
+        {'users': get_user_model().objects.order_by('pk')},
+        request,
+    ))
+
+
+urlpatterns = [
+    path('loop/', _view_with_template_loop),
+]
+
+
+@override_settings(NPLUSONE_THRESHOLD=3)
+class RepeatedQueriesMiddlewareTests(TestCase):
+    def setUp(self):
+        self.middleware = RepeatedQueriesMiddleware(_view_with_loop)
+        self.request = RequestFactory().get('/loop/')
+        self.request.resolver_match = None
+
+    def test_find_repeated(self):
+        """
+        Повторами считаются запросы с одним отпечатком из одного места.
+        """
+        with QueryRecorder() as recorder:
+            _view_with_loop(None)
+
+        repeated = find_repeated(recorder.queries, 3)
+
+        self.assertEqual(len(repeated), 1)
+        count, query = repeated[0]
+        self.assertEqual(count, 4)
+        self.assertIn('core/tests.py', query.origin)
+        self.assertIn('in _view_with_loop', query.origin)
+        self.assertEqual(find_repeated(recorder.queries, 4), [])
+
+    @override_settings(NPLUSONE_RAISE=True, NPLUSONE_SAMPLE_RATE=1.0)
+    def test_raise(self):
+        """
+        В тестах повторяющиеся запросы приводят к ошибке с местом
+        их выполнения.
+        """
+        with self.assertRaisesMessage(RepeatedQueriesError, '4x из '):
+            self.middleware(self.request)
+
+    @override_settings(NPLUSONE_RAISE=False, NPLUSONE_SAMPLE_RATE=1.0)
+    def test_log(self):
+        """
+        В продакшене о повторяющихся запросах пишется предупреждение.
+        """
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            response = self.middleware(self.request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/loop/', logs.output[0])
+        self.assertIn('in _view_with_loop', logs.output[0])
+
+    @override_settings(
+        NPLUSONE_RAISE=False,
+        NPLUSONE_SAMPLE_RATE=1.0,
+        ROOT_URLCONF=__name__,
+    )
+    def test_origin_through_middleware(self):
+        """
+        С замерами Server-Timing и шаблонным бэкендом core.timing местом
+        вызова считаются строка шаблона и представление.
+        """
+        for number in range(4):
+            get_user_model().objects.create_user(username=f'User{number}')
+
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            response = self.client.get('/loop/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            '4x из <unknown source>:2, core/tests.py:',
+            logs.output[0],
+        )
+        self.assertIn('in _view_with_template_loop', logs.output[0])
+        self.assertNotIn('core/timing.py', logs.output[0])
+
+    @override_settings(NPLUSONE_RAISE=True, NPLUSONE_SAMPLE_RATE=0.0)
+    def test_sampling(self):
+        """
+        Запросы, не попавшие в выборку, не проверяются.
+        """
+        response = self.middleware(self.request)
+
+        self.assertEqual(response.status_code, 200)
+
+
+class ServerTimingTests(TestCase):
+    def test_timed(self):
+        """
+        Фазы учитываются только внутри запроса и без повторного входа.
+        """
+        with timed('template'):
+            self.assertIsNone(get_current())
+
+        with collect() as timings:
+            with timed('template'):
+                with timed('template'):
+                    with timed('db'):
+                        pass
+
+        self.assertEqual(timings.counts, {'template': 1, 'db': 1})
+        self.assertGreaterEqual(
+            timings.total,
+            timings.durations['template'],
+        )
+        self.assertIsNone(get_current())
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_header_and_log(self):
+        """
+        Ответ содержит длительности SQL, шаблонов и сессии, а в лог
+        пишется строка JSON с именем представления.
+        """
+        client = Client()
+        client.force_login(
+            get_user_model().objects.create_user(username='Reader')
+        )
+
+        with self.assertLogs('core.timing', 'INFO') as logs:
+            response = client.get('/')
+
+        header = response['Server-Timing']
+        for metric in ('db;desc="SQL x', 'session;', 'template;', 'total;'):
+            self.assertIn(metric, header)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view_name'], 'posts:index')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['phases']['template']['count'], 1)
+        self.assertGreater(record['phases']['db']['count'], 0)
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_disabled(self):
+        """
+        Заголовок Server-Timing можно отключить.
+        """
+        self.assertNotIn('Server-Timing', Client().get('/about/tech/'))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        metrics_override = override_settings(
+            METRICS_PATH=os.path.join(self.location, 'metrics.sqlite3'),
+        )
+        metrics_override.enable()
+        self.addCleanup(metrics_override.disable)
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        metrics.clear()
+
+    def test_metrics(self):
+        """
+        /metrics отдает число запросов, гистограмму времени ответа,
+        SQL-запросы и долю попаданий в кэш по представлениям.
+        """
+        client = Client()
+        client.get('/')
+        client.get('/')
+        client.get('/about/tech/')
+        client.get('/missing/')
+
+        response = client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        for line in (
+            '# TYPE yatube_http_request_duration_seconds histogram',
+            'yatube_http_requests_total{status="2xx",view="posts:index"} 2',
+            'yatube_http_requests_total{status="2xx",view="about:tech"} 1',
+            'yatube_http_requests_total{status="4xx",view="unresolved"} 1',
+            'yatube_http_request_duration_seconds_bucket'
+            '{le="+Inf",view="posts:index"} 2',
+            'yatube_http_request_duration_seconds_count'
+            '{view="posts:index"} 2',
+            'yatube_cache_hit_ratio{cache="default",view="posts:index"} 0.5',
+        ):
+            self.assertIn(line + '\n', text)
+        self.assertRegex(
+            text,
+            r'yatube_db_queries_total\{view="posts:index"\} [1-9]',
+        )
+
+    def test_workers_aggregated(self):
+        """Счетчики разных процессов складываются в общем файле."""
+        worker = MetricsStore()
+        metrics.inc('yatube_thumbnails_generated_total', {'result': 'ok'})
+        worker.inc('yatube_thumbnails_generated_total', {'result': 'ok'}, 2)
+        worker.flush(force=True)
+
+        response = Client().get('/metrics')
+
+        self.assertIn(
+            'yatube_thumbnails_generated_total{result="ok"} 3\n',
+            response.content.decode(),
+        )
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0.01)
+    def test_flushed_without_requests(self):
+        """
+        Приращения из фоновых потоков записываются по таймеру, без
+        запросов к страницам.
+        """
+        worker = MetricsStore()
+        worker.inc('yatube_thumbnails_generated_total', {'result': 'ok'})
+
+        deadline = time.monotonic() + 5
+        while not worker.read() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(
+            list(worker.read().values()),
+            [1],
+        )
+
+    @override_settings(METRICS_ALLOWED_IPS=('10.0.0.1',))
+    def test_forbidden(self):
+        """Метрики недоступны с адресов не из METRICS_ALLOWED_IPS."""
+        self.assertEqual(Client().get('/metrics').status_code, 403)
+
+    def test_proxied_requests_forbidden(self):
+        """
+        Без токена запросы через обратный прокси не пропускаются:
+        REMOTE_ADDR у них - адрес прокси.
+        """
+        response = Client().get(
+            '/metrics',
+            HTTP_X_FORWARDED_FOR='203.0.113.5',
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        """С METRICS_TOKEN метрики отдаются только по токену."""
+        client = Client()
+
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        self.assertEqual(
+            client.get(
+                '/metrics',
+                HTTP_AUTHORIZATION='Bearer wrong',
+            ).status_code,
+            403,
+        )
+        self.assertEqual(
+            client.get(
+                '/metrics',
+                HTTP_AUTHORIZATION='Bearer secret',
+                HTTP_X_FORWARDED_FOR='203.0.113.5',
+            ).status_code,
+            200,
+        )
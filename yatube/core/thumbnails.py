@@ -0,0 +1,280 @@
+"""
+Фоновая генерация миниатюр sorl-thumbnail.
+
+AsyncThumbnailBackend отдает готовую миниатюру из хранилища ключей
+sorl, а если ее еще нет - возвращает исходное изображение и ставит
+генерацию в очередь локального пула потоков. Поэтому рендеринг страницы
+никогда не декодирует и не масштабирует оригинал. Задачи ставятся
+после фиксации транзакции, чтобы не генерировать миниатюры для
+откатившихся изменений.
+
+Геометрия и параметры миниатюр задаются именованными пресетами
+в настройке THUMBNAIL_PRESETS; шаблоны обращаются к ним по имени через
+тег preset_thumbnail. Для пресетов из THUMBNAIL_SRCSET_WIDTHS создаются
+и уменьшенные копии той же пропорции, из которых тег preset_srcset
+собирает атрибут srcset. Размер миниатюры вычисляется по сохраненным
+размерам оригинала (get_thumbnail_size), поэтому шаблон выводит
+width и height тега img, не открывая файлы.
+
+Пока миниатюры нет, страницы кэшируются с исходным изображением. Когда
+фоновая задача создает миниатюры изображения, отправляется сигнал
+thumbnails_generated, по которому приложения обновляют версии
+кэшированных страниц с этим изображением.
+"""
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.dispatch import Signal
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import serialize
+from sorl.thumbnail.parsers import parse_geometry
+from sorl.thumbnail.images import ImageFile
+
+from .background import submit
+from .metrics import metrics
+from .timing import count_event, timed
+
+logger = logging.getLogger(__name__)
+
+# Геометрия и параметры миниатюры, как в теге {% thumbnail %}.
+Preset = Tuple[str, Dict[str, Any]]
+
+# Фоновая задача создала миниатюры изображения name.
+thumbnails_generated = Signal()
+
+_pending: Set[str] = set()
+_lock: threading.Lock = threading.Lock()
+
+
+def get_preset(name: str) -> Preset:
+    """Возвращает геометрию и параметры миниатюры по имени пресета."""
+    try:
+        return settings.THUMBNAIL_PRESETS[name]
+    except KeyError:
+        raise ImproperlyConfigured(f'Неизвестный пресет миниатюры: {name}')
+
+
+def get_variants(name: str) -> List[Preset]:
+    """
+    Возвращает уменьшенные копии пресета для srcset по возрастанию
+    ширины, последним - сам пресет.
+    """
+    geometry_string, options = get_preset(name)
+    width, height = parse_geometry(geometry_string)
+    if width is None:
+        return [(geometry_string, options)]
+    variants: List[Preset] = []
+    for variant_width in sorted(
+        settings.THUMBNAIL_SRCSET_WIDTHS.get(name, ())
+    ):
+        if variant_width >= width:
+            continue
+        variant_geometry: str = (
+            f'{variant_width}x{round(height * variant_width / width)}'
+            if height is not None else str(variant_width)
+        )
+        variants.append((variant_geometry, options))
+    variants.append((geometry_string, options))
+    return variants
+
+
+def get_presets(names: Iterable[str]) -> List[Preset]:
+    """Возвращает пресеты по именам вместе с их копиями для srcset."""
+    presets: Dict[str, Preset] = {}
+    for name in names:
+        for geometry_string, options in get_variants(name):
+            presets.setdefault(
+                f'{geometry_string}|{serialize(options)}',
+                (geometry_string, options),
+            )
+    return list(presets.values())
+
+
+def get_thumbnail_size(preset: Preset, width: int,
+                       height: int) -> Tuple[int, int]:
+    """
+    Возвращает размер миниатюры изображения width x height так же,
+    как его вычисляет движок sorl-thumbnail, но без чтения файла.
+    """
+    geometry_string, options = preset
+    target_width, target_height = parse_geometry(
+        geometry_string,
+        width / height,
+    )
+    crop: bool = bool(options.get('crop'))
+    factors: Tuple[float, float] = (
+        target_width / width,
+        target_height / height,
+    )
+    factor: float = max(factors) if crop else min(factors)
+    if not options.get('upscale', thumbnail_settings.THUMBNAIL_UPSCALE):
+        factor = min(factor, 1)
+    size: Tuple[int, int] = (
+        int(round(width * factor)),
+        int(round(height * factor)),
+    )
+    if crop:
+        return min(size[0], target_width), min(size[1], target_height)
+    return size
+
+
+class AsyncThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, не генерирующий миниатюры при рендеринге."""
+
+    def get_thumbnail(self, file_: Any, geometry_string: str,
+                      **options: Any) -> ImageFile:
+        """
+        Возвращает готовую миниатюру или, пока она не создана,
+        исходное изображение.
+        """
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        source: ImageFile = ImageFile(file_)
+        thumbnail: Optional[ImageFile] = self.get_ready_thumbnail(
+            source,
+            geometry_string,
+            options,
+        )
+        if thumbnail is not None:
+            return thumbnail
+        schedule_thumbnails(source.name, [(geometry_string, options)])
+        return source
+
+    def get_ready_thumbnail(self, source: ImageFile, geometry_string: str,
+                            options: Dict[str, Any]) -> Optional[ImageFile]:
+        """Возвращает миниатюру, если она уже есть в хранилище ключей."""
+        with timed('thumbnail'):
+            name: str = self._get_thumbnail_filename(
+                source,
+                geometry_string,
+                self.get_full_options(source, options),
+            )
+            return default.kvstore.get(ImageFile(name, default.storage))
+
+    def get_full_options(self, source: ImageFile,
+                         options: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Дополняет параметры значениями по умолчанию так же, как
+        ThumbnailBackend.get_thumbnail, от них зависит имя миниатюры.
+        """
+        options = dict(options)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def generate(self, file_: Any, geometry_string: str,
+                 **options: Any) -> ImageFile:
+        """Создает миниатюру в текущем потоке."""
+        return super().get_thumbnail(file_, geometry_string, **options)
+
+
+def get_thumbnails(name: str) -> List[ImageFile]:
+    """Возвращает созданные миниатюры изображения name."""
+    keys: List[str] = default.kvstore._get(
+        ImageFile(name).key,
+        identity='thumbnails',
+    ) or []
+    return [
+        thumbnail for thumbnail in map(default.kvstore._get, keys)
+        if thumbnail is not None
+    ]
+
+
+def delete_thumbnails(name: str) -> None:
+    """Удаляет миниатюры изображения name и его ключи в хранилище sorl."""
+    default.kvstore.delete(ImageFile(name))
+
+
+def generate_thumbnail(name: str, geometry_string: str,
+                       options: Dict[str, Any]) -> Optional[ImageFile]:
+    """
+    Создает миниатюру изображения name.
+
+    Ошибки записываются в лог: у задачи в пуле нет вызывающего кода,
+    которому их можно передать.
+    """
+    try:
+        thumbnail: ImageFile = default.backend.generate(
+            name,
+            geometry_string,
+            **options,
+        )
+    except Exception:
+        logger.exception(
+            'Не удалось создать миниатюру %s (%s)',
+            name,
+            geometry_string,
+        )
+        metrics.inc('yatube_thumbnails_generated_total', {'result': 'error'})
+        return None
+    metrics.inc('yatube_thumbnails_generated_total', {'result': 'ok'})
+    return thumbnail
+
+
+def _run(keys: List[str], name: str, presets: List[Preset]) -> None:
+    try:
+        generated: bool = False
+        for geometry_string, options in presets:
+            thumbnail: Optional[ImageFile] = generate_thumbnail(
+                name,
+                geometry_string,
+                options,
+            )
+            generated = generated or thumbnail is not None
+        if generated:
+            thumbnails_generated.send(sender=AsyncThumbnailBackend, name=name)
+    except Exception:
+        logger.exception('Не удалось обработать миниатюры %s', name)
+    finally:
+        with _lock:
+            _pending.difference_update(keys)
+        metrics.flush()
+
+
+def _submit(name: str, presets: Iterable[Preset]) -> None:
+    keys: List[str] = []
+    batch: List[Preset] = []
+    with _lock:
+        for geometry_string, options in presets:
+            key: str = f'{name}|{geometry_string}|{serialize(options)}'
+            if key in _pending:
+                continue
+            _pending.add(key)
+            keys.append(key)
+            batch.append((geometry_string, options))
+    if batch:
+        count_event('thumbnails_queued', len(batch))
+        submit(
+            'thumbnails',
+            settings.THUMBNAIL_WORKERS,
+            _run,
+            keys,
+            name,
+            batch,
+        )
+
+
+def schedule_thumbnails(name: str, presets: Iterable[Preset]) -> None:
+    """
+    Ставит генерацию миниатюр изображения в очередь пула.
+
+    Миниатюры одного изображения создаются одной задачей подряд,
+    пока исходный файл в кэше файловой системы. Одна и та же миниатюра
+    не ставится в очередь повторно, пока предыдущая задача
+    не завершилась.
+    """
+    presets = list(presets)
+    transaction.on_commit(lambda: _submit(name, presets))
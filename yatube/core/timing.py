@@ -0,0 +1,148 @@
+"""
+Замер фаз обработки запроса.
+
+ServerTimingMiddleware создает для каждого запроса RequestTimings и
+делает его текущим для потока. Код, выполняющийся при обработке
+запроса, отмечает свои фазы контекстным менеджером timed: SQL-запросы
+(через connection.execute_wrapper), рендеринг шаблонов (бэкенд
+DjangoTemplates этого модуля), поиск миниатюр sorl-thumbnail
+(AsyncThumbnailBackend) и загрузку и сохранение сессии
+(core.sessions). Фазы могут вкладываться друг в друга: запросы,
+выполненные при рендеринге шаблона, входят и в db, и в template.
+Повторный вход в уже идущую фазу не учитывается.
+
+Кроме длительностей, запрос накапливает счетчики событий count_event:
+попадания и промахи кэша страниц и хранилища ключей миниатюр,
+поставленные в очередь миниатюры. По ним core.metrics строит метрики
+по представлениям.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, Optional, Set
+
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+# Описания фаз для заголовка Server-Timing.
+PHASES: Dict[str, str] = {
+    'db': 'SQL',
+    'template': 'Templates',
+    'thumbnail': 'Thumbnails',
+    'session': 'Session',
+}
+
+_current: ContextVar[Optional['RequestTimings']] = ContextVar(
+    'request_timings',
+    default=None,
+)
+
+
+class RequestTimings:
+    """Длительности и количество вызовов фаз одного запроса."""
+
+    def __init__(self) -> None:
+        self.durations: Dict[str, float] = defaultdict(float)
+        self.counts: Counter = Counter()
+        self.events: Counter = Counter()
+        self.active: Set[str] = set()
+        self.total: float = 0.0
+
+    def add(self, phase: str, duration: float) -> None:
+        self.durations[phase] += duration
+        self.counts[phase] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Возвращает длительности в миллисекундах, счетчики фаз
+        и событий.
+        """
+        return {
+            'total_ms': round(self.total * 1000, 2),
+            'phases': {
+                phase: {
+                    'ms': round(self.durations[phase] * 1000, 2),
+                    'count': self.counts[phase],
+                }
+                for phase in sorted(self.durations)
+            },
+            'events': dict(sorted(self.events.items())),
+        }
+
+    def header(self) -> str:
+        """Возвращает значение заголовка Server-Timing."""
+        metrics = [
+            f'{phase};desc="{PHASES.get(phase, phase)} '
+            f'x{self.counts[phase]}";dur={self.durations[phase] * 1000:.2f}'
+            for phase in sorted(self.durations)
+        ]
+        metrics.append(f'total;dur={self.total * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+def get_current() -> Optional[RequestTimings]:
+    """Возвращает замеры текущего запроса или None вне запроса."""
+    return _current.get()
+
+
+@contextmanager
+def collect() -> Iterator[RequestTimings]:
+    """Замеряет фазы кода внутри блока и общее время его выполнения."""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    started: float = perf_counter()
+    try:
+        yield timings
+    finally:
+        timings.total = perf_counter() - started
+        _current.reset(token)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Добавляет время выполнения блока к фазе текущего запроса."""
+    timings: Optional[RequestTimings] = _current.get()
+    if timings is None or phase in timings.active:
+        yield
+        return
+    timings.active.add(phase)
+    started: float = perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(phase)
+        timings.add(phase, perf_counter() - started)
+
+
+def count_event(event: str, amount: int = 1) -> None:
+    """Увеличивает счетчик события текущего запроса."""
+    timings: Optional[RequestTimings] = _current.get()
+    if timings is not None:
+        timings.events[event] += amount
+
+
+def time_query(execute: Callable, sql: str, params: Any, many: bool,
+               context: Dict[str, Any]) -> Any:
+    """Обертка connection.execute_wrapper, замеряющая SQL-запросы."""
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+class Template(django_backend.Template):
+    def render(self, context: Any = None, request: Any = None) -> str:
+        with timed('template'):
+            return super().render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Шаблонный бэкенд Django, замеряющий рендеринг шаблонов."""
+
+    def from_string(self, template_code: str) -> Template:
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name: str) -> Template:
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
@@ -1,4 +1,16 @@
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+
+from .metrics import metrics as metrics_store, render as render_metrics
+
+# Заголовки, которые добавляет обратный прокси.
+PROXY_HEADERS = (
+    'HTTP_X_FORWARDED_FOR',
+    'HTTP_X_REAL_IP',
+    'HTTP_FORWARDED',
+)
 
 
 def page_not_found(request, exception):
@@ -16,3 +28,26 @@ def csrf_failure(request, reason=''):
 
 def server_error(request, reason=''):
     return render(request, 'core/500.html')
+
+
+def _metrics_allowed(request: HttpRequest) -> bool:
+    if settings.METRICS_TOKEN:
+        return constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''),
+            f'Bearer {settings.METRICS_TOKEN}',
+        )
+    # За обратным прокси REMOTE_ADDR - адрес прокси, а адрес клиента
+    # неизвестен: без токена такие запросы не пропускаются.
+    if any(header in request.META for header in PROXY_HEADERS):
+        return False
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics(request):
+    """Метрики всех воркеров в текстовом формате Prometheus."""
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(metrics_store.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -1,6 +1,11 @@
+from typing import Optional, Tuple
+
 from django.contrib import admin
+from django.db.models import QuerySet
+from django.http import HttpRequest
 
 from .models import Comment, Follow, Group, Post
+from .search import build_match_query, filter_matching
 
 
 @admin.register(Post)
@@ -18,6 +23,16 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request: HttpRequest, queryset: QuerySet,
+                           search_term: str) -> Tuple[QuerySet, bool]:
+        """Ищет посты по полнотекстовому индексу вместо LIKE."""
+        if not search_term.strip():
+            return queryset, False
+        match: Optional[str] = build_match_query(search_term)
+        if match is None:
+            return queryset.none(), False
+        return filter_matching(queryset, match), False
+
 
 admin.site.register(Group)
 admin.site.register(Follow)
@@ -5,3 +5,7 @@ class PostsConfig(AppConfig):
     """Класс конфигурации для приложения <posts>"""
 
     name: str = 'posts'
+
+    def ready(self) -> None:
+        """Подключает обработчики сигналов приложения"""
+        from . import signals  # noqa: F401
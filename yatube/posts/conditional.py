@@ -0,0 +1,109 @@
+"""
+Условные GET-запросы к лентам и страницам постов.
+
+ETag и Last-Modified вычисляются по версиям и времени изменения
+областей кэша (см. invalidation), поэтому ответ 304 отдается без
+запросов к постам и без рендеринга шаблона. Страницы содержат данные
+пользователя (меню, кнопки подписки, CSRF-токен в форме), поэтому
+ETag зависит от пользователя и CSRF-cookie, а Last-Modified выставляется
+только анонимным посетителям.
+"""
+import hashlib
+from datetime import datetime
+from typing import Any, Callable, List, Optional
+
+from django.conf import settings
+from django.http import HttpRequest
+from django.views.decorators.http import condition
+
+from .invalidation import (GROUPS, INDEX, get_last_modified, get_version,
+                           group_feed, post_page, profile_feed, profile_page)
+from .models import Group, Post, User
+
+ScopesFunc = Callable[..., Optional[List[str]]]
+
+
+def index_scopes() -> List[str]:
+    """Области главной страницы."""
+    return [INDEX, GROUPS]
+
+
+def group_scopes(slug: str) -> Optional[List[str]]:
+    """Области страницы группы."""
+    group_id: Optional[int] = Group.objects.filter(
+        slug=slug,
+    ).values_list('pk', flat=True).first()
+    if group_id is None:
+        return None
+    return [group_feed(group_id), GROUPS]
+
+
+def profile_scopes(username: str) -> Optional[List[str]]:
+    """Области страницы профиля."""
+    author_id: Optional[int] = User.objects.filter(
+        username=username,
+    ).values_list('pk', flat=True).first()
+    if author_id is None:
+        return None
+    return [profile_feed(author_id), profile_page(author_id), GROUPS]
+
+
+def post_detail_scopes(post_id: int) -> Optional[List[str]]:
+    """
+    Области страницы поста.
+
+    Страница показывает количество постов автора, поэтому в области
+    входит лента его профиля.
+    """
+    author_id: Optional[int] = Post.objects.filter(
+        pk=post_id,
+    ).values_list('author_id', flat=True).first()
+    if author_id is None:
+        return None
+    return [post_page(post_id), profile_feed(author_id), GROUPS]
+
+
+def comments_scopes(post_id: int) -> Optional[List[str]]:
+    """Области фрагмента с комментариями к посту."""
+    if not Post.objects.filter(pk=post_id).exists():
+        return None
+    return [post_page(post_id)]
+
+
+def scoped_condition(get_scopes: ScopesFunc) -> Callable:
+    """
+    Декоратор представления, отвечающий 304 на условные запросы.
+
+    get_scopes получает аргументы представления и возвращает области
+    страницы или None, если объекта нет: тогда представление
+    выполняется как обычно и отвечает 404.
+    """
+
+    def scopes(request: HttpRequest, **kwargs: Any) -> Optional[List[str]]:
+        if not hasattr(request, '_page_scopes'):
+            request._page_scopes = get_scopes(**kwargs)
+        return request._page_scopes
+
+    def etag(request: HttpRequest, *args: Any,
+             **kwargs: Any) -> Optional[str]:
+        page_scopes: Optional[List[str]] = scopes(request, **kwargs)
+        if page_scopes is None:
+            return None
+        payload: str = '|'.join((
+            get_version(*page_scopes),
+            str(request.user.pk),
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+            request.GET.urlencode(),
+        ))
+        return hashlib.md5(payload.encode()).hexdigest()
+
+    def last_modified(request: HttpRequest, *args: Any,
+                      **kwargs: Any) -> Optional[datetime]:
+        if request.user.is_authenticated:
+            return None
+        page_scopes: Optional[List[str]] = scopes(request, **kwargs)
+        if page_scopes is None:
+            return None
+        return get_last_modified(*page_scopes)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
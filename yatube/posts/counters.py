@@ -0,0 +1,213 @@
+"""
+Денормализованные счетчики.
+
+Количество постов в лентах (всего, в группе, у автора, в ленте
+подписок читателя), комментариев к посту, подписчиков и подписок
+пользователя хранится в таблице Counter и меняется на единицу
+в обработчиках сигналов, поэтому страницам не нужен COUNT(*).
+Отсутствующий счетчик вычисляется один раз при первом чтении;
+при заданном COUNT_APPROXIMATE_ABOVE вычисление ограничено этим числом
+записей, а большее количество считается приблизительным. Разошедшиеся
+счетчики исправляет команда reconcile_counters.
+"""
+from collections import defaultdict
+from typing import (Dict, Iterable, Iterator, List, Optional, Tuple, Type,
+                    TypeVar)
+
+from django.conf import settings
+from django.db.models import Count, F, Model, QuerySet
+
+from .models import Comment, Counter, Follow, Post, TimelineEntry
+
+GLOBAL_SCOPE: str = 'posts'
+
+CountResult = Tuple[int, bool]
+Item = TypeVar('Item')
+
+# Префикс области счетчика -> модель и поле, по которому она считается.
+COUNTED_RELATIONS: Dict[str, Tuple[Type[Model], Optional[str]]] = {
+    GLOBAL_SCOPE: (Post, None),
+    'posts:group': (Post, 'group_id'),
+    'posts:author': (Post, 'author_id'),
+    'posts:follower': (TimelineEntry, 'user_id'),
+    'comments:post': (Comment, 'post_id'),
+    'followers': (Follow, 'author_id'),
+    'following': (Follow, 'user_id'),
+}
+
+
+def group_scope(group_id: int) -> str:
+    """Область счетчика постов группы."""
+    return f'posts:group:{group_id}'
+
+
+def author_scope(author_id: int) -> str:
+    """Область счетчика постов автора."""
+    return f'posts:author:{author_id}'
+
+
+def follower_scope(user_id: int) -> str:
+    """Область счетчика материализованной ленты читателя."""
+    return f'posts:follower:{user_id}'
+
+
+def comments_scope(post_id: int) -> str:
+    """Область счетчика комментариев к посту."""
+    return f'comments:post:{post_id}'
+
+
+def followers_scope(author_id: int) -> str:
+    """Область счетчика подписчиков автора."""
+    return f'followers:{author_id}'
+
+
+def following_scope(user_id: int) -> str:
+    """Область счетчика подписок пользователя."""
+    return f'following:{user_id}'
+
+
+def user_scopes(user_id: int) -> List[str]:
+    """Возвращает области счетчиков, принадлежащих пользователю."""
+    return [
+        author_scope(user_id),
+        follower_scope(user_id),
+        followers_scope(user_id),
+        following_scope(user_id),
+    ]
+
+
+def post_scopes(post: Post) -> List[str]:
+    """Возвращает области счетчиков, в которые входит пост."""
+    scopes: List[str] = [GLOBAL_SCOPE, author_scope(post.author_id)]
+    if post.group_id:
+        scopes.append(group_scope(post.group_id))
+    return scopes
+
+
+def parse_scope(scope: str) -> Tuple[str, Optional[int]]:
+    """Разбирает область счетчика на префикс и id объекта."""
+    prefix, _, key = scope.rpartition(':')
+    if prefix and key.isdigit():
+        return prefix, int(key)
+    return scope, None
+
+
+def scope_queryset(scope: str) -> QuerySet:
+    """Возвращает набор записей, количество которых хранит счетчик."""
+    prefix, key = parse_scope(scope)
+    model, field = COUNTED_RELATIONS[prefix]
+    if field is None:
+        return model.objects.all()
+    return model.objects.filter(**{field: key})
+
+
+def _batches(items: Iterable[Item]) -> Iterator[List[Item]]:
+    items = list(items)
+    for start in range(0, len(items), settings.COUNTERS_BATCH_SIZE):
+        yield items[start:start + settings.COUNTERS_BATCH_SIZE]
+
+
+def get_count(scope: str, queryset: Optional[QuerySet] = None,
+              approximate: bool = True) -> CountResult:
+    """
+    Возвращает значение счетчика и признак приблизительности.
+
+    Если счетчика еще нет, он вычисляется по queryset (по умолчанию -
+    по COUNTED_RELATIONS) и сохраняется. approximate=False требует
+    точного значения независимо от COUNT_APPROXIMATE_ABOVE.
+    """
+    value = Counter.objects.filter(
+        scope=scope,
+    ).values_list('value', flat=True).first()
+    if value is not None:
+        return value, False
+
+    if queryset is None:
+        queryset = scope_queryset(scope)
+    limit = settings.COUNT_APPROXIMATE_ABOVE if approximate else None
+    if limit is None:
+        value = queryset.order_by().count()
+    else:
+        value = queryset.order_by()[:limit + 1].count()
+        if value > limit:
+            return limit, True
+
+    Counter.objects.get_or_create(scope=scope, defaults={'value': value})
+    return value, False
+
+
+def get_value(scope: str) -> int:
+    """Возвращает точное значение счетчика."""
+    return get_count(scope, approximate=False)[0]
+
+
+def get_values(scopes: Iterable[str]) -> Dict[str, int]:
+    """Возвращает точные значения нескольких счетчиков."""
+    scopes = list(scopes)
+    values: Dict[str, int] = {}
+    for batch in _batches(scopes):
+        values.update(
+            Counter.objects.filter(
+                scope__in=batch,
+            ).values_list('scope', 'value')
+        )
+    values.update(_compute_values(
+        scope for scope in scopes if scope not in values
+    ))
+    return values
+
+
+def _compute_values(scopes: Iterable[str]) -> Dict[str, int]:
+    # Незаполненные счетчики одной модели вычисляются одним запросом
+    # с группировкой.
+    values: Dict[str, int] = {}
+    grouped: Dict[str, Dict[int, str]] = defaultdict(dict)
+    for scope in scopes:
+        prefix, key = parse_scope(scope)
+        if key is None or COUNTED_RELATIONS[prefix][1] is None:
+            values[scope] = get_value(scope)
+        else:
+            grouped[prefix][key] = scope
+    computed: Dict[str, int] = {}
+    for prefix, keys in grouped.items():
+        model, field = COUNTED_RELATIONS[prefix]
+        for batch in _batches(keys):
+            counts: Dict[int, int] = dict(
+                model.objects.filter(
+                    **{f'{field}__in': batch},
+                ).order_by().values_list(field).annotate(Count('pk'))
+            )
+            for key in batch:
+                computed[keys[key]] = counts.get(key, 0)
+    Counter.objects.bulk_create(
+        (Counter(scope=scope, value=value)
+         for scope, value in computed.items()),
+        batch_size=settings.COUNTERS_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    values.update(computed)
+    return values
+
+
+def change_counters(scopes: Iterable[str], delta: int) -> None:
+    """
+    Изменяет существующие счетчики на delta.
+
+    Незаполненные счетчики не создаются: они будут вычислены
+    при первом чтении.
+    """
+    for batch in _batches(scopes):
+        Counter.objects.filter(
+            scope__in=batch,
+        ).update(value=F('value') + delta)
+
+
+def reset_counters(scopes: Iterable[str]) -> None:
+    """Сбрасывает счетчики, чтобы они были вычислены заново."""
+    for batch in _batches(scopes):
+        Counter.objects.filter(scope__in=batch).delete()
+
+
+def reset_all_counters() -> None:
+    """Удаляет все счетчики; они пересчитаются при следующем чтении."""
+    Counter.objects.all().delete()
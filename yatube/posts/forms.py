@@ -1,6 +1,10 @@
+from typing import Any
+
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
-from .models import Post, Comment
+from .images import IngestedImage, ingest_image
+from .models import Comment, Post
 
 
 class PostForm(forms.ModelForm):
@@ -18,6 +22,23 @@ class PostForm(forms.ModelForm):
             'group': "Группа, к которой будет относиться пост",
         }
 
+    def clean_image(self) -> Any:
+        """Обрабатывает новое изображение и запоминает его размеры"""
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            ingested: IngestedImage = ingest_image(image)
+            self.instance.image_width = ingested.width
+            self.instance.image_height = ingested.height
+            self.instance.image_size = ingested.size
+            self.instance.image_color = ingested.color
+            return ingested.file
+        if not image:
+            self.instance.image_width = None
+            self.instance.image_height = None
+            self.instance.image_size = None
+            self.instance.image_color = ''
+        return image
+
 
 class CommentForm(forms.ModelForm):
     """Класс для формы создания комментария"""
@@ -0,0 +1,166 @@
+"""
+Обработка изображений, загружаемых к постам.
+
+Загруженный файл не хранится как есть: изображение уменьшается так,
+чтобы большая сторона не превышала IMAGE_MAX_DIMENSION, метаданные
+(EXIF, ICC, комментарии) отбрасываются, а результат перекодируется
+в WebP, если Pillow его поддерживает, иначе в JPEG (PNG для
+изображений с прозрачностью). JPEG декодируется сразу в уменьшенном
+масштабе (draft mode), поэтому память на обработку ограничена размером
+результата, а не оригинала. Анимированные GIF допустимого размера
+сохраняются без изменений. Для каждого изображения запоминаются
+размеры и средний цвет, который страница показывает вместо картинки,
+пока та загружается.
+"""
+import io
+import os
+from typing import IO, NamedTuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
+from PIL import Image, ImageOps, features
+
+EXTENSIONS = {
+    'WEBP': 'webp',
+    'JPEG': 'jpg',
+    'PNG': 'png',
+}
+
+
+# Значения тега EXIF Orientation, при которых изображение повернуто
+# на 90 градусов.
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION = 0x0112
+
+
+class IngestedImage(NamedTuple):
+    """Обработанное изображение и его характеристики."""
+
+    file: UploadedFile
+    width: int
+    height: int
+    size: int
+    color: str
+
+
+class ImageInfo(NamedTuple):
+    """Размеры и средний цвет сохраненного изображения."""
+
+    width: int
+    height: int
+    color: str
+
+
+def dominant_color(image: Image.Image) -> str:
+    """Возвращает средний цвет изображения в виде #rrggbb."""
+    pixel = image.convert('RGB').resize((1, 1), Image.BOX).getpixel((0, 0))
+    return '#{:02x}{:02x}{:02x}'.format(*pixel)
+
+
+def describe_image(file_: IO) -> ImageInfo:
+    """
+    Возвращает размеры и средний цвет изображения из файла.
+
+    Размеры читаются из заголовка с учетом EXIF-поворота, для цвета
+    изображение декодируется в уменьшенном масштабе.
+    """
+    image: Image.Image = Image.open(file_)
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    image.draft('RGB', (64, 64))
+    image.thumbnail((64, 64))
+    return ImageInfo(width, height, dominant_color(image))
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def _output_format(has_alpha: bool) -> str:
+    if features.check('webp'):
+        return 'WEBP'
+    return 'PNG' if has_alpha else 'JPEG'
+
+
+def _open(upload: UploadedFile) -> Image.Image:
+    upload.seek(0)
+    try:
+        image: Image.Image = Image.open(upload)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError(
+            'Загрузите правильное изображение.',
+            code='invalid_image',
+        )
+    width, height = image.size
+    if width * height > settings.IMAGE_MAX_SOURCE_PIXELS:
+        raise ValidationError(
+            'Изображение слишком большое: не больше %(limit)s пикселей.',
+            code='image_too_large',
+            params={'limit': settings.IMAGE_MAX_SOURCE_PIXELS},
+        )
+    return image
+
+
+def ingest_image(upload: UploadedFile) -> IngestedImage:
+    """
+    Уменьшает, очищает от метаданных и перекодирует загруженное
+    изображение.
+    """
+    image: Image.Image = _open(upload)
+    max_size = (settings.IMAGE_MAX_DIMENSION, settings.IMAGE_MAX_DIMENSION)
+
+    if getattr(image, 'is_animated', False) and (
+        max(image.size) <= settings.IMAGE_MAX_DIMENSION
+    ):
+        upload.seek(0)
+        return IngestedImage(
+            upload,
+            *image.size,
+            upload.size,
+            dominant_color(image),
+        )
+
+    # Для JPEG декодер сразу уменьшает изображение в 2, 4 или 8 раз,
+    # не опускаясь ниже требуемого размера.
+    image.draft('RGB', max_size)
+    try:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(max_size, Image.LANCZOS, reducing_gap=3.0)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError(
+            'Загрузите правильное изображение.',
+            code='invalid_image',
+        )
+
+    has_alpha: bool = _has_alpha(image)
+    image_format: str = _output_format(has_alpha)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    output = io.BytesIO()
+    image.save(
+        output,
+        image_format,
+        quality=settings.IMAGE_QUALITY,
+        optimize=True,
+        progressive=True,
+    )
+    name: str = '{}.{}'.format(
+        os.path.splitext(os.path.basename(upload.name))[0],
+        EXTENSIONS[image_format],
+    )
+    content = SimpleUploadedFile(
+        name,
+        output.getvalue(),
+        Image.MIME[image_format],
+    )
+    return IngestedImage(
+        content,
+        image.width,
+        image.height,
+        content.size,
+        dominant_color(image),
+    )
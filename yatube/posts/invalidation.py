@@ -0,0 +1,199 @@
+"""
+Инвалидация кэша страниц по версиям областей.
+
+У каждой области (главная лента, лента группы, профиль автора, лента
+подписок читателя, страница поста) есть версия в кэше versions.
+Версии входят в ключи кэшированных фрагментов, поэтому фрагменты можно
+хранить долго: обработчики сигналов меняют версии ровно тех областей,
+которых коснулось изменение, и старые фрагменты перестают читаться.
+Вместе с версией запоминается время изменения области - по нему
+страницам выставляется Last-Modified. Версии хранятся в общем уровне
+кэша без локальной копии, чтобы изменение сразу было видно всем
+воркерам.
+"""
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Comment, Post, TimelineEntry, User
+
+VERSIONS_CACHE: str = 'versions'
+
+INDEX: str = 'index'
+GROUPS: str = 'groups'
+
+
+def group_feed(group_id: int) -> str:
+    """Область ленты группы."""
+    return f'group:{group_id}'
+
+
+def profile_feed(author_id: int) -> str:
+    """Область ленты постов автора."""
+    return f'profile:{author_id}'
+
+
+def follow_feed(user_id: int) -> str:
+    """Область ленты подписок читателя."""
+    return f'follow:{user_id}'
+
+
+def post_page(post_id: int) -> str:
+    """Область страницы поста."""
+    return f'post:{post_id}'
+
+
+def profile_page(user_id: int) -> str:
+    """Область сведений о подписках на странице профиля."""
+    return f'profile-page:{user_id}'
+
+
+def _version_key(scope: str) -> str:
+    return f'version:{scope}'
+
+
+def _modified_key(scope: str) -> str:
+    return f'modified:{scope}'
+
+
+def get_version(*scopes: str) -> str:
+    """Возвращает составную версию областей для ключа фрагмента."""
+    cache = caches[VERSIONS_CACHE]
+    keys: List[str] = [_version_key(scope) for scope in scopes]
+    versions: Dict[str, str] = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return '.'.join(
+        f'{scope}-{versions[key]}' for scope, key in zip(scopes, keys)
+    )
+
+
+def get_last_modified(*scopes: str) -> datetime:
+    """
+    Возвращает время последнего изменения областей.
+
+    Время округляется вверх до секунды, потому что If-Modified-Since
+    передается с точностью до секунды. Если время изменения области
+    неизвестно, им считается текущий момент.
+    """
+    cache = caches[VERSIONS_CACHE]
+    keys: List[str] = [_modified_key(scope) for scope in scopes]
+    modified: Dict[str, float] = cache.get_many(keys)
+    for key in keys:
+        if key not in modified:
+            cache.add(key, time.time(), None)
+            modified[key] = cache.get(key)
+    return datetime.fromtimestamp(
+        math.ceil(max(modified.values())),
+        timezone.utc,
+    )
+
+
+def _set_new_versions(scopes: List[str]) -> None:
+    now: float = time.time()
+    values: Dict[str, Any] = {}
+    for scope in scopes:
+        values[_version_key(scope)] = uuid4().hex
+        values[_modified_key(scope)] = now
+    caches[VERSIONS_CACHE].set_many(values, None)
+
+
+def bump(scopes: Iterable[str]) -> None:
+    """
+    Меняет версии областей, делая их фрагменты недействительными.
+
+    Версии меняются сразу и еще раз после фиксации транзакции: иначе
+    запрос, прочитавший старые данные до фиксации, мог бы сохранить
+    их под новой версией.
+    """
+    scopes = list(scopes)
+    if scopes:
+        _set_new_versions(scopes)
+        transaction.on_commit(lambda: _set_new_versions(scopes))
+
+
+def invalidate_all() -> None:
+    """
+    Делает недействительными фрагменты всех областей.
+
+    Области без версии получают новую версию при первом чтении.
+    """
+    caches[VERSIONS_CACHE].clear()
+
+
+def post_feeds(post: Post) -> List[str]:
+    """
+    Возвращает области, в которых показывается пост.
+
+    Читатели определяются по материализованной ленте, поэтому функцию
+    нужно вызывать, пока записи ленты поста еще существуют.
+    """
+    scopes: List[str] = [
+        INDEX,
+        profile_feed(post.author_id),
+        post_page(post.pk),
+    ]
+    if post.group_id:
+        scopes.append(group_feed(post.group_id))
+    scopes.extend(
+        follow_feed(user_id) for user_id in TimelineEntry.objects.filter(
+            post_id=post.pk,
+        ).values_list('user_id', flat=True).iterator()
+    )
+    return scopes
+
+
+def author_feeds(author_id: int) -> List[str]:
+    """
+    Возвращает области, в которых показываются имя и ник пользователя:
+    ленты с его постами, его профиль и страницы постов с его постами
+    и комментариями.
+    """
+    posts = Post.objects.filter(author_id=author_id)
+    scopes: List[str] = [
+        INDEX,
+        profile_feed(author_id),
+        profile_page(author_id),
+    ]
+    scopes.extend(
+        group_feed(group_id) for group_id in posts.filter(
+            group__isnull=False,
+        ).values_list('group_id', flat=True).distinct().iterator()
+    )
+    scopes.extend(
+        follow_feed(user_id) for user_id in TimelineEntry.objects.filter(
+            author_id=author_id,
+        ).values_list('user_id', flat=True).distinct().iterator()
+    )
+    scopes.extend(
+        post_page(post_id) for post_id in posts.order_by().values_list(
+            'pk',
+            flat=True,
+        ).union(
+            Comment.objects.filter(
+                author_id=author_id,
+            ).order_by().values_list('post_id', flat=True),
+        ).iterator()
+    )
+    return scopes
+
+
+def get_timeline_version(user: User, heavy_authors: Iterable[int]) -> str:
+    """
+    Версия ленты подписок.
+
+    Посты "тяжелых" авторов не материализуются, поэтому в версию
+    входят версии их профилей.
+    """
+    return get_version(
+        follow_feed(user.pk),
+        GROUPS,
+        *map(profile_feed, heavy_authors),
+    )
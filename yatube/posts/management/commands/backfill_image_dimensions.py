@@ -0,0 +1,79 @@
+from typing import Any, List
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db.models import Q
+
+from posts.images import ImageInfo, describe_image
+from posts.models import Post
+
+FIELDS = ('image_width', 'image_height', 'image_size', 'image_color')
+
+
+class Command(BaseCommand):
+    """
+    Заполняет размеры и средний цвет картинок постов, загруженных
+    до того, как они стали сохраняться при загрузке.
+    """
+
+    help = 'Заполняет размеры и цвет картинок постов пачками'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Количество постов, сохраняемых одним запросом',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересчитать и уже заполненные картинки',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        posts = Post.objects.exclude(image='').only('pk', 'image')
+        if not options['all']:
+            posts = posts.filter(
+                Q(image_width__isnull=True) | Q(image_color='')
+            )
+        filled: int = 0
+        failed: int = 0
+        last_pk: int = 0
+
+        while True:
+            batch: List[Post] = list(
+                posts.filter(pk__gt=last_pk).order_by('pk')[
+                    :options['batch_size']
+                ]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            described: List[Post] = []
+            for post in batch:
+                if self.describe(post):
+                    described.append(post)
+                else:
+                    failed += 1
+            Post.objects.bulk_update(described, FIELDS)
+            filled += len(described)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Заполнено картинок: {filled}, ошибок: {failed}'
+        ))
+
+    def describe(self, post: Post) -> bool:
+        """Заполняет поля картинки поста; при ошибке возвращает False."""
+        try:
+            with post.image.open('rb') as file_:
+                info: ImageInfo = describe_image(file_)
+            size: int = post.image.size
+        except OSError as error:
+            self.stderr.write(f'{post.image.name}: {error}')
+            return False
+        post.image_width = info.width
+        post.image_height = info.height
+        post.image_size = size
+        post.image_color = info.color
+        return True
@@ -0,0 +1,549 @@
+import http.client
+import json
+import math
+import platform
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from importlib import import_module
+from typing import (Any, Callable, Dict, Iterator, List, NamedTuple,
+                    Optional, Tuple)
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import (BaseCommand, CommandError,
+                                         CommandParser)
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.db import connection
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_TOKEN_LENGTH
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# Адрес сервера: хост и порт.
+Address = Tuple[str, int]
+PERCENTILES: Tuple[int, ...] = (50, 95, 99)
+REQUEST_TIMEOUT: float = 30
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    session: Optional[str] = None
+    data: Optional[Dict[str, Any]] = None
+
+
+class SamplePost(NamedTuple):
+    pk: int
+    author: str
+    group_id: Optional[int]
+
+
+class Sample(NamedTuple):
+    """Данные базы, из которых составляются запросы."""
+
+    group_ids: List[int]
+    group_slugs: List[str]
+    posts: List[SamplePost]
+    # Сессии подписчиков и авторов постов из posts по именам.
+    followers: List[Tuple[str, str]]
+    authors: Dict[str, str]
+
+
+class Outcome(NamedTuple):
+    duration: float
+    status: int
+
+
+def _index(sample: Sample, rng: random.Random) -> Request:
+    return Request('GET', reverse('posts:index'))
+
+
+def _group_posts(sample: Sample, rng: random.Random) -> Request:
+    slug: str = rng.choice(sample.group_slugs)
+    return Request('GET', reverse('posts:group_posts', args=[slug]))
+
+
+def _profile(sample: Sample, rng: random.Random) -> Request:
+    author: str = rng.choice(sample.posts).author
+    return Request('GET', reverse('posts:profile', args=[author]))
+
+
+def _post_detail(sample: Sample, rng: random.Random) -> Request:
+    post_id: int = rng.choice(sample.posts).pk
+    return Request('GET', reverse('posts:post_detail', args=[post_id]))
+
+
+def _follow_index(sample: Sample, rng: random.Random) -> Request:
+    session, _ = rng.choice(sample.followers)
+    return Request('GET', reverse('posts:follow_index'), session)
+
+
+def _post_create(sample: Sample, rng: random.Random) -> Request:
+    session, username = rng.choice(sample.followers)
+    return Request('POST', reverse('posts:post_create'), session, {
+        'text': f'Нагрузочный пост {username} {rng.getrandbits(32)}',
+        'group': rng.choice(sample.group_ids) if sample.group_ids else '',
+    })
+
+
+def _post_edit(sample: Sample, rng: random.Random) -> Request:
+    post: SamplePost = rng.choice(
+        [post for post in sample.posts if post.author in sample.authors]
+    )
+    return Request(
+        'POST',
+        reverse('posts:post_edit', args=[post.pk]),
+        sample.authors[post.author],
+        {
+            'text': f'Отредактированный пост {rng.getrandbits(32)}',
+            'group': post.group_id or '',
+        },
+    )
+
+
+def _add_comment(sample: Sample, rng: random.Random) -> Request:
+    session, _ = rng.choice(sample.followers)
+    post_id: int = rng.choice(sample.posts).pk
+    return Request(
+        'POST',
+        reverse('posts:add_comment', args=[post_id]),
+        session,
+        {'text': f'Нагрузочный комментарий {rng.getrandbits(32)}'},
+    )
+
+
+def _profile_follow(sample: Sample, rng: random.Random) -> Request:
+    session, _ = rng.choice(sample.followers)
+    author: str = rng.choice(sample.posts).author
+    return Request(
+        'GET',
+        reverse('posts:profile_follow', args=[author]),
+        session,
+    )
+
+
+def _profile_unfollow(sample: Sample, rng: random.Random) -> Request:
+    session, _ = rng.choice(sample.followers)
+    author: str = rng.choice(sample.posts).author
+    return Request(
+        'GET',
+        reverse('posts:profile_unfollow', args=[author]),
+        session,
+    )
+
+
+# Страницы в порядке замера.
+TARGETS: Dict[str, Callable[[Sample, random.Random], Request]] = {
+    'posts:index': _index,
+    'posts:group_posts': _group_posts,
+    'posts:profile': _profile,
+    'posts:post_detail': _post_detail,
+    'posts:follow_index': _follow_index,
+    'posts:post_create': _post_create,
+    'posts:post_edit': _post_edit,
+    'posts:add_comment': _add_comment,
+    'posts:profile_follow': _profile_follow,
+    'posts:profile_unfollow': _profile_unfollow,
+}
+# Страницы, меняющие данные в базе; замеряются только с --allow-writes.
+WRITE_TARGETS: Tuple[str, ...] = (
+    'posts:post_create',
+    'posts:post_edit',
+    'posts:add_comment',
+    'posts:profile_follow',
+    'posts:profile_unfollow',
+)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Возвращает перцентиль отсортированного списка по ближайшему рангу."""
+    if not values:
+        return 0.0
+    rank: int = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(outcomes: List[Outcome], elapsed: float) -> Dict[str, Any]:
+    """Возвращает задержки в миллисекундах и пропускную способность."""
+    durations: List[float] = sorted(
+        outcome.duration * 1000 for outcome in outcomes
+    )
+    statuses: Counter = Counter(str(outcome.status) for outcome in outcomes)
+    summary: Dict[str, Any] = {
+        'requests': len(outcomes),
+        'errors': sum(
+            1 for outcome in outcomes
+            if not 0 < outcome.status < 400
+        ),
+        'statuses': dict(sorted(statuses.items())),
+        'rps': round(len(outcomes) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(durations) / len(durations), 2)
+        if durations else 0.0,
+    }
+    for percent in PERCENTILES:
+        summary[f'p{percent}_ms'] = round(percentile(durations, percent), 2)
+    return summary
+
+
+def _change(before: float, after: float) -> str:
+    if not before:
+        return 'n/a'
+    return f'{(after - before) / before:+.1%}'
+
+
+def send(address: Address, csrf_token: str, request: Request) -> Outcome:
+    """Выполняет запрос и читает ответ целиком, не следуя редиректам."""
+    cookies: Dict[str, str] = {settings.CSRF_COOKIE_NAME: csrf_token}
+    if request.session:
+        cookies[settings.SESSION_COOKIE_NAME] = request.session
+    headers: Dict[str, str] = {
+        'Cookie': '; '.join(f'{key}={value}' for key, value in cookies.items())
+    }
+    body: Optional[str] = None
+    if request.data is not None:
+        body = urlencode({**request.data, 'csrfmiddlewaretoken': csrf_token})
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    client = http.client.HTTPConnection(*address, timeout=REQUEST_TIMEOUT)
+    started: float = time.perf_counter()
+    try:
+        client.request(request.method, request.path, body, headers)
+        response = client.getresponse()
+        response.read()
+        status: int = response.status
+    except (OSError, http.client.HTTPException):
+        status = 0
+    finally:
+        client.close()
+    return Outcome(time.perf_counter() - started, status)
+
+
+class BenchmarkServer(ThreadedWSGIServer):
+    # Очередь соединений должна вмещать все потоки нагрузки.
+    request_queue_size: int = 1024
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@contextmanager
+def serve() -> Iterator[Address]:
+    """Запускает проект на свободном порту в фоновом потоке."""
+    server = BenchmarkServer(
+        ('127.0.0.1', 0),
+        QuietRequestHandler,
+        allow_reuse_address=False,
+    )
+    server.set_app(WSGIHandler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[:2]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def login(user: User) -> str:
+    """Создает сессию пользователя и возвращает ее ключ."""
+    client = Client()
+    client.force_login(user)
+    return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+def logout(sample: Sample) -> None:
+    """Удаляет сессии, созданные для нагрузки."""
+    engine: Any = import_module(settings.SESSION_ENGINE)
+    for session in [
+        session for session, _ in sample.followers
+    ] + list(sample.authors.values()):
+        engine.SessionStore(session).delete()
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный тест страниц постов на заполненной базе.
+    """
+
+    help = (
+        'Запускает проект во встроенном многопоточном WSGI-сервере, '
+        'нагружает страницы постов из нескольких потоков и сохраняет '
+        'p50/p95/p99 задержки и запросы в секунду по каждой странице '
+        'в JSON. По умолчанию замеряются только страницы чтения; '
+        'запись создает посты, комментарии и подписки, поэтому '
+        'включается флагом --allow-writes и только на копии базы '
+        '(см. generate_dataset)'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--urls',
+            nargs='+',
+            choices=list(TARGETS),
+            help=(
+                'Замеряемые страницы (по умолчанию все, доступные '
+                'без --allow-writes)'
+            ),
+        )
+        parser.add_argument(
+            '--allow-writes',
+            action='store_true',
+            help=(
+                'Замерять и страницы, меняющие данные в базе: создание '
+                'и редактирование постов, комментарии, подписки'
+            ),
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Количество одновременных клиентов',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Количество замеряемых запросов к каждой странице',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=20,
+            help='Количество незамеряемых запросов для прогрева кэшей',
+        )
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=200,
+            help='Количество случайных постов, к которым идут запросы',
+        )
+        parser.add_argument(
+            '--sessions',
+            type=int,
+            default=20,
+            help='Количество авторизованных подписчиков и авторов',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Зерно выбора страниц и пользователей',
+        )
+        parser.add_argument(
+            '--output',
+            default='benchmark.json',
+            help='Файл для результатов',
+        )
+        parser.add_argument(
+            '--compare',
+            help='Файл с результатами прошлого запуска для сравнения',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options['threads'] < 1 or options['requests'] < 1:
+            raise CommandError('--threads и --requests должны быть больше 0')
+        options['urls'] = self.get_urls(options)
+        if settings.DEBUG:
+            self.stderr.write(self.style.WARNING(
+                'DEBUG включен: задержки будут выше, чем в продакшене'
+            ))
+        rng = random.Random(options['seed'])
+        sample: Sample = self.load_sample(rng, options)
+        try:
+            results: Dict[str, Dict[str, Any]] = self.measure(
+                sample,
+                rng,
+                options,
+            )
+        finally:
+            logout(sample)
+
+        self.save(results, options)
+        if options['compare']:
+            self.compare(results, options['compare'])
+
+    def get_urls(self, options: Dict[str, Any]) -> List[str]:
+        """Возвращает замеряемые страницы с учетом --allow-writes."""
+        if options['allow_writes']:
+            return options['urls'] or list(TARGETS)
+        if options['urls'] is None:
+            return [name for name in TARGETS if name not in WRITE_TARGETS]
+        writes: List[str] = [
+            name for name in options['urls'] if name in WRITE_TARGETS
+        ]
+        if writes:
+            raise CommandError(
+                f'{", ".join(writes)} меняют данные в базе; добавьте '
+                '--allow-writes и запускайте тест на копии базы'
+            )
+        return options['urls']
+
+    def measure(self, sample: Sample, rng: random.Random,
+                options: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Нагружает страницы и возвращает сводку по каждой."""
+        csrf_token: str = get_random_string(
+            CSRF_TOKEN_LENGTH,
+            CSRF_ALLOWED_CHARS,
+        )
+        results: Dict[str, Dict[str, Any]] = {}
+        with serve() as address:
+            run = partial(self.run, address, csrf_token, options['threads'])
+            for name in options['urls']:
+                plan: Optional[List[Request]] = self.plan(
+                    name,
+                    sample,
+                    rng,
+                    options['warmup'] + options['requests'],
+                )
+                if plan is None:
+                    continue
+                run(plan[:options['warmup']])
+                results[name] = summarize(
+                    *run(plan[options['warmup']:])
+                )
+                self.report(name, results[name])
+        return results
+
+    def load_sample(self, rng: random.Random,
+                    options: Dict[str, Any]) -> Sample:
+        """Выбирает группы, посты и пользователей для запросов."""
+        groups: List[Tuple[int, str]] = list(
+            Group.objects.order_by('pk').values_list('pk', 'slug')
+        )
+        post_ids: List[int] = list(
+            Post.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        posts: List[SamplePost] = [
+            SamplePost(*row) for row in Post.objects.filter(
+                pk__in=rng.sample(
+                    post_ids,
+                    min(options['sample'], len(post_ids)),
+                ),
+            ).order_by('pk').values_list('pk', 'author__username', 'group')
+        ]
+        follower_ids: List[int] = list(
+            Follow.objects.order_by('user').values_list(
+                'user',
+                flat=True,
+            ).distinct()
+        )
+        followers: List[Tuple[str, str]] = [
+            (login(user), user.username) for user in User.objects.filter(
+                pk__in=rng.sample(
+                    follower_ids,
+                    min(options['sessions'], len(follower_ids)),
+                ),
+            ).order_by('pk')
+        ]
+        authors: Dict[str, str] = {
+            user.username: login(user) for user in User.objects.filter(
+                username__in=[
+                    post.author for post in posts[:options['sessions']]
+                ],
+            )
+        }
+        return Sample(
+            group_ids=[pk for pk, _ in groups],
+            group_slugs=[slug for _, slug in groups],
+            posts=posts,
+            followers=followers,
+            authors=authors,
+        )
+
+    def plan(self, name: str, sample: Sample, rng: random.Random,
+             count: int) -> Optional[List[Request]]:
+        """Составляет запросы к странице или None, если не хватает данных."""
+        try:
+            return [TARGETS[name](sample, rng) for _ in range(count)]
+        except IndexError:
+            self.stderr.write(self.style.WARNING(
+                f'{name}: в базе нет данных для запросов, пропускаю'
+            ))
+            return None
+
+    def run(self, address: Address, csrf_token: str, threads: int,
+            requests: List[Request]) -> Tuple[List[Outcome], float]:
+        """Выполняет запросы в threads потоков и замеряет общее время."""
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            started: float = time.perf_counter()
+            outcomes: List[Outcome] = list(
+                pool.map(partial(send, address, csrf_token), requests)
+            )
+            elapsed: float = time.perf_counter() - started
+        return outcomes, elapsed
+
+    def report(self, name: str, summary: Dict[str, Any]) -> None:
+        """Выводит результат замера страницы."""
+        self.stdout.write(
+            f'{name:<24} {summary["rps"]:>8.1f} req/s  '
+            + '  '.join(
+                f'p{percent} {summary[f"p{percent}_ms"]:>8.2f} мс'
+                for percent in PERCENTILES
+            )
+            + f'  ошибок: {summary["errors"]}'
+        )
+
+    def save(self, results: Dict[str, Dict[str, Any]],
+             options: Dict[str, Any]) -> None:
+        """Сохраняет результаты с параметрами запуска и размером базы."""
+        meta: Dict[str, Any] = {
+            key: options[key]
+            for key in ('threads', 'requests', 'warmup', 'sample', 'seed')
+        }
+        meta.update({
+            'dataset': {
+                model._meta.label: model.objects.count()
+                for model in (User, Group, Post, Comment, Follow)
+            },
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+        })
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(
+                {'meta': meta, 'results': results},
+                output,
+                ensure_ascii=False,
+                indent=2,
+                sort_keys=True,
+            )
+            output.write('\n')
+        self.stdout.write(self.style.SUCCESS(
+            f'Результаты сохранены в {options["output"]}'
+        ))
+
+    def compare(self, results: Dict[str, Dict[str, Any]],
+                path: str) -> None:
+        """Выводит изменение p95 и req/s относительно прошлого запуска."""
+        with open(path, encoding='utf-8') as previous_file:
+            previous: Dict[str, Dict[str, Any]] = json.load(
+                previous_file,
+            )['results']
+        for name, summary in results.items():
+            if name not in previous:
+                continue
+            before: Dict[str, Any] = previous[name]
+            self.stdout.write(
+                f'{name:<24} '
+                f'p95 {before["p95_ms"]:.2f} -> {summary["p95_ms"]:.2f} мс '
+                f'({_change(before["p95_ms"], summary["p95_ms"])}), '
+                f'{before["rps"]:.1f} -> {summary["rps"]:.1f} req/s '
+                f'({_change(before["rps"], summary["rps"])})'
+            )
@@ -0,0 +1,202 @@
+import os
+import time
+from collections import Counter
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Set, Tuple
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from core.models import StoredFile
+from core.thumbnails import delete_thumbnails, get_thumbnails
+from posts.models import Post
+
+# Относительное имя файла в хранилище и его размер.
+MediaFile = Tuple[str, int]
+
+
+def _batches(files: Iterable[MediaFile],
+             size: int) -> Iterator[List[MediaFile]]:
+    files = iter(files)
+    while True:
+        batch: List[MediaFile] = list(islice(files, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    """
+    Удаляет картинки, на которые не ссылается ни один пост и у которых
+    нет ссылок в StoredFile, и миниатюры, которых нет в хранилище ключей
+    sorl-thumbnail.
+    """
+
+    help = (
+        'Обходит каталог загрузок постов и каталог миниатюр, пачками '
+        'сверяет файлы с базой и удаляет неиспользуемые'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество файлов, сверяемых с базой одним запросом',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, какие файлы будут удалены',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=0,
+            help='Не больше указанного числа удалений в секунду',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60 * 60,
+            help=(
+                'Не трогать файлы моложе указанного числа секунд: их пост '
+                'может быть еще не сохранен'
+            ),
+        )
+        parser.add_argument(
+            '--skip-thumbnails',
+            action='store_true',
+            help='Не проверять каталог миниатюр',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        self.options = options
+        self.stats: Counter = Counter()
+        self.last_deleted: float = 0.0
+        self.cutoff: float = time.time() - options['min_age']
+
+        upload_to: str = Post._meta.get_field('image').upload_to
+        for batch in _batches(self.walk(upload_to), options['batch_size']):
+            names: List[str] = [name for name, _ in batch]
+            referenced: Set[str] = set(
+                Post.objects.filter(
+                    image__in=names,
+                ).values_list('image', flat=True)
+            ) | set(
+                StoredFile.objects.filter(
+                    name__in=names,
+                    references__gt=0,
+                ).values_list('name', flat=True)
+            )
+            for name, size in batch:
+                if name not in referenced:
+                    self.collect_image(name, size)
+
+        if not options['skip_thumbnails']:
+            thumbnails = self.walk(thumbnail_settings.THUMBNAIL_PREFIX)
+            for name, size in thumbnails:
+                if default.kvstore.get(ImageFile(name)) is None:
+                    self.stats['thumbnails'] += 1
+                    self.delete(name, size)
+
+        self.report()
+
+    def walk(self, directory: str) -> Iterator[MediaFile]:
+        """Перечисляет файлы каталога хранилища, не читая его целиком."""
+        root: str = default_storage.path('')
+        pending: List[str] = [default_storage.path(directory)]
+        while pending:
+            try:
+                entries = os.scandir(pending.pop())
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    self.stats['scanned'] += 1
+                    if stat.st_mtime > self.cutoff:
+                        self.stats['young'] += 1
+                        continue
+                    name: str = os.path.relpath(entry.path, root)
+                    yield name.replace(os.sep, '/'), stat.st_size
+
+    def is_orphan(self, name: str) -> bool:
+        """
+        Проверяет непосредственно перед удалением, что у картинки нет
+        ссылок: после обхода каталога ее могли загрузить повторно.
+        """
+        try:
+            if os.stat(default_storage.path(name)).st_mtime > self.cutoff:
+                return False
+        except FileNotFoundError:
+            return False
+        return not (
+            Post.objects.filter(image=name).exists()
+            or StoredFile.objects.filter(
+                name=name,
+                references__gt=0,
+            ).exists()
+        )
+
+    def collect_image(self, name: str, size: int) -> None:
+        """Удаляет картинку без ссылок вместе с ее миниатюрами."""
+        with transaction.atomic():
+            if not self.is_orphan(name):
+                self.stats['reused'] += 1
+                return
+            self._collect_image(name, size)
+
+    def _collect_image(self, name: str, size: int) -> None:
+        thumbnails: List[ImageFile] = get_thumbnails(name)
+        for thumbnail in thumbnails:
+            try:
+                size += default_storage.size(thumbnail.name)
+            except OSError:
+                pass
+        self.stats['images'] += 1
+        self.stats['thumbnails'] += len(thumbnails)
+        self.delete(name, size, delete_thumbnails)
+        if not self.options['dry_run']:
+            StoredFile.objects.filter(name=name, references=0).delete()
+
+    def delete(self, name: str, size: int, *cleanups: Any) -> None:
+        """Удаляет файл с учетом ограничения скорости."""
+        self.stats['bytes'] += size
+        if self.options['dry_run']:
+            self.stdout.write(name)
+            return
+        if self.options['rate'] > 0:
+            delay: float = (
+                self.last_deleted + 1 / self.options['rate'] - time.monotonic()
+            )
+            if delay > 0:
+                time.sleep(delay)
+            self.last_deleted = time.monotonic()
+        for cleanup in cleanups:
+            cleanup(name)
+        default_storage.delete(name)
+
+    def report(self) -> None:
+        """Выводит итоги сборки мусора."""
+        action, reclaimed = (
+            ('будет удалено', 'можно освободить')
+            if self.options['dry_run'] else ('удалено', 'освобождено')
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {self.stats["scanned"]}, '
+            f'пропущено новых: {self.stats["young"]}, '
+            f'использованных повторно: {self.stats["reused"]}, '
+            f'{action} картинок: {self.stats["images"]}, '
+            f'миниатюр: {self.stats["thumbnails"]}, '
+            f'{reclaimed}: {filesizeformat(self.stats["bytes"])} '
+            f'({self.stats["bytes"]} байт)'
+        ))
@@ -0,0 +1,399 @@
+import io
+import random
+import time
+from array import array
+from collections import Counter as Tally
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+from typing import (Any, Dict, Iterable, Iterator, List, NamedTuple, Tuple,
+                    Type)
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import (BaseCommand, CommandError,
+                                         CommandParser)
+from django.db import transaction
+from django.db.models import F, Max, Model
+from faker import Faker
+from PIL import Image, ImageOps
+
+from core.models import StoredFile
+from posts.counters import reset_all_counters
+from posts.images import IngestedImage, ingest_image
+from posts.invalidation import invalidate_all
+from posts.models import Comment, Follow, Group, Post, User
+from posts.search import rebuild_index
+from posts.timeline import rebuild_timelines
+
+# Даты постов равномерно распределены на --days дней после EPOCH,
+# чтобы набор данных не зависел от момента запуска.
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+# Доля постов, опубликованных в группах.
+GROUP_SHARE: float = 0.7
+# Комментарии появляются в течение недели после публикации поста.
+COMMENT_WINDOW: float = 7 * 24 * 60 * 60
+# Размер пула текстов: генерировать текст для каждой записи долго.
+TEXT_POOL_SIZE: int = 2000
+NAME_POOL_SIZE: int = 200
+
+
+class SyntheticImage(NamedTuple):
+    """Сохраненная картинка и ее характеристики."""
+
+    name: str
+    ingested: IngestedImage
+
+
+class Popularity(NamedTuple):
+    """Пользователи в порядке популярности и накопленные веса."""
+
+    user_ids: List[int]
+    cum_weights: List[float]
+
+
+@contextmanager
+def _explicit_dates(*fields: Any) -> Iterator[None]:
+    # bulk_create иначе заменил бы сгенерированные даты текущим временем.
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _max_pk(model: Type[Model]) -> int:
+    return model.objects.aggregate(pk=Max('pk'))['pk'] or 0
+
+
+class Command(BaseCommand):
+    """
+    Заполняет базу синтетическими пользователями, группами, постами,
+    комментариями и подписками для нагрузочного тестирования.
+    """
+
+    help = (
+        'Генерирует воспроизводимый по --seed набор данных: подписки '
+        'и авторство распределены по степенному закону. Записи '
+        'вставляются пачками через bulk_create, после чего заново '
+        'строятся ленты подписок, счетчики и поисковый индекс'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        counts: Dict[str, Tuple[int, str]] = {
+            'users': (1000, 'Количество пользователей'),
+            'groups': (20, 'Количество групп'),
+            'posts': (10000, 'Количество постов'),
+            'comments': (20000, 'Количество комментариев'),
+            'follows': (5000, 'Количество попыток подписки'),
+        }
+        for name, (default, help_text) in counts.items():
+            parser.add_argument(f'--{name}', type=int, default=default,
+                                help=help_text)
+        parser.add_argument(
+            '--images',
+            type=float,
+            default=0,
+            help='Доля постов с картинками, от 0 до 1',
+        )
+        parser.add_argument(
+            '--image-pool',
+            type=int,
+            default=20,
+            help='Количество разных картинок',
+        )
+        parser.add_argument(
+            '--zipf',
+            type=float,
+            default=1.2,
+            help='Показатель степенного распределения популярности авторов',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='За сколько дней публикуются посты',
+        )
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора случайных чисел')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Количество записей в одном INSERT',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='synthetic',
+            help='Префикс имен пользователей и slug групп',
+        )
+        parser.add_argument(
+            '--password',
+            default='synthetic',
+            help='Пароль всех пользователей',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        self.options = options
+        self.prefix: str = options['prefix']
+        taken: bool = User.objects.filter(
+            username__startswith=f'{self.prefix}-',
+        ).exists()
+        if taken:
+            raise CommandError(
+                f'Пользователи с префиксом {self.prefix} уже есть, '
+                'укажите другой --prefix'
+            )
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(options['seed'])
+        self.texts: List[str] = [
+            self.fake.paragraph(nb_sentences=self.rng.randint(1, 6))
+            for _ in range(TEXT_POOL_SIZE)
+        ]
+        started: float = time.monotonic()
+
+        with _explicit_dates(
+            Post._meta.get_field('pub_date'),
+            Comment._meta.get_field('created'),
+        ):
+            user_ids: List[int] = self.create_users()
+            popularity: Popularity = self.popularity(user_ids)
+            group_ids: List[int] = self.create_groups()
+            self.create_follows(user_ids, popularity)
+            images: List[SyntheticImage] = self.create_images()
+            self.create_posts(popularity, group_ids, images)
+            self.create_comments(user_ids)
+        self.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с'
+        ))
+
+    @contextmanager
+    def stage(self, title: str) -> Iterator[None]:
+        """Выполняет этап в транзакции и сообщает его длительность."""
+        started: float = time.monotonic()
+        with transaction.atomic():
+            yield
+        self.stdout.write(f'{title} за {time.monotonic() - started:.1f} с')
+
+    def bulk_create(self, model: Type[Model], objects: Iterable[Model],
+                    ignore_conflicts: bool = False) -> None:
+        """Вставляет записи пачками по --batch-size."""
+        objects = iter(objects)
+        while True:
+            batch: List[Model] = list(
+                islice(objects, self.options['batch_size'])
+            )
+            if not batch:
+                return
+            model.objects.bulk_create(
+                batch,
+                ignore_conflicts=ignore_conflicts,
+            )
+
+    def create_users(self) -> List[int]:
+        """Создает пользователей и возвращает их id."""
+        count: int = self.options['users']
+        first_names: List[str] = [
+            self.fake.first_name() for _ in range(NAME_POOL_SIZE)
+        ]
+        last_names: List[str] = [
+            self.fake.last_name() for _ in range(NAME_POOL_SIZE)
+        ]
+        password: str = make_password(self.options['password'])
+        before: int = _max_pk(User)
+        with self.stage(f'Пользователей: {count}'):
+            self.bulk_create(User, (
+                User(
+                    username=f'{self.prefix}-{number}',
+                    first_name=self.rng.choice(first_names),
+                    last_name=self.rng.choice(last_names),
+                    password=password,
+                ) for number in range(count)
+            ))
+        return list(
+            User.objects.filter(pk__gt=before).order_by('pk').values_list(
+                'pk',
+                flat=True,
+            )
+        )
+
+    def popularity(self, user_ids: List[int]) -> Popularity:
+        """
+        Случайно упорядочивает пользователей по популярности с весами
+        1 / rank ** zipf.
+        """
+        ranked: List[int] = list(user_ids)
+        self.rng.shuffle(ranked)
+        return Popularity(ranked, list(accumulate(
+            1 / rank ** self.options['zipf']
+            for rank in range(1, len(ranked) + 1)
+        )))
+
+    def create_groups(self) -> List[int]:
+        """Создает группы и возвращает их id."""
+        count: int = self.options['groups']
+        before: int = _max_pk(Group)
+        with self.stage(f'Групп: {count}'):
+            self.bulk_create(Group, (
+                Group(
+                    title=f'{self.fake.word().capitalize()} {number}',
+                    slug=f'{self.prefix}-{number}',
+                    description=self.fake.sentence(),
+                ) for number in range(count)
+            ))
+        return list(
+            Group.objects.filter(pk__gt=before).values_list('pk', flat=True)
+        )
+
+    def create_follows(self, user_ids: List[int],
+                       popularity: Popularity) -> None:
+        """Подписывает случайных читателей на популярных авторов."""
+        count: int = self.options['follows']
+        if not user_ids:
+            return
+        authors: List[int] = self.rng.choices(
+            popularity.user_ids,
+            cum_weights=popularity.cum_weights,
+            k=count,
+        )
+        before: int = Follow.objects.count()
+        with self.stage('Подписки'):
+            self.bulk_create(Follow, (
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id, author_id in (
+                    (self.rng.choice(user_ids), author_id)
+                    for author_id in authors
+                )
+                if user_id != author_id
+            ), ignore_conflicts=True)
+        self.stdout.write(
+            f'Подписок создано: {Follow.objects.count() - before}'
+        )
+
+    def create_images(self) -> List[SyntheticImage]:
+        """Сохраняет пул картинок для постов."""
+        if self.options['images'] <= 0:
+            return []
+        images: List[SyntheticImage] = []
+        field = Post._meta.get_field('image')
+        for number in range(self.options['image_pool']):
+            size: Tuple[int, int] = (
+                self.rng.randint(400, 1600),
+                self.rng.randint(300, 1200),
+            )
+            colors = [
+                tuple(self.rng.randrange(256) for _ in range(3))
+                for _ in range(2)
+            ]
+            content = io.BytesIO()
+            ImageOps.colorize(
+                Image.linear_gradient('L').resize(size),
+                *colors,
+            ).save(content, 'JPEG')
+            ingested: IngestedImage = ingest_image(SimpleUploadedFile(
+                f'{self.prefix}-{number}.jpg',
+                content.getvalue(),
+            ))
+            images.append(SyntheticImage(
+                default_storage.save(
+                    field.generate_filename(None, ingested.file.name),
+                    ingested.file,
+                ),
+                ingested,
+            ))
+        return images
+
+    def create_posts(self, popularity: Popularity, group_ids: List[int],
+                     images: List[SyntheticImage]) -> None:
+        """Создает посты популярных авторов, часть - с картинками."""
+        count: int = self.options['posts']
+        self.first_post_id = _max_pk(Post) + 1
+        if not popularity.user_ids:
+            return
+        authors: List[int] = self.rng.choices(
+            popularity.user_ids,
+            cum_weights=popularity.cum_weights,
+            k=count,
+        )
+        references: Tally = Tally()
+        with self.stage(f'Постов: {count}'):
+            self.bulk_create(Post, (
+                self.make_post(author_id, group_ids, images, references)
+                for author_id in authors
+            ))
+            for name, added in references.items():
+                StoredFile.objects.filter(name=name).update(
+                    references=F('references') + added,
+                )
+
+    def make_post(self, author_id: int, group_ids: List[int],
+                  images: List[SyntheticImage], references: Tally) -> Post:
+        """Возвращает несохраненный пост."""
+        post = Post(
+            text=self.rng.choice(self.texts),
+            author_id=author_id,
+            group_id=(
+                self.rng.choice(group_ids)
+                if group_ids and self.rng.random() < GROUP_SHARE else None
+            ),
+            pub_date=EPOCH + timedelta(
+                seconds=self.rng.random() * self.options['days'] * 86400,
+            ),
+        )
+        if images and self.rng.random() < self.options['images']:
+            image: SyntheticImage = self.rng.choice(images)
+            post.image = image.name
+            post.image_width = image.ingested.width
+            post.image_height = image.ingested.height
+            post.image_size = image.ingested.size
+            post.image_color = image.ingested.color
+            references[image.name] += 1
+        return post
+
+    def create_comments(self, user_ids: List[int]) -> None:
+        """Создает комментарии к случайным постам после их публикации."""
+        count: int = self.options['comments']
+        post_ids: array = array('q')
+        published: array = array('d')
+        posts = Post.objects.filter(
+            pk__gte=self.first_post_id,
+        ).order_by('pk').values_list('pk', 'pub_date')
+        for post_id, pub_date in posts.iterator():
+            post_ids.append(post_id)
+            published.append(pub_date.timestamp())
+        if not post_ids or not user_ids:
+            return
+
+        def make_comment() -> Comment:
+            index: int = self.rng.randrange(len(post_ids))
+            return Comment(
+                post_id=post_ids[index],
+                author_id=self.rng.choice(user_ids),
+                text=self.rng.choice(self.texts),
+                created=datetime.fromtimestamp(
+                    published[index] + self.rng.random() * COMMENT_WINDOW,
+                    timezone.utc,
+                ),
+            )
+
+        with self.stage(f'Комментариев: {count}'):
+            self.bulk_create(Comment, (make_comment() for _ in range(count)))
+
+    def rebuild(self) -> None:
+        """
+        Восстанавливает данные, которые обычно поддерживают сигналы.
+        """
+        with self.stage('Ленты, счетчики и поисковый индекс'):
+            entries: int = rebuild_timelines()
+            reset_all_counters()
+            indexed: int = rebuild_index()
+        invalidate_all()
+        self.stdout.write(
+            f'Записей лент: {entries}, проиндексировано постов: {indexed}'
+        )
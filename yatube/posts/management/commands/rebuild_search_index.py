@@ -0,0 +1,17 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.search import rebuild_index
+
+
+class Command(BaseCommand):
+    """Заново строит полнотекстовый индекс постов."""
+
+    help = 'Перестраивает поисковый индекс после массовых изменений постов'
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        with transaction.atomic():
+            count: int = rebuild_index()
+        self.stdout.write(f'Проиндексировано постов: {count}')
@@ -0,0 +1,93 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from django.db.models import Count
+
+from posts.counters import COUNTED_RELATIONS, parse_scope
+from posts.models import Counter
+
+
+class Command(BaseCommand):
+    """Сверяет денормализованные счетчики с данными и исправляет их."""
+
+    help = 'Пересчитывает разошедшиеся счетчики пачками'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.COUNTERS_BATCH_SIZE,
+            help='Количество счетчиков, сверяемых за одну транзакцию',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, ничего не исправляя',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        checked: int = 0
+        fixed: int = 0
+        last_pk: int = 0
+
+        while True:
+            with transaction.atomic():
+                batch: List[Counter] = list(
+                    Counter.objects.filter(
+                        pk__gt=last_pk,
+                    ).order_by('pk')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                checked += len(batch)
+
+                drifted: List[Counter] = self.reconcile_batch(batch)
+                for counter in drifted:
+                    self.stdout.write(f'{counter.scope}: {counter.value}')
+                fixed += len(drifted)
+                if drifted and not options['dry_run']:
+                    Counter.objects.bulk_update(drifted, ['value'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено счетчиков: {checked}, '
+            f'{"найдено" if options["dry_run"] else "исправлено"} '
+            f'расхождений: {fixed}'
+        ))
+
+    def reconcile_batch(self, batch: List[Counter]) -> List[Counter]:
+        """
+        Возвращает счетчики пачки с исправленными значениями.
+
+        Для каждого вида счетчиков пачки выполняется один
+        сгруппированный COUNT.
+        """
+        by_prefix: Dict[str, Dict[Optional[int], Counter]] = defaultdict(
+            dict,
+        )
+        for counter in batch:
+            prefix, key = parse_scope(counter.scope)
+            if prefix in COUNTED_RELATIONS:
+                by_prefix[prefix][key] = counter
+
+        drifted: List[Counter] = []
+        for prefix, counters in by_prefix.items():
+            model, field = COUNTED_RELATIONS[prefix]
+            if field is None:
+                actual: Dict[Optional[int], int] = {
+                    None: model.objects.count(),
+                }
+            else:
+                actual = dict(
+                    model.objects.filter(
+                        **{f'{field}__in': list(counters)},
+                    ).order_by().values_list(field).annotate(Count('pk'))
+                )
+            for key, counter in counters.items():
+                if counter.value != actual.get(key, 0):
+                    counter.value = actual.get(key, 0)
+                    drifted.append(counter)
+        return drifted
@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core.thumbnails import Preset, generate_thumbnail, get_presets
+from posts.invalidation import invalidate_all
+from posts.models import Post
+
+Task = Tuple[str, str, Dict[str, Any]]
+
+
+def _warm(task: Task) -> bool:
+    name, geometry_string, options = task
+    return generate_thumbnail(name, geometry_string, options) is not None
+
+
+class Command(BaseCommand):
+    """Создает недостающие миниатюры изображений постов."""
+
+    help = (
+        'Создает недостающие миниатюры изображений постов в пуле '
+        'процессов. Готовые миниатюры пропускаются, поэтому прерванный '
+        'запуск можно просто повторить или продолжить с --after-id.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Количество процессов; 0 - создавать в текущем процессе',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Количество постов, обрабатываемых за один шаг',
+        )
+        parser.add_argument(
+            '--preset',
+            action='append',
+            dest='presets',
+            help='Имя пресета миниатюры (по умолчанию POST_IMAGE_PRESETS)',
+        )
+        parser.add_argument(
+            '--after-id',
+            type=int,
+            default=0,
+            help='Начать с постов, id которых больше указанного',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        presets: List[Preset] = get_presets(
+            options['presets'] or settings.POST_IMAGE_PRESETS
+        )
+        posts = Post.objects.exclude(image='').order_by('pk')
+        last_id: int = options['after_id']
+        total: int = posts.filter(pk__gt=last_id).count()
+        stats: Counter = Counter()
+        started: float = time.monotonic()
+
+        executor: Optional[ProcessPoolExecutor] = None
+        if options['workers'] > 0:
+            executor = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        try:
+            while True:
+                batch: List[Tuple[int, str]] = list(
+                    posts.filter(
+                        pk__gt=last_id,
+                    ).values_list('pk', 'image')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                tasks: List[Task] = [
+                    (name, geometry_string, preset_options)
+                    for _, name in batch
+                    for geometry_string, preset_options in presets
+                    if default.backend.get_ready_thumbnail(
+                        ImageFile(name),
+                        geometry_string,
+                        preset_options,
+                    ) is None
+                ]
+                stats['skipped'] += len(batch) * len(presets) - len(tasks)
+                results: Iterable[bool] = (
+                    executor.map(_warm, tasks) if executor
+                    else map(_warm, tasks)
+                )
+                for created in results:
+                    stats['created' if created else 'failed'] += 1
+
+                stats['posts'] += len(batch)
+                last_id = batch[-1][0]
+                self.stdout.write(
+                    f'Постов: {stats["posts"]}/{total}, '
+                    f'создано миниатюр: {stats["created"]}, '
+                    f'готовых: {stats["skipped"]}, '
+                    f'ошибок: {stats["failed"]}, '
+                    f'последний id: {last_id}'
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            # Кэшированные страницы показывают исходные изображения.
+            if stats['created']:
+                invalidate_all()
+
+        elapsed: float = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {elapsed:.1f} с: '
+            f'{stats["created"] / elapsed:.1f} миниатюр/с, '
+            f'{stats["posts"] / elapsed:.1f} постов/с'
+        ))
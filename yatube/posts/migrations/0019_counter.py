@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=64, unique=True, verbose_name='Область счетчика')),
+                ('value', models.IntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Счетчик',
+                'verbose_name_plural': 'Счетчики',
+            },
+        ),
+    ]
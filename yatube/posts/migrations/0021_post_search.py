@@ -0,0 +1,30 @@
+from django.db import migrations
+
+# Полнотекстовый индекс FTS5 по тексту постов; rowid записи индекса
+# совпадает с id поста. Индекс обновляется обработчиками сигналов
+# Post (см. posts.search).
+CREATE_SEARCH_INDEX = [
+    """
+    CREATE VIRTUAL TABLE posts_post_search USING fts5(
+        text,
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    INSERT INTO posts_post_search(rowid, text)
+    SELECT id, text FROM posts_post
+    """,
+]
+
+DROP_SEARCH_INDEX = 'DROP TABLE IF EXISTS posts_post_search'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH_INDEX, DROP_SEARCH_INDEX),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_post_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_color',
+            field=models.CharField(blank=True, editable=False, max_length=7, verbose_name='Средний цвет картинки'),
+        ),
+    ]
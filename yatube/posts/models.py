@@ -64,11 +64,49 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True,
     )
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер картинки в байтах',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_color = models.CharField(
+        'Средний цвет картинки',
+        max_length=7,
+        blank=True,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Публикация'
         verbose_name_plural = 'Публикации'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx',
+            ),
+        ]
 
     def __str__(self) -> str:
         """Возвращает первые 15 символов текста поста"""
@@ -108,6 +146,12 @@ class Comment(models.Model):
         ordering = ('-created',)
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_created_idx',
+            ),
+        ]
 
     def __str__(self) -> str:
         """Возвращает первые 15 символов комментария"""
@@ -144,7 +188,89 @@ class Follow(models.Model):
                 check=~models.Q(user=models.F('author')),
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx',
+            ),
+        ]
 
     def __str__(self) -> str:
         """Строковое представление подписки"""
         return f'{self.user} подписан на {self.author}'
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя"""
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Читатель',
+        related_name='timeline',
+        on_delete=models.CASCADE,
+    )
+
+    post = models.ForeignKey(
+        Post,
+        verbose_name='Пост',
+        related_name='timeline_entries',
+        on_delete=models.CASCADE,
+    )
+
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор поста',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique timeline entry'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='timeline_user_author_idx',
+            ),
+        ]
+
+    def __str__(self) -> str:
+        """Строковое представление записи ленты"""
+        return f'{self.post} в ленте {self.user}'
+
+
+class Counter(models.Model):
+    """Денормализованный счетчик (количество постов в ленте и т.п.)"""
+
+    scope = models.CharField(
+        verbose_name='Область счетчика',
+        max_length=64,
+        unique=True,
+    )
+
+    value = models.IntegerField(
+        verbose_name='Значение',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Счетчик'
+        verbose_name_plural = 'Счетчики'
+
+    def __str__(self) -> str:
+        """Строковое представление счетчика"""
+        return f'{self.scope}: {self.value}'
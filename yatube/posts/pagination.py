@@ -0,0 +1,314 @@
+"""
+Курсорная (keyset) пагинация лент постов.
+
+Страница ленты выбирается условием по ключу (дата публикации, id)
+вместо OFFSET, поэтому глубокие страницы стоят столько же, сколько
+первая, а COUNT(*) для курсорных страниц не выполняется. Курсоры
+передаются в адресе страницы непрозрачными токенами ?after= и ?before=.
+Старые ссылки вида ?page=N обслуживаются обычной постраничной
+навигацией, но не глубже PAGINATION_MAX_PAGE. Комментарии к посту
+листаются тем же курсором по дате создания.
+
+Ленту можно собрать из нескольких наборов с одинаковой сортировкой
+(MergedQuerySet): они читаются одним запросом UNION ALL, который SQLite
+сливает по индексам наборов без сортировки во временном B-дереве.
+"""
+import base64
+import binascii
+from typing import (Any, Callable, Iterable, Iterator, List, Mapping,
+                    Optional, Set, Tuple, Union)
+
+from django.conf import settings
+from django.core.paginator import (EmptyPage, Page, PageNotAnInteger,
+                                   Paginator)
+from django.db.models import Model, Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+Cursor = Tuple[Any, int]
+CountProvider = Callable[[], Tuple[int, bool]]
+
+
+def encode_token(key: str, pk: int) -> str:
+    """Упаковывает ключ сортировки и id в непрозрачный токен курсора."""
+    return base64.urlsafe_b64encode(
+        f'{key}|{pk}'.encode()
+    ).decode().rstrip('=')
+
+
+def decode_token(token: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Распаковывает токен курсора; для некорректного возвращает None."""
+    if not token:
+        return None
+    try:
+        raw: str = base64.urlsafe_b64decode(
+            token + '=' * (-len(token) % 4)
+        ).decode()
+        key, pk = raw.rsplit('|', 1)
+        return key, int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class MergedQuerySet:
+    """
+    Объединение наборов записей с одинаковой сортировкой.
+
+    Заменяет условие OR по разным индексам с DISTINCT, для которого
+    SQLite сортирует строки во временном B-дереве. filter и order_by
+    применяются к каждому набору, а срез читается одним запросом
+    UNION ALL: каждый набор идет по своему индексу, и SQLite сливает
+    их, останавливаясь на нужной записи. Записи с одинаковым ключом
+    сортировки, попавшие в несколько наборов, выдаются один раз.
+    Поддерживает только то, что нужно CursorPaginator.
+    """
+
+    ordered: bool = True
+
+    def __init__(self, querysets: Iterable[QuerySet]) -> None:
+        self.querysets: List[QuerySet] = list(querysets)
+        self.model = self.querysets[0].model
+
+    @property
+    def query(self) -> Any:
+        return self.querysets[0].query
+
+    def filter(self, *args: Any, **kwargs: Any) -> 'MergedQuerySet':
+        return MergedQuerySet(
+            queryset.filter(*args, **kwargs) for queryset in self.querysets
+        )
+
+    def order_by(self, *fields: str) -> 'MergedQuerySet':
+        return MergedQuerySet(
+            queryset.order_by(*fields) for queryset in self.querysets
+        )
+
+    def _union(self) -> QuerySet:
+        first, *others = (
+            queryset.order_by() for queryset in self.querysets
+        )
+        return first.union(*others, all=True).order_by(*self.query.order_by)
+
+    def _merge(self, limit: Optional[int] = None) -> List[Model]:
+        fields: List[str] = [
+            field.lstrip('-') for field in self.query.order_by
+        ]
+        while True:
+            rows: List[Model] = list(
+                self._union()[:limit] if limit is not None
+                else self._union()
+            )
+            keys: Set[Tuple[Any, ...]] = set()
+            objects: List[Model] = []
+            for obj in rows:
+                key: Tuple[Any, ...] = tuple(
+                    getattr(obj, field) for field in fields
+                )
+                if key not in keys:
+                    keys.add(key)
+                    objects.append(obj)
+            # Повторы из разных наборов укоротили срез: читаем больше.
+            if limit is None or len(objects) >= limit or len(rows) < limit:
+                return objects
+            limit *= 2
+
+    def __getitem__(self, key: Union[int, slice]) -> Any:
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        return self._merge(key.stop)[key.start:key.stop]
+
+    def __iter__(self) -> Iterator[Model]:
+        return iter(self._merge())
+
+    def count(self) -> int:
+        return len(self._merge())
+
+
+class CursorPaginator(Paginator):
+    """
+    Пагинатор с курсорным режимом.
+
+    Ключ пагинации берется из сортировки набора постов: первое поле -
+    дата, второе - уникальный id (по умолчанию pk). Обе части ключа
+    упорядочены по убыванию. Количество постов берется у count_provider,
+    если он передан, вместо COUNT(*).
+    """
+
+    def __init__(self, object_list: Union[QuerySet, MergedQuerySet],
+                 per_page: int,
+                 max_page: Optional[int] = None,
+                 count_provider: Optional[CountProvider] = None,
+                 **kwargs: Any) -> None:
+        ordering = (
+            object_list.query.order_by
+            or object_list.model._meta.ordering
+        )
+        self.date_field: str = ordering[0].lstrip('-')
+        self.id_field: str = (
+            ordering[1].lstrip('-') if len(ordering) > 1 else 'pk'
+        )
+        self.max_page: int = max_page or settings.PAGINATION_MAX_PAGE
+        self.count_provider: Optional[CountProvider] = count_provider
+        self.count_is_approximate: bool = False
+        super().__init__(
+            object_list.order_by(
+                f'-{self.date_field}',
+                f'-{self.id_field}',
+            ),
+            per_page,
+            **kwargs,
+        )
+
+    def encode_cursor(self, obj: Model) -> str:
+        """Возвращает непрозрачный токен курсора для объекта."""
+        return encode_token(
+            getattr(obj, self.date_field).isoformat(),
+            getattr(obj, self.id_field),
+        )
+
+    @staticmethod
+    def decode_cursor(token: Optional[str]) -> Optional[Cursor]:
+        """Разбирает токен курсора; для некорректного возвращает None."""
+        value: Optional[Tuple[str, int]] = decode_token(token)
+        if value is None:
+            return None
+        try:
+            date = parse_datetime(value[0])
+        except ValueError:
+            return None
+        if date is None:
+            return None
+        return date, value[1]
+
+    @cached_property
+    def count(self) -> int:
+        """Количество объектов (при приблизительном счете - нижняя граница)."""
+        if self.count_provider is None:
+            return Paginator.count.func(self)
+        count, self.count_is_approximate = self.count_provider()
+        return count
+
+    @property
+    def page_range(self) -> range:
+        """Номера страниц, доступных в режиме совместимости."""
+        return range(1, min(self.num_pages, self.max_page) + 1)
+
+    def get_page(self, number: Any) -> Page:
+        """
+        Возвращает страницу по номеру, не глубже max_page.
+
+        Режим совместимости для ссылок вида ?page=N.
+        """
+        try:
+            number = min(self.validate_number(number), self.max_page)
+        except PageNotAnInteger:
+            number = 1
+        except EmptyPage:
+            number = min(self.num_pages, self.max_page)
+        return self.page(number)
+
+    def get_cursor_page(self, after: Optional[str] = None,
+                        before: Optional[str] = None) -> Page:
+        """Возвращает страницу, соседнюю с курсором after или before."""
+        before_cursor: Optional[Cursor] = self.decode_cursor(before)
+        if before_cursor is not None:
+            objects: List[Model] = list(
+                self.object_list.filter(
+                    self._cursor_q(before_cursor, 'gt')
+                ).order_by(
+                    self.date_field,
+                    self.id_field,
+                )[:self.per_page + 1]
+            )
+            if objects:
+                has_previous: bool = len(objects) > self.per_page
+                return self._cursor_page(
+                    objects[:self.per_page][::-1],
+                    has_previous=has_previous,
+                    has_next=True,
+                    key=f'before-{before}',
+                )
+
+        after_cursor: Optional[Cursor] = self.decode_cursor(after)
+        object_list: QuerySet = self.object_list
+        if after_cursor is not None:
+            object_list = object_list.filter(
+                self._cursor_q(after_cursor, 'lt')
+            )
+
+        objects = list(object_list[:self.per_page + 1])
+        return self._cursor_page(
+            objects[:self.per_page],
+            has_previous=after_cursor is not None,
+            has_next=len(objects) > self.per_page,
+            key=f'after-{after}' if after_cursor is not None else 'first',
+        )
+
+    def _cursor_q(self, cursor: Cursor, lookup: str) -> Q:
+        """
+        Условие "ключ строго после курсора".
+
+        Первое слагаемое - диапазон по дате, по которому SQLite
+        начинает обход индекса с позиции курсора.
+        """
+        date, pk = cursor
+        return (
+            Q(**{f'{self.date_field}__{lookup}e': date})
+            & (
+                Q(**{f'{self.date_field}__{lookup}': date})
+                | Q(**{f'{self.id_field}__{lookup}': pk})
+            )
+        )
+
+    def _cursor_page(self, objects: List[Model], has_previous: bool,
+                     has_next: bool, key: str) -> Page:
+        page: Page = Page(objects, None, self)
+        page.is_cursor = True
+        page.previous_cursor = (
+            self.encode_cursor(objects[0])
+            if has_previous and objects else None
+        )
+        page.next_cursor = (
+            self.encode_cursor(objects[-1])
+            if has_next and objects else None
+        )
+        page.key = key
+        return page
+
+    def _get_page(self, *args: Any, **kwargs: Any) -> Page:
+        page: Page = super()._get_page(*args, **kwargs)
+        page.is_cursor = False
+        page.key = f'page-{page.number}'
+        return page
+
+
+def get_page_obj(post_list: Union[QuerySet, MergedQuerySet],
+                 params: Mapping[str, str],
+                 count_provider: Optional[CountProvider] = None) -> Page:
+    """
+    Возвращает объект класса Page для пагинации.
+
+    Номер страницы (?page=) включает постраничный режим совместимости,
+    в остальных случаях страница выбирается по курсору.
+    """
+    paginator: CursorPaginator = CursorPaginator(
+        post_list,
+        settings.LIMIT_OF_RECORDS,
+        count_provider=count_provider,
+    )
+    if 'page' in params:
+        return paginator.get_page(params.get('page'))
+    return paginator.get_cursor_page(
+        after=params.get('after'),
+        before=params.get('before'),
+    )
+
+
+def get_comments_page(comment_list: QuerySet,
+                      after: Optional[str] = None) -> Page:
+    """Возвращает порцию комментариев, следующую за курсором after."""
+    paginator: CursorPaginator = CursorPaginator(
+        comment_list.select_related('author').order_by('-created', '-id'),
+        settings.COMMENTS_PER_PAGE,
+    )
+    return paginator.get_cursor_page(after=after)
@@ -0,0 +1,144 @@
+"""
+Полнотекстовый поиск по постам.
+
+Тексты постов хранятся в виртуальной таблице FTS5 posts_post_search
+(rowid записи равен id поста), которую обновляют обработчики сигналов
+Post. Запрос к индексу возвращает только подходящие посты, поэтому
+стоимость поиска зависит от числа совпадений, а не от размера таблицы
+постов. Результаты упорядочены по релевантности (bm25) и листаются
+курсором по паре (ранг, id).
+"""
+import re
+from typing import Any, List, Optional, Tuple
+
+from django.db import connection
+from django.db.models import QuerySet
+
+from .models import Post
+from .pagination import decode_token, encode_token
+
+SEARCH_TABLE: str = 'posts_post_search'
+# Больше слов в запросе не учитывается.
+MAX_TERMS: int = 10
+WORD = re.compile(r'\w+')
+
+SearchCursor = Tuple[float, int]
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Превращает строку поиска в запрос FTS5.
+
+    Каждое слово ищется как префикс, синтаксис FTS5 из строки
+    не пропускается. Для строки без слов возвращает None.
+    """
+    words: List[str] = WORD.findall(query)[:MAX_TERMS]
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def encode_cursor(rank: float, post_id: int) -> str:
+    """Возвращает непрозрачный токен курсора результатов поиска."""
+    return encode_token(repr(rank), post_id)
+
+
+def decode_cursor(token: Optional[str]) -> Optional[SearchCursor]:
+    """Разбирает токен курсора; для некорректного возвращает None."""
+    value: Optional[Tuple[str, int]] = decode_token(token)
+    if value is None:
+        return None
+    try:
+        return float(value[0]), value[1]
+    except ValueError:
+        return None
+
+
+def index_post(post: Post) -> None:
+    """Добавляет текст поста в индекс или обновляет его."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s',
+            [post.pk],
+        )
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE}(rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text],
+        )
+
+
+def unindex_post(post_id: int) -> None:
+    """Удаляет пост из индекса."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s',
+            [post_id],
+        )
+
+
+def rebuild_index() -> int:
+    """
+    Заново строит индекс по всем постам.
+
+    Возвращает количество проиндексированных постов.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE}(rowid, text) '
+            f'SELECT id, text FROM {Post._meta.db_table}'
+        )
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"
+        )
+        cursor.execute(f'SELECT COUNT(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def filter_matching(queryset: QuerySet, match: str) -> QuerySet:
+    """Оставляет в наборе постов подходящие под запрос FTS5."""
+    return queryset.extra(
+        where=[
+            f'{Post._meta.db_table}.id IN (SELECT rowid FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s)'
+        ],
+        params=[match],
+    )
+
+
+def search_posts(query: str, after: Optional[str],
+                 limit: int) -> Tuple[List[Post], Optional[str]]:
+    """
+    Возвращает порцию найденных постов после курсора after
+    и курсор следующей порции.
+    """
+    match: Optional[str] = build_match_query(query)
+    if match is None:
+        return [], None
+
+    sql: str = (
+        f'SELECT rowid, rank FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s'
+    )
+    params: List[Any] = [match]
+    cursor_value: Optional[SearchCursor] = decode_cursor(after)
+    if cursor_value is not None:
+        sql += ' AND (rank > %s OR (rank = %s AND rowid > %s))'
+        params.extend([cursor_value[0], cursor_value[0], cursor_value[1]])
+    sql += ' ORDER BY rank, rowid LIMIT %s'
+    params.append(limit + 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows: List[Tuple[int, float]] = cursor.fetchall()
+
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [post_id for post_id, _ in rows[:limit]]
+    )
+    next_cursor: Optional[str] = (
+        encode_cursor(rows[limit - 1][1], rows[limit - 1][0])
+        if len(rows) > limit else None
+    )
+    return [
+        posts[post_id] for post_id, _ in rows[:limit] if post_id in posts
+    ], next_cursor
@@ -0,0 +1,210 @@
+from typing import Any, FrozenSet, List, Optional
+
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from core.storage import acquire_file, release_file
+from core.thumbnails import thumbnails_generated
+
+from .counters import (change_counters, comments_scope, followers_scope,
+                       following_scope, group_scope, post_scopes,
+                       reset_counters, user_scopes)
+from .invalidation import (GROUPS, author_feeds, bump, follow_feed,
+                           group_feed, post_feeds, post_page, profile_page)
+from .models import Comment, Follow, Group, Post, User
+from .search import index_post, unindex_post
+from .timeline import (backfill_timeline, fan_out_post, prune_timeline,
+                       withdraw_post)
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender: Any, instance: Post, **kwargs: Any) -> None:
+    """Запоминает прежние группу, текст и картинку редактируемого поста."""
+    (
+        instance._previous_group_id,
+        instance._previous_text,
+        instance._previous_image,
+    ) = (
+        instance.pk and Post.objects.filter(
+            pk=instance.pk,
+        ).values_list('group_id', 'text', 'image').first()
+    ) or (None, None, '')
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender: Any, instance: Post, created: bool,
+               **kwargs: Any) -> None:
+    """
+    Раскладывает новый пост по лентам, обновляет счетчики, версии
+    кэшированных лент, поисковый индекс и ссылки на картинки.
+    """
+    previous_image: str = getattr(instance, '_previous_image', '')
+    if instance.image.name != previous_image:
+        if instance.image:
+            acquire_file(instance.image.name)
+        if previous_image:
+            release_file(previous_image)
+
+    if created:
+        change_counters(post_scopes(instance), 1)
+        fan_out_post(instance)
+        index_post(instance)
+        bump(post_feeds(instance))
+        return
+
+    if getattr(instance, '_previous_text', None) != instance.text:
+        index_post(instance)
+
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id != instance.group_id:
+        if previous_group_id:
+            change_counters([group_scope(previous_group_id)], -1)
+            bump([group_feed(previous_group_id)])
+        if instance.group_id:
+            change_counters([group_scope(instance.group_id)], 1)
+    bump(post_feeds(instance))
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender: Any, instance: Post, **kwargs: Any) -> None:
+    """
+    Уменьшает счетчики и меняет версии лент, из которых будет удален
+    пост.
+    """
+    bump(post_feeds(instance))
+    withdraw_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender: Any, instance: Post, **kwargs: Any) -> None:
+    """
+    Уменьшает счетчики постов, удаляет пост из поискового индекса
+    и освобождает его картинку.
+    """
+    change_counters(post_scopes(instance), -1)
+    reset_counters([comments_scope(instance.pk)])
+    unindex_post(instance.pk)
+    if instance.image:
+        release_file(instance.image.name)
+
+
+@receiver(thumbnails_generated)
+def thumbnails_ready(sender: Any, name: str, **kwargs: Any) -> None:
+    """
+    Меняет версии лент и страниц постов с картинкой name: их
+    кэшированные фрагменты показывают исходное изображение без srcset.
+    """
+    scopes: List[str] = []
+    for post in Post.objects.filter(image=name).only(
+        'pk', 'author_id', 'group_id',
+    ).iterator():
+        scopes.extend(post_feeds(post))
+    bump(scopes)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender: Any, instance: Comment, created: bool,
+                    **kwargs: Any) -> None:
+    """Обновляет счетчик комментариев и версию страницы поста."""
+    if created:
+        change_counters([comments_scope(instance.post_id)], 1)
+    bump([post_page(instance.post_id)])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender: Any, instance: Comment, **kwargs: Any) -> None:
+    """Обновляет счетчик комментариев и версию страницы поста."""
+    change_counters([comments_scope(instance.post_id)], -1)
+    bump([post_page(instance.post_id)])
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender: Any, instance: Group, **kwargs: Any) -> None:
+    """Меняет версии лент, в которых показываются ссылки на группы."""
+    bump([GROUPS, group_feed(instance.pk)])
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender: Any, instance: Group, **kwargs: Any) -> None:
+    """Удаляет счетчик и меняет версии лент удаленной группы."""
+    reset_counters([group_scope(instance.pk)])
+    bump([GROUPS, group_feed(instance.pk)])
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender: Any, instance: Follow, created: bool,
+                   **kwargs: Any) -> None:
+    """Обновляет счетчики подписок и заполняет ленту читателя."""
+    if created:
+        change_counters(
+            [
+                followers_scope(instance.author_id),
+                following_scope(instance.user_id),
+            ],
+            1,
+        )
+        backfill_timeline(instance.user_id, instance.author_id)
+        bump([
+            follow_feed(instance.user_id),
+            profile_page(instance.user_id),
+            profile_page(instance.author_id),
+        ])
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender: Any, instance: Follow, **kwargs: Any) -> None:
+    """Обновляет счетчики подписок и очищает ленту читателя."""
+    change_counters(
+        [
+            followers_scope(instance.author_id),
+            following_scope(instance.user_id),
+        ],
+        -1,
+    )
+    prune_timeline(instance.user_id, instance.author_id)
+    bump([
+        follow_feed(instance.user_id),
+        profile_page(instance.user_id),
+        profile_page(instance.author_id),
+    ])
+
+
+# Поля пользователя, которые показываются в лентах и на страницах постов.
+DISPLAYED_USER_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def user_changing(sender: Any, instance: User,
+                  update_fields: Optional[FrozenSet[str]] = None,
+                  **kwargs: Any) -> None:
+    """Запоминает прежние имя и ник пользователя."""
+    if update_fields is not None and not update_fields.intersection(
+        DISPLAYED_USER_FIELDS,
+    ):
+        # Например, last_login при входе.
+        instance._previous_names = None
+        return
+    instance._previous_names = instance.pk and User.objects.filter(
+        pk=instance.pk,
+    ).values_list(*DISPLAYED_USER_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender: Any, instance: User, created: bool,
+               **kwargs: Any) -> None:
+    """
+    Меняет версии лент и страниц, в которых показываются имя и ник
+    пользователя, если они изменились.
+    """
+    previous = getattr(instance, '_previous_names', None)
+    names = tuple(getattr(instance, field) for field in DISPLAYED_USER_FIELDS)
+    if created or previous is None or previous == names:
+        return
+    bump(author_feeds(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender: Any, instance: User, **kwargs: Any) -> None:
+    """Удаляет счетчики удаленного пользователя."""
+    reset_counters(user_scopes(instance.pk))
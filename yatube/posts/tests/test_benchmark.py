@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TransactionTestCase
+
+from ..management.commands.benchmark_urls import (TARGETS, WRITE_TARGETS,
+                                                  Outcome, percentile,
+                                                  summarize)
+from ..models import Follow, Group, Post
+
+User = get_user_model()
+
+
+class SummarizeTest(SimpleTestCase):
+    def test_percentile(self):
+        """
+        Перцентиль берется по ближайшему рангу.
+        """
+        values = [float(value) for value in range(1, 101)]
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7.0], 99), 7)
+        self.assertEqual(percentile([], 50), 0)
+
+    def test_summarize(self):
+        """
+        Ошибки считаются по статусам 4xx, 5xx и оборванным соединениям.
+        """
+        outcomes = [
+            Outcome(0.010, 200),
+            Outcome(0.020, 302),
+            Outcome(0.030, 500),
+            Outcome(0.040, 0),
+        ]
+
+        summary = summarize(outcomes, 2)
+
+        self.assertEqual(summary['requests'], 4)
+        self.assertEqual(summary['errors'], 2)
+        self.assertEqual(
+            summary['statuses'],
+            {'0': 1, '200': 1, '302': 1, '500': 1},
+        )
+        self.assertEqual(summary['rps'], 2)
+        self.assertEqual(summary['mean_ms'], 25)
+        self.assertEqual(summary['p50_ms'], 20)
+        self.assertEqual(summary['p99_ms'], 40)
+
+
+class BenchmarkCommandTest(TransactionTestCase):
+    def setUp(self):
+        group = Group.objects.create(title='Группа', slug='group')
+        author = User.objects.create_user(username='Author')
+        follower = User.objects.create_user(username='Follower')
+        Follow.objects.create(user=follower, author=author)
+        for number in range(3):
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=author,
+                group=group,
+            )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.output = os.path.join(directory, 'benchmark.json')
+
+    def benchmark(self, **options):
+        call_command(
+            'benchmark_urls',
+            threads=1,
+            requests=3,
+            warmup=1,
+            output=self.output,
+            stdout=StringIO(),
+            stderr=StringIO(),
+            **options,
+        )
+        with open(self.output, encoding='utf-8') as output:
+            return json.load(output)
+
+    def test_benchmark(self):
+        """
+        С --allow-writes команда замеряет все страницы, сохраняет
+        результаты в JSON и удаляет созданные сессии.
+        """
+        report = self.benchmark(allow_writes=True)
+
+        self.assertEqual(set(report['results']), set(TARGETS))
+        for name, summary in report['results'].items():
+            with self.subTest(name=name):
+                self.assertEqual(summary['requests'], 3)
+                self.assertEqual(summary['errors'], 0)
+        self.assertEqual(report['meta']['dataset']['posts.Post'], 7)
+        self.assertEqual(report['meta']['threads'], 1)
+        self.assertFalse(Session.objects.exists())
+
+    def test_read_only_by_default(self):
+        """
+        Без --allow-writes замеряются только страницы чтения, а данные
+        в базе не меняются.
+        """
+        report = self.benchmark()
+
+        self.assertEqual(
+            set(report['results']),
+            set(TARGETS) - set(WRITE_TARGETS),
+        )
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertFalse(Session.objects.exists())
+
+    def test_writes_require_flag(self):
+        """
+        Страницы записи без --allow-writes не замеряются.
+        """
+        with self.assertRaises(CommandError):
+            self.benchmark(urls=['posts:index', 'posts:post_create'])
+        self.assertEqual(Post.objects.count(), 3)
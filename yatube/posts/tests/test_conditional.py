@@ -0,0 +1,156 @@
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ConditionalGetTest(TestCase):
+    """
+    Ленты и страницы постов отвечают 304, пока их данные не менялись.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='grp',
+            description='Группа для проверки условных запросов',
+        )
+        cls.post = Post.objects.create(
+            text='Пост',
+            author=cls.author,
+            group=cls.group,
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.auth_client = Client()
+        self.auth_client.force_login(self.reader)
+        self.urls = [
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug}),
+            reverse(
+                'posts:profile',
+                kwargs={'username': self.author.username},
+            ),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+
+    def get_again(self, client, url):
+        # Первый ответ может установить CSRF-cookie, от которой
+        # зависит ETag.
+        client.get(url)
+        response = client.get(url)
+        return client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_pages_are_not_modified(self):
+        """
+        Повторный запрос с ETag неизменной страницы получает 304.
+        """
+        for url in self.urls:
+            for client in (self.guest_client, self.auth_client):
+                with self.subTest(url=url):
+                    self.assertEqual(
+                        self.get_again(client, url).status_code,
+                        HTTPStatus.NOT_MODIFIED,
+                    )
+
+    def test_not_modified_before_page_queries(self):
+        """
+        Ответ 304 главной страницы отдается без запросов к базе.
+        """
+        url = reverse('posts:index')
+        etag = self.guest_client.get(url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_last_modified_for_guests(self):
+        """
+        Анонимным посетителям отдается Last-Modified.
+        """
+        for url in self.urls:
+            with self.subTest(url=url):
+                last_modified = self.guest_client.get(url)['Last-Modified']
+                response = self.guest_client.get(
+                    url,
+                    HTTP_IF_MODIFIED_SINCE=last_modified,
+                )
+                self.assertEqual(
+                    response.status_code,
+                    HTTPStatus.NOT_MODIFIED,
+                )
+                self.assertFalse(
+                    self.auth_client.get(url).has_header('Last-Modified'),
+                    'Last-Modified не должен зависеть от пользователя',
+                )
+
+    def test_etag_depends_on_user(self):
+        """
+        Разные пользователи получают разные ETag.
+        """
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertNotEqual(
+                    self.guest_client.get(url)['ETag'],
+                    self.auth_client.get(url)['ETag'],
+                )
+
+    def test_changes_invalidate_etag(self):
+        """
+        Изменения постов, комментариев и подписок меняют ETag страниц.
+        """
+        changes = {
+            'новый пост': lambda: Post.objects.create(
+                text='Новый пост',
+                author=self.author,
+                group=self.group,
+            ),
+            'комментарий': lambda: Comment.objects.create(
+                text='Комментарий',
+                author=self.reader,
+                post=self.post,
+            ),
+            'подписка': lambda: Follow.objects.create(
+                user=self.reader,
+                author=self.author,
+            ),
+        }
+        affected = {
+            'новый пост': self.urls,
+            'комментарий': self.urls[3:],
+            'подписка': self.urls[2:3],
+        }
+        for url in self.urls:
+            self.auth_client.get(url)
+        for change, make_change in changes.items():
+            etags = {
+                url: self.auth_client.get(url)['ETag']
+                for url in affected[change]
+            }
+            make_change()
+            for url, etag in etags.items():
+                with self.subTest(change=change, url=url):
+                    self.assertEqual(
+                        self.auth_client.get(
+                            url,
+                            HTTP_IF_NONE_MATCH=etag,
+                        ).status_code,
+                        HTTPStatus.OK,
+                    )
+
+    def test_missing_objects(self):
+        """
+        Условные запросы к несуществующим страницам получают 404.
+        """
+        url = reverse('posts:group_posts', kwargs={'slug': 'missing'})
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
@@ -0,0 +1,223 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from ..counters import (GLOBAL_SCOPE, author_scope, comments_scope,
+                        followers_scope, following_scope, get_count,
+                        get_value, get_values, group_scope)
+from ..models import Comment, Counter, Follow, Group, Post
+
+User = get_user_model()
+
+
+class PostsCountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.author = User.objects.create_user(username='Author')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='grp',
+            description='Группа для проверки счетчиков',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-grp',
+            description='Вторая группа для проверки счетчиков',
+        )
+        Post.objects.bulk_create(
+            Post(
+                text=f'Пост {number}',
+                author=cls.author,
+                group=cls.group,
+            ) for number in range(3)
+        )
+
+    def setUp(self):
+        self.client = Client()
+
+    def get_profile_count(self):
+        response = self.client.get(
+            reverse(
+                'posts:profile',
+                kwargs={'username': self.author.username},
+            )
+        )
+        return response.context['page_obj'].paginator.count
+
+    def get_counter(self, scope):
+        return Counter.objects.get(scope=scope).value
+
+    def test_count_is_read_from_counter(self):
+        """
+        Пагинатор берет количество постов из счетчика, а не из COUNT(*).
+        """
+        self.assertEqual(self.get_profile_count(), 3)
+
+        Counter.objects.filter(
+            scope=author_scope(self.author.pk),
+        ).update(value=42)
+        self.assertEqual(
+            self.get_profile_count(),
+            42,
+            'Количество постов не берется из счетчика',
+        )
+
+    def test_missing_counters_computed_together(self):
+        """
+        Незаполненные счетчики одной модели вычисляются одним запросом.
+        """
+        other = User.objects.create_user(username='Other')
+        scopes = [
+            author_scope(self.author.pk),
+            author_scope(other.pk),
+            group_scope(self.group.pk),
+            group_scope(self.other_group.pk),
+        ]
+
+        with self.assertNumQueries(4):
+            values = get_values(scopes)
+
+        self.assertEqual(values, dict(zip(scopes, (3, 0, 3, 0))))
+        self.assertEqual(
+            dict(Counter.objects.values_list('scope', 'value')),
+            values,
+        )
+
+    def test_counters_follow_post_changes(self):
+        """
+        Счетчики меняются при создании, переносе и удалении поста.
+        """
+        for scope, post_list in (
+            (GLOBAL_SCOPE, Post.objects.all()),
+            (group_scope(self.group.pk), self.group.posts.all()),
+            (group_scope(self.other_group.pk), self.other_group.posts.all()),
+            (author_scope(self.author.pk), self.author.posts.all()),
+        ):
+            get_count(scope, post_list)
+
+        post = Post.objects.create(
+            text='Новый пост',
+            author=self.author,
+            group=self.group,
+        )
+        self.assertEqual(self.get_counter(GLOBAL_SCOPE), 4)
+        self.assertEqual(self.get_counter(group_scope(self.group.pk)), 4)
+        self.assertEqual(self.get_counter(author_scope(self.author.pk)), 4)
+
+        post.group = self.other_group
+        post.save()
+        self.assertEqual(self.get_counter(group_scope(self.group.pk)), 3)
+        self.assertEqual(
+            self.get_counter(group_scope(self.other_group.pk)),
+            1,
+        )
+
+        post.delete()
+        self.assertEqual(self.get_counter(GLOBAL_SCOPE), 3)
+        self.assertEqual(
+            self.get_counter(group_scope(self.other_group.pk)),
+            0,
+        )
+        self.assertEqual(self.get_counter(author_scope(self.author.pk)), 3)
+
+    @override_settings(COUNT_APPROXIMATE_ABOVE=2)
+    def test_approximate_count(self):
+        """
+        Незаполненный счетчик считается не дальше заданной границы.
+        """
+        response = self.client.get(
+            reverse(
+                'posts:profile',
+                kwargs={'username': self.author.username},
+            )
+        )
+        paginator = response.context['page_obj'].paginator
+
+        self.assertEqual(paginator.count, 2)
+        self.assertTrue(paginator.count_is_approximate)
+        self.assertContains(response, 'Всего постов: 2+')
+
+
+class UserCountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.post = Post.objects.create(
+            text='Пост для комментариев',
+            author=cls.author,
+        )
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_write_paths_update_counters(self):
+        """
+        Комментарии и подписки меняют счетчики, в т.ч. при каскадном
+        удалении.
+        """
+        scopes = (
+            comments_scope(self.post.pk),
+            followers_scope(self.author.pk),
+            following_scope(self.reader.pk),
+        )
+        for scope in scopes:
+            self.assertEqual(get_value(scope), 0)
+
+        self.client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'Комментарий'},
+        )
+        self.client.get(
+            reverse(
+                'posts:profile_follow',
+                kwargs={'username': self.author.username},
+            )
+        )
+        for scope in scopes:
+            with self.subTest(scope=scope):
+                self.assertEqual(get_value(scope), 1)
+
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        self.assertEqual(response.context['comments_count'], 1)
+        self.assertEqual(response.context['author_posts_count'], 1)
+
+        self.reader.delete()
+        self.assertEqual(get_value(comments_scope(self.post.pk)), 0)
+        self.assertEqual(get_value(followers_scope(self.author.pk)), 0)
+
+    def test_reconcile_counters_fixes_drift(self):
+        """
+        Команда reconcile_counters исправляет разошедшиеся счетчики.
+        """
+        Comment.objects.create(
+            text='Комментарий',
+            author=self.reader,
+            post=self.post,
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+        for scope in (
+            comments_scope(self.post.pk),
+            followers_scope(self.author.pk),
+            author_scope(self.author.pk),
+        ):
+            get_value(scope)
+        Counter.objects.update(value=100)
+
+        out = StringIO()
+        call_command('reconcile_counters', batch_size=2, stdout=out)
+
+        self.assertEqual(get_value(comments_scope(self.post.pk)), 1)
+        self.assertEqual(get_value(followers_scope(self.author.pk)), 1)
+        self.assertEqual(get_value(author_scope(self.author.pk)), 1)
+        self.assertIn('исправлено расхождений: 3', out.getvalue())
@@ -0,0 +1,109 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import Count
+from django.test import TestCase, override_settings
+
+from core.models import StoredFile
+
+from ..counters import GLOBAL_SCOPE, get_value
+from ..management.commands.generate_dataset import EPOCH
+from ..models import Comment, Follow, Group, Post, TimelineEntry, User
+from ..search import search_posts
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class GenerateDatasetTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def generate(self, prefix, **options):
+        call_command(
+            'generate_dataset',
+            users=30,
+            groups=3,
+            posts=200,
+            comments=300,
+            follows=100,
+            batch_size=70,
+            prefix=prefix,
+            stdout=StringIO(),
+            **{'seed': 7, **options},
+        )
+        return Post.objects.filter(author__username__startswith=f'{prefix}-')
+
+    def test_dataset(self):
+        """
+        Команда создает заданное количество записей с датами
+        в прошлом и ссылками на общие картинки.
+        """
+        posts = self.generate('load', images=0.5, image_pool=2)
+
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Group.objects.count(), 3)
+        self.assertEqual(posts.count(), 200)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertTrue(0 < Follow.objects.count() <= 100)
+        self.assertFalse(posts.filter(pub_date__lt=EPOCH).exists())
+        self.assertFalse(
+            Comment.objects.filter(created__lt=EPOCH).exists()
+        )
+
+        images = dict(
+            posts.exclude(image='').order_by().values_list(
+                'image',
+            ).annotate(
+                Count('pk'),
+            )
+        )
+        self.assertEqual(len(images), 2)
+        self.assertEqual(
+            dict(StoredFile.objects.values_list('name', 'references')),
+            images,
+        )
+
+    def test_derived_data_is_rebuilt(self):
+        """
+        После вставки в обход сигналов заполнены ленты подписок,
+        счетчики и поисковый индекс.
+        """
+        posts = self.generate('load')
+
+        self.assertEqual(
+            TimelineEntry.objects.count(),
+            Post.objects.filter(author__following__isnull=False).count(),
+        )
+        self.assertEqual(get_value(GLOBAL_SCOPE), 200)
+        word = posts.first().text.split()[0]
+        self.assertTrue(search_posts(word, None, 10)[0])
+
+    def test_same_seed_same_data(self):
+        """
+        При одинаковом зерне генерируются одинаковые посты.
+        """
+        fields = ('text', 'pub_date', 'group__slug')
+        first = [
+            (text, pub_date, slug.split('-')[-1] if slug else None)
+            for text, pub_date, slug in self.generate(
+                'first',
+            ).order_by('pk').values_list(*fields)
+        ]
+        second = [
+            (text, pub_date, slug.split('-')[-1] if slug else None)
+            for text, pub_date, slug in self.generate(
+                'second',
+            ).order_by('pk').values_list(*fields)
+        ]
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(
+            first,
+            list(self.generate('third', seed=8).values_list(*fields)),
+        )
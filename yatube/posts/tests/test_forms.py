@@ -1,11 +1,15 @@
 import shutil
 import tempfile
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
+
+from core.thumbnails import get_presets
 
 from ..models import Comment, Group, Post
 
@@ -57,6 +61,35 @@ class PostCreateFormTests(TestCase):
                     f' (атрибут {field_name})'
                 )
 
+    def test_create_post_schedules_thumbnails(self):
+        """
+        Миниатюры загруженного изображения ставятся в очередь
+        при создании поста.
+        """
+        uploaded = SimpleUploadedFile(
+            name='thumbnail_test.gif',
+            content=(
+                b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                b'\x0A\x00\x3B'
+            ),
+            content_type='image/gif',
+        )
+        with mock.patch('posts.views.schedule_thumbnails') as schedule:
+            self.authorized_client.post(
+                reverse('posts:post_create'),
+                data={'text': 'Пост с изображением', 'image': uploaded},
+            )
+
+        post = Post.objects.get(text='Пост с изображением')
+        schedule.assert_called_once_with(
+            post.image.name,
+            get_presets(settings.POST_IMAGE_PRESETS),
+        )
+
     def test_create_post_form(self):
         """
         Валидная форма создает новый пост.
@@ -120,10 +153,19 @@ class PostCreateFormTests(TestCase):
                     'автор',
                 ),
                 (
-                    recently_created_post.image.read(),
-                    gif_for_test,
+                    Image.open(recently_created_post.image).size,
+                    (2, 1),
                     'картинка',
                 ),
+                (
+                    (
+                        recently_created_post.image_width,
+                        recently_created_post.image_height,
+                        recently_created_post.image_size,
+                    ),
+                    (2, 1, recently_created_post.image.size),
+                    'размеры картинки',
+                ),
             ]
         )
 
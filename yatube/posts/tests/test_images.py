@@ -0,0 +1,343 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from core.models import StoredFile
+from core.thumbnails import generate_thumbnail, get_preset
+
+from ..images import describe_image, ingest_image
+from ..models import Post
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+User = get_user_model()
+
+
+def tearDownModule():
+    shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+
+@override_settings(
+    IMAGE_MAX_DIMENSION=100,
+    IMAGE_MAX_SOURCE_PIXELS=1000 * 1000,
+)
+class IngestImageTest(SimpleTestCase):
+    def make_upload(self, name, size, mode='RGB', image_format='JPEG',
+                    **params):
+        content = io.BytesIO()
+        Image.new(mode, size, 'red').save(content, image_format, **params)
+        return SimpleUploadedFile(name, content.getvalue())
+
+    def test_large_image_is_downscaled(self):
+        """
+        Изображение уменьшается до IMAGE_MAX_DIMENSION по большей стороне.
+        """
+        ingested = ingest_image(self.make_upload('photo.jpeg', (800, 400)))
+
+        self.assertEqual((ingested.width, ingested.height), (100, 50))
+        self.assertEqual(ingested.size, ingested.file.size)
+        self.assertEqual(Image.open(ingested.file).size, (100, 50))
+
+    def test_dominant_color(self):
+        """
+        Для изображения запоминается его средний цвет.
+        """
+        ingested = ingest_image(
+            self.make_upload('photo.png', (10, 10), image_format='PNG')
+        )
+
+        self.assertEqual(ingested.color, '#ff0000')
+
+    def test_describe_rotated_image(self):
+        """
+        Размеры повернутого по EXIF изображения меняются местами.
+        """
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        upload = self.make_upload('photo.jpg', (40, 20), exif=exif.tobytes())
+
+        info = describe_image(upload)
+
+        self.assertEqual((info.width, info.height), (20, 40))
+        self.assertTrue(info.color.startswith('#'))
+
+    def test_metadata_is_stripped(self):
+        """
+        Метаданные исходного файла не сохраняются.
+        """
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        ingested = ingest_image(
+            self.make_upload('photo.jpg', (50, 50), exif=exif.tobytes())
+        )
+
+        self.assertEqual(len(Image.open(ingested.file).getexif()), 0)
+
+    def test_transparency_is_kept(self):
+        """
+        Изображение с прозрачностью не теряет альфа-канал.
+        """
+        ingested = ingest_image(
+            self.make_upload('logo.png', (20, 20), 'RGBA', 'PNG')
+        )
+
+        self.assertEqual(Image.open(ingested.file).mode, 'RGBA')
+        self.assertFalse(ingested.file.name.endswith('.jpg'))
+
+    def test_too_large_source_is_rejected(self):
+        """
+        Изображение больше IMAGE_MAX_SOURCE_PIXELS не декодируется.
+        """
+        with self.assertRaises(ValidationError):
+            ingest_image(self.make_upload('huge.png', (1001, 1000),
+                                          image_format='PNG'))
+
+    def test_not_an_image(self):
+        """
+        Файл, не являющийся изображением, не принимается.
+        """
+        with self.assertRaises(ValidationError):
+            ingest_image(SimpleUploadedFile('fake.jpg', b'not an image'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class BackfillImageDimensionsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        content = io.BytesIO()
+        Image.new('RGB', (120, 60), 'blue').save(content, 'PNG')
+        cls.post = Post(text='Старый пост', author=cls.author)
+        cls.post.image.save(
+            'old.png',
+            ContentFile(content.getvalue()),
+            save=False,
+        )
+        cls.post.save()
+        Post.objects.create(text='Пост без картинки', author=cls.author)
+
+    def test_backfill(self):
+        """
+        Команда заполняет размеры и цвет картинок, не обработанных
+        при загрузке.
+        """
+        call_command('backfill_image_dimensions', stdout=StringIO())
+
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.image_width, post.image_height), (120, 60))
+        self.assertEqual(post.image_size, post.image.size)
+        self.assertEqual(post.image_color, '#0000ff')
+
+    def test_sized_image_tag(self):
+        """
+        Тег img получает размеры миниатюры и цвет-заглушку.
+        """
+        call_command('backfill_image_dimensions', stdout=StringIO())
+
+        response = Client().get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertContains(response, 'background-color: #0000ff')
+
+    def test_missing_file(self):
+        """
+        Отсутствующий файл не прерывает заполнение.
+        """
+        Post.objects.filter(pk=self.post.pk).update(image='posts/gone.png')
+        stderr = StringIO()
+
+        call_command(
+            'backfill_image_dimensions',
+            stdout=StringIO(),
+            stderr=stderr,
+        )
+
+        self.assertIn('posts/gone.png', stderr.getvalue())
+        self.assertIsNone(Post.objects.get(pk=self.post.pk).image_width)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class SharedImageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='Author')
+
+    def create_post(self, text):
+        content = io.BytesIO()
+        Image.new('RGB', (30, 20), 'green').save(content, 'PNG')
+        post = Post(text=text, author=self.author)
+        post.image.save('same.png', ContentFile(content.getvalue()))
+        return post
+
+    def test_identical_images_are_shared(self):
+        """
+        Посты с одинаковыми картинками ссылаются на один файл, который
+        удаляется вместе с последним из них.
+        """
+        first = self.create_post('Первый пост')
+        second = self.create_post('Второй пост')
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(StoredFile.objects.get(name=name).references, 2)
+
+        with mock.patch(
+            'core.storage.transaction.on_commit',
+            side_effect=lambda callback: callback(),
+        ):
+            first.delete()
+            self.assertTrue(default_storage.exists(name))
+            second.image = ''
+            second.save()
+
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+
+class CollectMediaTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='Author')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        media_override = override_settings(
+            MEDIA_ROOT=media_root,
+            THUMBNAIL_KVSTORE_PATH=os.path.join(
+                media_root,
+                'thumbnails.sqlite3',
+            ),
+        )
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.live = self.create_post('live').image.name
+        orphaned_post = self.create_post('orphaned')
+        self.orphan = orphaned_post.image.name
+        geometry_string, options = get_preset('post_card')
+        self.orphan_thumbnail = generate_thumbnail(
+            self.orphan,
+            geometry_string,
+            options,
+        ).name
+        Post.objects.filter(pk=orphaned_post.pk).update(image='')
+        StoredFile.objects.filter(name=self.orphan).update(references=0)
+        self.stray_thumbnail = default_storage.save(
+            'cache/00/00/stray.jpg',
+            ContentFile(b'stray'),
+        )
+
+    def create_post(self, color):
+        content = io.BytesIO()
+        Image.new('RGB', (30, 20), 'red' if color == 'live' else 'blue').save(
+            content,
+            'PNG',
+        )
+        post = Post(text=color, author=self.author)
+        post.image.save(f'{color}.png', ContentFile(content.getvalue()))
+        return post
+
+    def collect(self, **options):
+        out = StringIO()
+        call_command('collect_media', min_age=0, stdout=out, **options)
+        return out.getvalue()
+
+    def test_dry_run(self):
+        """
+        В режиме dry-run файлы только перечисляются.
+        """
+        output = self.collect(dry_run=True)
+
+        self.assertIn(self.orphan, output)
+        self.assertIn(self.stray_thumbnail, output)
+        self.assertIn('будет удалено картинок: 1, миниатюр: 2', output)
+        for name in (self.orphan, self.orphan_thumbnail, self.stray_thumbnail):
+            with self.subTest(name=name):
+                self.assertTrue(default_storage.exists(name))
+
+    def test_orphans_are_deleted(self):
+        """
+        Удаляются картинки без постов, их миниатюры и миниатюры без
+        ключей; освобожденный объем попадает в отчет.
+        """
+        reclaimed = sum(
+            default_storage.size(name)
+            for name in (
+                self.orphan,
+                self.orphan_thumbnail,
+                self.stray_thumbnail,
+            )
+        )
+
+        output = self.collect(rate=1000)
+
+        self.assertIn(f'({reclaimed} байт)', output)
+        self.assertTrue(default_storage.exists(self.live))
+        for name in (self.orphan, self.orphan_thumbnail, self.stray_thumbnail):
+            with self.subTest(name=name):
+                self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=self.orphan).exists())
+
+    def test_young_files_are_kept(self):
+        """
+        Файлы моложе --min-age не удаляются.
+        """
+        out = StringIO()
+        call_command('collect_media', stdout=out)
+
+        self.assertIn('удалено картинок: 0, миниатюр: 0', out.getvalue())
+        self.assertTrue(default_storage.exists(self.orphan))
+
+    def test_referenced_files_are_kept(self):
+        """
+        Картинка со ссылками в StoredFile не удаляется, даже если
+        ни один пост на нее не ссылается.
+        """
+        StoredFile.objects.filter(name=self.orphan).update(references=1)
+
+        output = self.collect(skip_thumbnails=True)
+
+        self.assertIn('удалено картинок: 0', output)
+        self.assertTrue(default_storage.exists(self.orphan))
+
+    def test_reused_files_are_kept(self):
+        """
+        Старая картинка без ссылок, загруженная повторно, считается
+        новой и не удаляется до сохранения поста.
+        """
+        path = default_storage.path(self.orphan)
+        two_hours_ago = time.time() - 2 * 60 * 60
+        os.utime(path, (two_hours_ago, two_hours_ago))
+        with default_storage.open(self.orphan) as image:
+            self.assertEqual(
+                default_storage.save('posts/again.png', image),
+                self.orphan,
+            )
+
+        out = StringIO()
+        call_command('collect_media', skip_thumbnails=True, stdout=out)
+
+        self.assertIn('удалено картинок: 0', out.getvalue())
+        self.assertTrue(default_storage.exists(self.orphan))
+
+        os.utime(path, (two_hours_ago, two_hours_ago))
+        call_command('collect_media', skip_thumbnails=True, stdout=out)
+
+        self.assertFalse(default_storage.exists(self.orphan))
@@ -0,0 +1,207 @@
+from itertools import count
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.test import Client, TestCase
+from django.urls import URLPattern, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from about import urls as about_urls
+from core.queries import QueryBudget, QueryRecorder, check_budget
+from users import urls as users_urls
+
+from .. import urls as posts_urls
+from ..invalidation import VERSIONS_CACHE
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# Во сколько раз большой набор данных больше малого. Рост числа
+# запросов между ними означает запросы в цикле по данным.
+SMALL_DATASET: int = 2
+LARGE_DATASET: int = 8
+
+
+class Route(NamedTuple):
+    budget: QueryBudget
+    kwargs: Callable[['QueryBudgetTest'], Dict[str, Any]] = (
+        lambda test: {}
+    )
+    method: str = 'get'
+    data: Optional[Dict[str, Any]] = None
+    # Пользователь, от имени которого выполняется запрос.
+    user: Optional[str] = None
+
+
+def _post(test: 'QueryBudgetTest') -> Dict[str, Any]:
+    return {'post_id': test.post.pk}
+
+
+def _author(test: 'QueryBudgetTest') -> Dict[str, Any]:
+    return {'username': test.author.username}
+
+
+def _reset_token(test: 'QueryBudgetTest') -> Dict[str, Any]:
+    return {
+        'uidb64': urlsafe_base64_encode(force_bytes(test.reader.pk)),
+        'token': default_token_generator.make_token(test.reader),
+    }
+
+
+# Бюджеты запросов каждой страницы с холодным кэшем.
+ROUTES: Dict[str, Route] = {
+    'posts:index': Route(QueryBudget(1)),
+    'posts:group_posts': Route(
+        QueryBudget(3),
+        lambda test: {'slug': test.group.slug},
+    ),
+    'posts:profile': Route(QueryBudget(16), _author),
+    'posts:post_detail': Route(QueryBudget(15), _post),
+    'posts:post_comments': Route(QueryBudget(3), _post),
+    'posts:search': Route(QueryBudget(2), data={'q': 'пост'}),
+    'posts:post_create': Route(
+        QueryBudget(16),
+        method='post',
+        data={'text': 'Новый пост'},
+        user='reader',
+    ),
+    'posts:post_edit': Route(
+        QueryBudget(11),
+        _post,
+        method='post',
+        data={'text': 'Измененный пост'},
+        user='author',
+    ),
+    'posts:add_comment': Route(
+        QueryBudget(7),
+        _post,
+        method='post',
+        data={'text': 'Комментарий'},
+        user='reader',
+    ),
+    'posts:follow_index': Route(QueryBudget(5), user='reader'),
+    'posts:profile_follow': Route(
+        QueryBudget(14),
+        _author,
+        user='newcomer',
+    ),
+    'posts:profile_unfollow': Route(QueryBudget(11), _author, user='reader'),
+    'users:signup': Route(QueryBudget(0)),
+    'users:login': Route(QueryBudget(0)),
+    'users:logout': Route(QueryBudget(4), user='reader'),
+    'users:password_change': Route(QueryBudget(2), user='reader'),
+    'users:password_change_done': Route(QueryBudget(2), user='reader'),
+    'users:password_reset': Route(QueryBudget(0)),
+    'users:password_reset_done': Route(QueryBudget(0)),
+    'users:reset_confirm': Route(QueryBudget(5), _reset_token),
+    'users:reset_done': Route(QueryBudget(0)),
+    'about:author': Route(QueryBudget(0)),
+    'about:tech': Route(QueryBudget(0)),
+}
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Число запросов страниц не превышает бюджет и не растет вместе
+    с количеством постов, комментариев, авторов и подписок.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.newcomer = User.objects.create_user(username='Newcomer')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.post = Post.objects.create(
+            text='Пост автора',
+            author=cls.author,
+            group=cls.group,
+        )
+
+    def setUp(self):
+        self.numbers = count()
+
+    def populate(self, size: int) -> None:
+        """
+        Добавляет постов, комментариев, авторов и подписок так, чтобы
+        их стало size, причем у каждого поста и комментария свой автор.
+        """
+        while Follow.objects.filter(user=self.reader).count() < size:
+            number: int = next(self.numbers)
+            user = User.objects.create_user(
+                username=f'user-{number}',
+                first_name='Имя',
+                last_name=f'Фамилия {number}',
+            )
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=user,
+                group=self.group,
+            )
+            Post.objects.create(
+                text=f'Пост автора {number}',
+                author=self.author,
+            )
+            Comment.objects.create(
+                text=f'Комментарий {number}',
+                author=user,
+                post=self.post,
+            )
+            Follow.objects.create(user=self.reader, author=user)
+            Follow.objects.create(user=user, author=self.author)
+
+    def measure(self, name: str, route: Route) -> List[Any]:
+        """
+        Записывает запросы страницы с холодным кэшем и откатывает
+        сделанные ею изменения.
+        """
+        client = Client()
+        if route.user is not None:
+            client.force_login(getattr(self, route.user))
+        cache.clear()
+        caches[VERSIONS_CACHE].clear()
+        url: str = reverse(name, kwargs=route.kwargs(self))
+        with transaction.atomic():
+            with QueryRecorder() as recorder:
+                response = getattr(client, route.method)(url, route.data)
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 400, url)
+        return recorder.queries
+
+    def test_query_budgets(self):
+        """
+        Запросы страниц укладываются в бюджет на малом и большом
+        наборах данных.
+        """
+        measured: Dict[str, List[List[Any]]] = {name: [] for name in ROUTES}
+        for size in (SMALL_DATASET, LARGE_DATASET):
+            self.populate(size)
+            for name, route in ROUTES.items():
+                measured[name].append(self.measure(name, route))
+
+        for name, route in ROUTES.items():
+            with self.subTest(name=name):
+                report: Optional[str] = check_budget(
+                    route.budget,
+                    *measured[name],
+                )
+                if report is not None:
+                    self.fail(f'{name}: {report}')
+
+    def test_every_route_has_budget(self):
+        """
+        Для каждой страницы posts, users и about задан бюджет.
+        """
+        names = {
+            f'{module.app_name}:{pattern.name}'
+            for module in (posts_urls, users_urls, about_urls)
+            for pattern in module.urlpatterns
+            if isinstance(pattern, URLPattern)
+        }
+
+        self.assertEqual(names, set(ROUTES))
@@ -0,0 +1,130 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# Таблицы, запросы к которым должны идти по индексам.
+FEED_TABLES = (
+    'posts_post',
+    'posts_comment',
+    'posts_follow',
+    'posts_timelineentry',
+)
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?(?P<table>\w+)(?! USING)')
+
+
+class QueryPlansTest(TestCase):
+    """
+    Запросы лент и комментариев не должны приводить к полному
+    просмотру таблиц и к сортировке во временном B-дереве.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='grp',
+            description='Группа для проверки планов запросов',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for number in range(30):
+            post = Post.objects.create(
+                text=f'Пост {number}',
+                author=cls.author if number % 2 else cls.reader,
+                group=cls.group if number % 3 else None,
+            )
+            Comment.objects.create(
+                text=f'Комментарий {number}',
+                author=cls.reader,
+                post=post,
+            )
+        cls.post = post
+        cls.extra_author = User.objects.create_user(username='Extra')
+        for number in range(15):
+            Post.objects.create(
+                text=f'Пост второго автора {number}',
+                author=cls.extra_author,
+            )
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def get_feed_urls(self):
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug}),
+            reverse(
+                'posts:profile',
+                kwargs={'username': self.author.username},
+            ),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        for url in urls[:4]:
+            response = self.client.get(url)
+            urls.append(
+                f'{url}?after={response.context["page_obj"].next_cursor}'
+            )
+            urls.append(f'{url}?page=2')
+        comments_url = reverse(
+            'posts:post_comments',
+            kwargs={'post_id': self.post.pk},
+        )
+        comments = self.client.get(comments_url).context['comments']
+        cursor = comments.paginator.encode_cursor(comments[0])
+        urls.append(f'{comments_url}?after={cursor}')
+        return urls
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_feed_queries_use_indexes(self):
+        """
+        Запросы страниц лент используют индексы.
+        """
+        self.check_feed_plans()
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_heavy_author_queries_use_indexes(self):
+        """
+        Лента подписок с постами "тяжелых" авторов, читаемыми в момент
+        запроса, тоже использует индексы.
+        """
+        Follow.objects.create(user=self.reader, author=self.extra_author)
+        self.check_feed_plans()
+
+    def check_feed_plans(self):
+        for url in self.get_feed_urls():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or not any(
+                    table in sql for table in FEED_TABLES
+                ):
+                    continue
+                for step in self.explain(sql):
+                    with self.subTest(url=url, sql=sql, step=step):
+                        self.assertNotIn(
+                            'USE TEMP B-TREE',
+                            step,
+                            'Запрос сортирует строки без индекса',
+                        )
+                        match = FULL_SCAN.match(step)
+                        self.assertFalse(
+                            match and match.group('table') in FEED_TABLES,
+                            'Запрос просматривает таблицу целиком',
+                        )
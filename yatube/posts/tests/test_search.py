@@ -0,0 +1,125 @@
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Post
+from ..search import build_match_query, rebuild_index
+
+User = get_user_model()
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='Author')
+        cls.admin = User.objects.create_superuser(
+            username='Admin',
+            email='admin@example.com',
+            password='password',
+        )
+        cls.cats = Post.objects.create(
+            text='Коты любят спать на солнце',
+            author=cls.author,
+        )
+        cls.more_cats = Post.objects.create(
+            text='Кот и кот: два кота на одном окне',
+            author=cls.author,
+        )
+        cls.dogs = Post.objects.create(
+            text='Собаки любят гулять',
+            author=cls.author,
+        )
+
+    def setUp(self):
+        self.client = Client()
+
+    def search(self, query, **params):
+        response = self.client.get(
+            reverse('posts:search'),
+            {'q': query, **params},
+        )
+        return response.context['posts'], response.context['next_cursor']
+
+    def test_match_query_escapes_syntax(self):
+        """
+        Синтаксис FTS5 в строке поиска не интерпретируется.
+        """
+        self.assertEqual(
+            build_match_query('кот OR "собака" NEAR(*'),
+            '"кот"* "OR"* "собака"* "NEAR"*',
+        )
+        self.assertIsNone(build_match_query('  !?* '))
+
+    def test_search_finds_ranked_posts(self):
+        """
+        Поиск находит посты по префиксам слов и ранжирует их.
+        """
+        posts, _ = self.search('кот')
+        self.assertEqual(posts, [self.more_cats, self.cats])
+
+        posts, _ = self.search('ЛЮБЯТ')
+        self.assertCountEqual(posts, [self.cats, self.dogs])
+
+        posts, _ = self.search('!!!')
+        self.assertEqual(posts, [])
+
+    def test_index_follows_post_changes(self):
+        """
+        Индекс обновляется при изменении и удалении постов.
+        """
+        dogs = Post.objects.get(pk=self.dogs.pk)
+        dogs.text = 'Собаки и попугаи'
+        dogs.save()
+        posts, _ = self.search('попугаи')
+        self.assertEqual(posts, [self.dogs])
+
+        dogs.delete()
+        posts, _ = self.search('собаки')
+        self.assertEqual(posts, [])
+
+    @override_settings(SEARCH_RESULTS_PER_PAGE=1)
+    def test_cursor_pagination(self):
+        """
+        Результаты поиска листаются курсором без пропусков и повторов.
+        """
+        found = []
+        after = None
+        while True:
+            posts, after = self.search('кот любят', after=after or '')
+            found.extend(posts)
+            if after is None:
+                break
+        self.assertEqual(found, [self.cats])
+
+        found = []
+        while True:
+            posts, after = self.search('на', after=after or '')
+            found.extend(posts)
+            if after is None:
+                break
+        self.assertEqual(len(found), 2)
+        self.assertCountEqual(found, [self.cats, self.more_cats])
+
+    def test_rebuild_index(self):
+        """
+        Перестроение индекса учитывает изменения в обход сигналов.
+        """
+        Post.objects.filter(pk=self.dogs.pk).update(text='Попугаи')
+        self.assertEqual(self.search('попугаи')[0], [])
+
+        self.assertEqual(rebuild_index(), Post.objects.count())
+        self.assertEqual(self.search('попугаи')[0], [self.dogs])
+
+    def test_admin_search_uses_index(self):
+        """
+        Поиск в админке идет по индексу.
+        """
+        self.client.force_login(self.admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'),
+            {'q': 'кот'},
+        )
+        self.assertCountEqual(
+            response.context['cl'].result_list,
+            [self.cats, self.more_cats],
+        )
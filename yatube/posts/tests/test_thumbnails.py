@@ -0,0 +1,176 @@
+import io
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core.thumbnails import _run, get_preset, get_presets, get_variants
+
+from ..models import Post
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+User = get_user_model()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class WarmThumbnailsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.posts = []
+        for number in range(3):
+            content = io.BytesIO()
+            Image.new('RGB', (100, 50), (0, 0, 100 * number)).save(
+                content,
+                'JPEG',
+            )
+            post = Post(text=f'Пост {number}', author=cls.author)
+            post.image.save(
+                f'warm_{number}.jpg',
+                ContentFile(content.getvalue()),
+                save=False,
+            )
+            post.save()
+            cls.posts.append(post)
+        Post.objects.create(text='Пост без картинки', author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        kvstore_override = override_settings(
+            THUMBNAIL_KVSTORE_PATH=os.path.join(
+                tempfile.mkdtemp(dir=TEMP_MEDIA_ROOT),
+                'thumbnails.sqlite3',
+            ),
+        )
+        kvstore_override.enable()
+        self.addCleanup(kvstore_override.disable)
+        cache.clear()
+
+    def is_ready(self, post, preset):
+        geometry_string, options = get_preset(preset)
+        return default.backend.get_ready_thumbnail(
+            ImageFile(post.image.name),
+            geometry_string,
+            options,
+        ) is not None
+
+    def warm(self, **options):
+        out = StringIO()
+        call_command(
+            'warm_thumbnails',
+            workers=0,
+            batch_size=2,
+            stdout=out,
+            **options,
+        )
+        return out.getvalue()
+
+    def test_missing_thumbnails_are_created(self):
+        """
+        Команда создает миниатюры всех пресетов и пропускает готовые.
+        """
+        output = self.warm()
+
+        for post in self.posts:
+            for preset in settings.POST_IMAGE_PRESETS:
+                with self.subTest(post=post.pk, preset=preset):
+                    self.assertTrue(self.is_ready(post, preset))
+        created = len(self.posts) * len(
+            get_presets(settings.POST_IMAGE_PRESETS)
+        )
+        self.assertIn(f'Постов: 3/3, создано миниатюр: {created}', output)
+        self.assertIn('миниатюр/с', output)
+
+        output = self.warm()
+        self.assertIn(f'создано миниатюр: 0, готовых: {created}', output)
+
+    def test_resume_after_id(self):
+        """
+        Команда продолжает обработку с указанного id.
+        """
+        self.warm(after_id=self.posts[0].pk)
+
+        self.assertFalse(self.is_ready(self.posts[0], 'post_card'))
+        self.assertTrue(self.is_ready(self.posts[1], 'post_card'))
+
+    def test_templates_use_presets(self):
+        """
+        Страницы показывают миниатюру пресета, когда она готова.
+        """
+        self.warm()
+        geometry_string, options = get_preset('post_detail')
+        thumbnail = default.backend.get_thumbnail(
+            self.posts[0].image,
+            geometry_string,
+            **options,
+        )
+
+        response = Client().get(
+            reverse('posts:post_detail', kwargs={'post_id': self.posts[0].pk})
+        )
+        self.assertContains(response, thumbnail.url)
+
+    def test_post_cards_have_srcset(self):
+        """
+        Карточки постов перечисляют готовые копии миниатюры в srcset
+        и загружаются лениво.
+        """
+        self.warm()
+
+        response = Client().get(reverse('posts:index'))
+
+        self.assertContains(response, 'loading="lazy"')
+        for geometry_string, options in get_variants('post_card'):
+            thumbnail = default.backend.get_ready_thumbnail(
+                ImageFile(self.posts[0].image.name),
+                geometry_string,
+                options,
+            )
+            with self.subTest(geometry=geometry_string):
+                self.assertContains(
+                    response,
+                    f'{thumbnail.url} {thumbnail.width}w',
+                )
+
+    def test_cached_pages_refreshed_when_ready(self):
+        """
+        Страницы, закэшированные с исходным изображением, показывают
+        миниатюру после ее создания фоновой задачей.
+        """
+        post = self.posts[0]
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'Author'}),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        ]
+        for url in urls:
+            self.assertContains(Client().get(url), post.image.url)
+
+        _run([], post.image.name, get_presets(settings.POST_IMAGE_PRESETS))
+
+        for preset, url in zip(('post_card', 'post_card', 'post_detail'),
+                               urls):
+            geometry_string, options = get_preset(preset)
+            thumbnail = default.backend.get_ready_thumbnail(
+                ImageFile(post.image.name),
+                geometry_string,
+                options,
+            )
+            with self.subTest(url=url):
+                self.assertContains(Client().get(url), thumbnail.url)
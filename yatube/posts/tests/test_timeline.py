@@ -0,0 +1,218 @@
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Follow, Post, TimelineEntry
+from ..timeline import get_timeline_count, materialize_author
+
+User = get_user_model()
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.author = User.objects.create_user(username='Author')
+        cls.follower = User.objects.create_user(username='Follower')
+        cls.old_post = Post.objects.create(
+            text='Пост, опубликованный до подписки',
+            author=cls.author,
+        )
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.follower)
+
+    def follow(self):
+        self.client.get(
+            reverse(
+                'posts:profile_follow',
+                kwargs={'username': self.author.username},
+            )
+        )
+
+    def get_feed(self):
+        response = self.client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'].object_list)
+
+    def test_follow_backfills_timeline(self):
+        """
+        При подписке в ленту попадают уже опубликованные посты автора.
+        """
+        self.follow()
+
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.follower,
+                post=self.old_post,
+            ).exists(),
+            'Лента не заполняется при подписке на автора',
+        )
+        self.assertEqual(
+            self.get_feed(),
+            [self.old_post],
+            'Посты автора не отображаются в ленте подписок',
+        )
+
+    def test_new_post_fans_out(self):
+        """
+        Новый пост раскладывается по лентам подписчиков.
+        """
+        self.follow()
+        new_post = Post.objects.create(
+            text='Пост, опубликованный после подписки',
+            author=self.author,
+        )
+
+        self.assertEqual(
+            self.get_feed(),
+            [new_post, self.old_post],
+            'Новый пост не попал в ленту подписчика',
+        )
+
+    def test_unfollow_prunes_timeline(self):
+        """
+        При отписке посты автора удаляются из ленты.
+        """
+        self.follow()
+        self.client.get(
+            reverse(
+                'posts:profile_unfollow',
+                kwargs={'username': self.author.username},
+            )
+        )
+
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.follower).exists(),
+            'Лента не очищается при отписке от автора',
+        )
+        self.assertEqual(self.get_feed(), [])
+
+    def test_timeline_count_follows_changes(self):
+        """
+        Количество постов в ленте подписок меняется вместе с лентой.
+        """
+        self.follow()
+        self.assertEqual(get_timeline_count(self.follower), (1, False))
+
+        new_post = Post.objects.create(
+            text='Пост, опубликованный после подписки',
+            author=self.author,
+        )
+        self.assertEqual(get_timeline_count(self.follower), (2, False))
+
+        new_post.delete()
+        self.assertEqual(get_timeline_count(self.follower), (1, False))
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_heavy_author_is_read_on_request(self):
+        """
+        Посты автора с большим числом подписчиков не материализуются,
+        но отображаются в ленте.
+        """
+        Follow.objects.create(user=self.follower, author=self.author)
+        new_post = Post.objects.create(
+            text='Пост популярного автора',
+            author=self.author,
+        )
+
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.author).exists(),
+            'Посты популярного автора не должны раскладываться по лентам',
+        )
+        self.assertEqual(
+            self.get_feed(),
+            [new_post, self.old_post],
+            'Посты популярного автора не отображаются в ленте',
+        )
+        self.assertEqual(get_timeline_count(self.follower), (2, False))
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_heavy_authors_merged_with_timeline(self):
+        """
+        Посты нескольких популярных авторов и материализованной ленты
+        идут по дате на всех страницах ленты и читаются одним запросом
+        независимо от числа авторов.
+        """
+        reader = User.objects.create_user(username='Reader')
+        authors = [
+            User.objects.create_user(username=f'Heavy {number}')
+            for number in range(10)
+        ]
+        for author in authors:
+            Follow.objects.create(user=self.follower, author=author)
+            Follow.objects.create(user=reader, author=author)
+        Follow.objects.create(user=self.follower, author=self.author)
+        for number in range(settings.LIMIT_OF_RECORDS * 3):
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=(authors + [self.author])[number % 11],
+            )
+        expected = list(
+            Post.objects.filter(
+                author__in=authors + [self.author],
+            ).order_by('-pub_date', '-pk')
+        )
+
+        for max_authors in (100, 3):
+            with self.subTest(max_authors=max_authors), override_settings(
+                TIMELINE_MERGE_MAX_AUTHORS=max_authors,
+            ):
+                feed = []
+                url = reverse('posts:follow_index')
+                while url:
+                    with CaptureQueriesContext(connection) as queries:
+                        page_obj = self.client.get(url).context['page_obj']
+                    feed.extend(page_obj.object_list)
+                    self.assertEqual(
+                        sum(
+                            'UNION ALL' in query['sql']
+                            for query in queries.captured_queries
+                        ),
+                        1,
+                    )
+                    url = page_obj.next_cursor and (
+                        f'{reverse("posts:follow_index")}?after='
+                        f'{page_obj.next_cursor}'
+                    )
+                self.assertEqual(feed, expected)
+
+                response = self.client.get(
+                    reverse('posts:follow_index'),
+                    {'page': 2},
+                )
+                self.assertEqual(
+                    list(response.context['page_obj'].object_list),
+                    expected[settings.LIMIT_OF_RECORDS:][
+                        :settings.LIMIT_OF_RECORDS
+                    ],
+                )
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_author_materialized_after_unfollow(self):
+        """
+        Когда автор перестает быть популярным, его посты раскладываются
+        по лентам оставшихся подписчиков в фоне, а не в запросе.
+        """
+        reader = User.objects.create_user(username='Reader')
+        Follow.objects.create(user=reader, author=self.author)
+        self.follow()
+
+        with mock.patch('posts.timeline.schedule_materialize') as schedule:
+            Follow.objects.get(user=reader).delete()
+
+        schedule.assert_called_once_with(self.author.pk)
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.author).exists(),
+        )
+
+        materialize_author(self.author.pk)
+
+        self.assertEqual(self.get_feed(), [self.old_post])
+        self.assertEqual(get_timeline_count(self.follower), (1, False))
@@ -1,14 +1,16 @@
 import math
 import shutil
 import tempfile
-from enum import Enum
+from http import HTTPStatus
 from random import randrange
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from ..forms import PostForm
@@ -246,36 +248,110 @@ class PostsViewsTest(TestCase):
 
     def test_check_cache_index_page(self):
         """
-        Список постов на главной странице сохраняется в кэше.
+        Список постов на главной странице сохраняется в кэше
+        до изменения постов.
         """
-        class TestLevels(Enum):
-            BEFORE_DEL_OBJ = 1
-            AFTER_DEL_OBJ = 2
-            AFTER_CACHE_CLEAR = 3
-
         old_content = self.auth_client.get(reverse('posts:index')).content
 
-        for level in TestLevels:
-            new_content = self.auth_client.get(
-                reverse('posts:index')
-            ).content
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        self.assertEqual(
+            self.auth_client.get(reverse('posts:index')).content,
+            old_content,
+            'Ошибка в кешировании страницы.',
+        )
 
-            args = (
-                old_content,
-                new_content,
-                'Ошибка в кешировании страницы.',
-            )
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertNotEqual(
+            self.auth_client.get(reverse('posts:index')).content,
+            old_content,
+            'Кэш страницы не сбрасывается при удалении поста.',
+        )
 
-            if level is TestLevels.AFTER_CACHE_CLEAR:
-                self.assertNotEqual(*args)
-            else:
-                self.assertEqual(*args)
+    def get_cache_version(self, url):
+        context = self.auth_client.get(url).context
+        return context.get('feed_version') or context['post_version']
 
-            level is TestLevels.BEFORE_DEL_OBJ and Post.objects.filter(
-                pk=self.post.pk
-            ).delete()
+    def test_cache_invalidation_scopes(self):
+        """
+        Изменение поста сбрасывает кэш только затронутых лент.
+        """
+        other_group_url = reverse(
+            'posts:group_posts',
+            kwargs={'slug': self.test_group_for_post_create_testing.slug},
+        )
+        urls = {
+            'index': reverse('posts:index'),
+            'group': reverse(
+                'posts:group_posts',
+                kwargs={'slug': self.test_group.slug},
+            ),
+            'profile': reverse(
+                'posts:profile',
+                kwargs={'username': self.user_author.username},
+            ),
+            'detail': reverse(
+                'posts:post_detail',
+                kwargs={'post_id': self.post.pk},
+            ),
+        }
+        versions = {
+            name: self.get_cache_version(url) for name, url in urls.items()
+        }
+        other_group_version = self.get_cache_version(other_group_url)
+
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Отредактированный пост'
+        post.save()
+
+        for name, url in urls.items():
+            with self.subTest(name=name):
+                self.assertNotEqual(
+                    self.get_cache_version(url),
+                    versions[name],
+                    f'Кэш страницы {url} не сброшен после изменения поста',
+                )
+        self.assertEqual(
+            self.get_cache_version(other_group_url),
+            other_group_version,
+            'Кэш ленты другой группы не должен сбрасываться',
+        )
 
-            level is TestLevels.AFTER_DEL_OBJ and cache.clear()
+    def test_author_rename_refreshes_cached_pages(self):
+        """
+        Кэшированные страницы показывают новое имя автора, а вход
+        пользователя кэш не сбрасывает.
+        """
+        urls = [
+            reverse('posts:index'),
+            reverse(
+                'posts:group_posts',
+                kwargs={'slug': self.test_group.slug},
+            ),
+            reverse(
+                'posts:profile',
+                kwargs={'username': self.user_author.username},
+            ),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        versions = [self.get_cache_version(url) for url in urls]
+
+        Client().force_login(self.user_author)
+        self.assertEqual(
+            [self.get_cache_version(url) for url in urls],
+            versions,
+        )
+
+        author = User.objects.get(pk=self.user_author.pk)
+        author.first_name = 'Новое'
+        author.last_name = 'Имя'
+        author.save()
+
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.auth_client.get(url),
+                    'Автор: Новое Имя',
+                )
 
 
 class FollowingTest(TestCase):
@@ -426,3 +502,145 @@ class PaginatorTest(TestCase):
                     'Пагинатор работает некорректно'
                     f' по адресу {address}',
                 )
+
+    def test_cursor_pagination_walks_whole_feed(self):
+        """
+        Курсорная пагинация проходит ленту без пропусков и повторов
+        в обе стороны.
+        """
+        url = reverse('posts:index')
+        response = self.auth_client.get(url)
+        pages = [list(response.context['page_obj'].object_list)]
+
+        while response.context['page_obj'].next_cursor:
+            response = self.auth_client.get(
+                url,
+                {'after': response.context['page_obj'].next_cursor},
+            )
+            pages.append(list(response.context['page_obj'].object_list))
+
+        walked_posts = [post.pk for page in pages for post in page]
+        self.assertEqual(
+            walked_posts,
+            list(
+                Post.objects.order_by('-pub_date', '-pk').values_list(
+                    'pk',
+                    flat=True,
+                )
+            ),
+            'Курсорная пагинация пропускает или повторяет посты',
+        )
+        self.assertEqual(len(pages), self.number_of_pages)
+
+        for page in reversed(pages[:-1]):
+            response = self.auth_client.get(
+                url,
+                {'before': response.context['page_obj'].previous_cursor},
+            )
+            self.assertEqual(
+                list(response.context['page_obj'].object_list),
+                page,
+                'Переход на предыдущую страницу по курсору работает'
+                ' некорректно',
+            )
+        self.assertIsNone(response.context['page_obj'].previous_cursor)
+
+    @override_settings(PAGINATION_MAX_PAGE=1)
+    def test_page_number_fallback_is_bounded(self):
+        """
+        Старые ссылки ?page=N работают, но не глубже PAGINATION_MAX_PAGE.
+        """
+        response = self.auth_client.get(
+            reverse('posts:index'),
+            {'page': self.number_of_pages},
+        )
+        self.assertEqual(response.context['page_obj'].number, 1)
+
+
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.author = User.objects.create_user(username='Author')
+        cls.post = Post.objects.create(
+            text='Пост с длинным обсуждением',
+            author=cls.author,
+        )
+        cls.comments_count = settings.COMMENTS_PER_PAGE + 5
+        for number in range(cls.comments_count):
+            Comment.objects.create(
+                text=f'Комментарий {number}',
+                author=User.objects.create_user(username=f'Reader{number}'),
+                post=cls.post,
+            )
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def test_comments_are_paginated(self):
+        """
+        На странице поста выводится первая порция комментариев,
+        остальные отдает фрагмент со следующей порцией.
+        """
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        first_page = response.context['comments']
+        self.assertEqual(len(first_page), settings.COMMENTS_PER_PAGE)
+        self.assertIsNotNone(first_page.next_cursor)
+
+        response = self.guest_client.get(
+            reverse(
+                'posts:post_comments',
+                kwargs={'post_id': self.post.pk},
+            ),
+            {'after': first_page.next_cursor},
+        )
+        next_page = response.context['comments']
+        self.assertEqual(
+            len(next_page),
+            self.comments_count - settings.COMMENTS_PER_PAGE,
+        )
+        self.assertIsNone(next_page.next_cursor)
+        self.assertTemplateUsed(response, 'posts/includes/comments.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertEqual(
+            [comment.pk for comment in first_page]
+            + [comment.pk for comment in next_page],
+            list(
+                self.post.comments.order_by(
+                    '-created',
+                    '-id',
+                ).values_list('pk', flat=True)
+            ),
+            'Порции комментариев пропускают или повторяют комментарии',
+        )
+
+    def test_comment_authors_in_one_query(self):
+        """
+        Комментарии и их авторы загружаются одним запросом.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest_client.get(
+                reverse(
+                    'posts:post_detail',
+                    kwargs={'post_id': self.post.pk},
+                )
+            )
+        comment_queries = [
+            query['sql'] for query in queries.captured_queries
+            if '"posts_comment"."text"' in query['sql']
+        ]
+        self.assertEqual(len(comment_queries), 1)
+        self.assertContains(response, f'Reader{self.comments_count - 1}')
+
+    def test_missing_post_comments(self):
+        """
+        Фрагмент комментариев к несуществующему посту отвечает 404.
+        """
+        response = self.guest_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 10 ** 6})
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
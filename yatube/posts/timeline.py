@@ -0,0 +1,295 @@
+"""
+Материализованная лента подписок (fan-out on write).
+
+При публикации поста он раскладывается по лентам подписчиков автора,
+поэтому страница /follow/ читает один индексный диапазон таблицы
+TimelineEntry вместо соединения всей таблицы постов с подписками.
+Посты авторов, у которых подписчиков больше TIMELINE_FANOUT_LIMIT,
+по лентам не раскладываются и читаются в момент запроса: каждый такой
+автор - отдельный набор по индексу его постов, и все наборы
+сливаются с материализованной лентой одним запросом (MergedQuerySet).
+Когда автор перестает быть "тяжелым", его посты раскладываются по
+лентам подписчиков в фоновом потоке после фиксации транзакции.
+"""
+import logging
+from typing import Dict, List, Optional, Union
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, QuerySet
+
+from core.background import submit
+
+from .counters import (CountResult, author_scope, change_counters,
+                       follower_scope, followers_scope, get_count,
+                       get_value, get_values, reset_counters)
+from .invalidation import bump, follow_feed
+from .models import Follow, Post, TimelineEntry, User
+from .pagination import MergedQuerySet
+
+logger = logging.getLogger(__name__)
+
+
+def get_followers_count(author_id: int) -> int:
+    """Возвращает количество подписчиков автора."""
+    return get_value(followers_scope(author_id))
+
+
+def is_heavy_author(author_id: int) -> bool:
+    """Проверяет, что посты автора читаются без материализации."""
+    return get_followers_count(author_id) > settings.TIMELINE_FANOUT_LIMIT
+
+
+def get_heavy_authors(user_id: int) -> List[int]:
+    """Возвращает id "тяжелых" авторов из подписок пользователя."""
+    author_ids: List[int] = list(
+        Follow.objects.filter(
+            user_id=user_id,
+        ).values_list('author_id', flat=True)
+    )
+    followers_counts: Dict[str, int] = get_values(
+        map(followers_scope, author_ids)
+    )
+    return [
+        author_id for author_id in author_ids
+        if followers_counts[followers_scope(author_id)]
+        > settings.TIMELINE_FANOUT_LIMIT
+    ]
+
+
+def fan_out_post(post: Post) -> None:
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_heavy_author(post.author_id):
+        return
+
+    follower_ids: List[int] = list(
+        Follow.objects.filter(
+            author_id=post.author_id,
+        ).values_list('user_id', flat=True)
+    )
+
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=follower_id,
+                post_id=post.pk,
+                author_id=post.author_id,
+                pub_date=post.pub_date,
+            ) for follower_id in follower_ids
+        ),
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    change_counters(map(follower_scope, follower_ids), 1)
+
+
+def withdraw_post(post: Post) -> None:
+    """Уменьшает счетчики лент, из которых будет удален пост."""
+    reader_ids = TimelineEntry.objects.filter(
+        post_id=post.pk,
+    ).values_list('user_id', flat=True)
+    change_counters(map(follower_scope, reader_ids), -1)
+
+
+def withdraw_author(author_id: int) -> None:
+    """Убирает посты автора из всех материализованных лент."""
+    entries = TimelineEntry.objects.filter(author_id=author_id)
+    reader_ids: List[int] = list(
+        entries.values_list('user_id', flat=True).distinct()
+    )
+    entries.delete()
+    reset_counters(map(follower_scope, reader_ids))
+
+
+def backfill_timeline(user_id: int, author_id: int) -> None:
+    """
+    Добавляет в ленту читателя все посты автора.
+
+    Если с этой подпиской автор стал "тяжелым", его посты убираются
+    из лент: дальше они читаются в момент запроса.
+    """
+    followers_count: int = get_followers_count(author_id)
+    if followers_count > settings.TIMELINE_FANOUT_LIMIT:
+        if followers_count == settings.TIMELINE_FANOUT_LIMIT + 1:
+            withdraw_author(author_id)
+        return
+
+    posts = Post.objects.filter(
+        author_id=author_id,
+    ).values_list('pk', 'pub_date')
+
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            ) for post_id, pub_date in posts.iterator()
+        ),
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    reset_counters([follower_scope(user_id)])
+
+
+def prune_timeline(user_id: int, author_id: int) -> None:
+    """
+    Удаляет посты автора из ленты читателя.
+
+    Если после отписки автор перестал быть "тяжелым", его посты
+    раскладываются по лентам оставшихся подписчиков в фоне.
+    """
+    TimelineEntry.objects.filter(
+        user_id=user_id,
+        author_id=author_id,
+    ).delete()
+    reset_counters([follower_scope(user_id)])
+
+    if get_followers_count(author_id) == settings.TIMELINE_FANOUT_LIMIT:
+        schedule_materialize(author_id)
+
+
+def materialize_author(author_id: int) -> None:
+    """
+    Раскладывает посты автора по лентам всех его подписчиков одним
+    запросом, если автор не "тяжелый".
+    """
+    if is_heavy_author(author_id):
+        return
+    entries: str = TimelineEntry._meta.db_table
+    follows: str = Follow._meta.db_table
+    posts: str = Post._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR IGNORE INTO {entries} '
+            '(user_id, post_id, author_id, pub_date) '
+            f'SELECT {follows}.user_id, {posts}.id, {posts}.author_id, '
+            f'{posts}.pub_date FROM {follows} '
+            f'JOIN {posts} ON {posts}.author_id = {follows}.author_id '
+            f'WHERE {follows}.author_id = %s',
+            [author_id],
+        )
+        follower_ids: List[int] = list(
+            Follow.objects.filter(
+                author_id=author_id,
+            ).values_list('user_id', flat=True)
+        )
+        reset_counters(map(follower_scope, follower_ids))
+        bump(map(follow_feed, follower_ids))
+
+
+def _materialize(author_id: int) -> None:
+    try:
+        materialize_author(author_id)
+    except Exception:
+        logger.exception(
+            'Не удалось разложить посты автора %s по лентам',
+            author_id,
+        )
+
+
+def schedule_materialize(author_id: int) -> None:
+    """
+    Ставит раскладку постов автора по лентам в очередь фонового потока
+    после фиксации транзакции.
+
+    Пока она не выполнена, посты автора не видны в лентах его
+    подписчиков; потерянную задачу восполняет rebuild_timelines.
+    """
+    transaction.on_commit(
+        lambda: submit('timeline', 1, _materialize, author_id)
+    )
+
+
+def rebuild_timelines() -> int:
+    """
+    Заново строит материализованные ленты всех читателей.
+
+    Счетчики лент после нее нужно сбросить. Возвращает количество
+    записей лент.
+    """
+    entries: str = TimelineEntry._meta.db_table
+    follows: str = Follow._meta.db_table
+    posts: str = Post._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {entries}')
+        cursor.execute(
+            f'INSERT INTO {entries} (user_id, post_id, author_id, pub_date) '
+            f'SELECT {follows}.user_id, {posts}.id, {posts}.author_id, '
+            f'{posts}.pub_date FROM {follows} '
+            f'JOIN {posts} ON {posts}.author_id = {follows}.author_id '
+            f'WHERE {follows}.author_id IN ('
+            f'SELECT author_id FROM {follows} '
+            f'GROUP BY author_id HAVING COUNT(*) <= %s)',
+            [settings.TIMELINE_FANOUT_LIMIT],
+        )
+        cursor.execute(f'SELECT COUNT(*) FROM {entries}')
+        return cursor.fetchone()[0]
+
+
+def get_timeline(user: User, heavy_authors: Optional[List[int]] = None
+                 ) -> Union[QuerySet, MergedQuerySet]:
+    """
+    Возвращает посты ленты подписок пользователя.
+
+    heavy_authors - заранее полученный результат get_heavy_authors.
+    Посты "тяжелых" авторов сливаются с материализованной лентой
+    в одном запросе (MergedQuerySet).
+    """
+    post_list: QuerySet = Post.objects.select_related(
+        'author',
+        'group',
+    )
+    if heavy_authors is None:
+        heavy_authors = get_heavy_authors(user.pk)
+
+    timeline: QuerySet = post_list.filter(
+        timeline_entries__user=user.pk,
+    ).annotate(
+        feed_date=F('timeline_entries__pub_date'),
+        feed_id=F('timeline_entries__post'),
+    ).order_by(
+        '-feed_date',
+        '-feed_id',
+    )
+    if not heavy_authors:
+        return timeline
+
+    # Каждый набор читается по индексу (author, pub_date); авторы сверх
+    # TIMELINE_MERGE_MAX_AUTHORS читаются одним набором с сортировкой.
+    limit: int = settings.TIMELINE_MERGE_MAX_AUTHORS
+    author_groups: List[List[int]] = [
+        [author_id] for author_id in heavy_authors[:limit]
+    ]
+    if heavy_authors[limit:]:
+        author_groups.append(heavy_authors[limit:])
+    return MergedQuerySet([timeline] + [
+        post_list.filter(
+            author_id__in=author_ids,
+        ).annotate(
+            feed_date=F('pub_date'),
+            feed_id=F('pk'),
+        ).order_by(
+            '-feed_date',
+            '-feed_id',
+        )
+        for author_ids in author_groups
+    ])
+
+
+def get_timeline_count(user: User) -> CountResult:
+    """
+    Возвращает количество постов в ленте подписок пользователя.
+
+    Складывается из счетчика материализованной ленты и счетчиков
+    постов "тяжелых" авторов.
+    """
+    count, approximate = get_count(
+        follower_scope(user.pk),
+        TimelineEntry.objects.filter(user_id=user.pk),
+    )
+    count += sum(get_values(
+        map(author_scope, get_heavy_authors(user.pk))
+    ).values())
+    return count, approximate
@@ -1,22 +1,32 @@
-from typing import Any, Dict, Optional, Union
+from functools import partial
+from typing import Any, Dict, List, Union
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Page, Paginator
+from django.core.paginator import Page
+from django.db import transaction
 from django.db.models import QuerySet
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
+from core.thumbnails import get_presets, schedule_thumbnails
+
+from .conditional import (comments_scopes, group_scopes, index_scopes,
+                          post_detail_scopes, profile_scopes,
+                          scoped_condition)
+from .counters import (GLOBAL_SCOPE, author_scope, comments_scope,
+                       followers_scope, following_scope, get_count,
+                       get_value, group_scope)
 from .forms import CommentForm, PostForm
+from .invalidation import (GROUPS, INDEX, get_timeline_version, get_version,
+                           group_feed, post_page, profile_feed)
 from .models import Follow, Group, Post, User
+from .pagination import MergedQuerySet, get_comments_page, get_page_obj
+from .search import search_posts
+from .timeline import get_heavy_authors, get_timeline, get_timeline_count
 
 
-def get_page_obj(post_list: QuerySet, page_number: Optional[str]) -> Page:
-    """Возвращает объект класса Page для пагинации"""
-    paginator: Paginator = Paginator(post_list, settings.LIMIT_OF_RECORDS)
-    return paginator.get_page(page_number)
-
-
+@scoped_condition(index_scopes)
 def index(request: HttpRequest) -> HttpResponse:
     """Обработчик для главной страницы приложения"""
     post_list: QuerySet = Post.objects.select_related(
@@ -25,16 +35,19 @@ def index(request: HttpRequest) -> HttpResponse:
     )
     page_obj: Page = get_page_obj(
         post_list,
-        request.GET.get('page'),
+        request.GET,
+        partial(get_count, GLOBAL_SCOPE, post_list),
     )
 
     context: Dict[str, Union[str, Any]] = {
         'page_obj': page_obj,
         'index': True,
+        'feed_version': get_version(INDEX, GROUPS),
     }
     return render(request, 'posts/index.html', context)
 
 
+@scoped_condition(group_scopes)
 def group_posts(request: HttpRequest, slug: str) -> HttpResponse:
     """Обработчик для страницы постов определенной группы"""
     group: Group = get_object_or_404(Group, slug=slug)
@@ -44,17 +57,20 @@ def group_posts(request: HttpRequest, slug: str) -> HttpResponse:
     )
     page_obj: Page = get_page_obj(
         post_list,
-        request.GET.get('page'),
+        request.GET,
+        partial(get_count, group_scope(group.pk), post_list),
     )
 
     context: Dict[str, Any] = {
         'group': group,
         'page_obj': page_obj,
+        'feed_version': get_version(group_feed(group.pk), GROUPS),
     }
 
     return render(request, 'posts/group_list.html', context)
 
 
+@scoped_condition(profile_scopes)
 def profile(request: HttpRequest, username: str) -> HttpResponse:
     """Возвращает страницу с профайлом пользователя"""
     author = get_object_or_404(User, username=username)
@@ -64,7 +80,8 @@ def profile(request: HttpRequest, username: str) -> HttpResponse:
     )
     page_obj: Page = get_page_obj(
         post_list,
-        request.GET.get('page'),
+        request.GET,
+        partial(get_count, author_scope(author.pk), post_list),
     )
 
     following: bool = (
@@ -76,10 +93,14 @@ def profile(request: HttpRequest, username: str) -> HttpResponse:
         'author': author,
         'page_obj': page_obj,
         'following': following,
+        'followers_count': get_value(followers_scope(author.pk)),
+        'following_count': get_value(following_scope(author.pk)),
+        'feed_version': get_version(profile_feed(author.pk), GROUPS),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@scoped_condition(post_detail_scopes)
 def post_detail(request: HttpRequest, post_id: int) -> HttpResponse:
     """Возвращает страницу с информацией о публикации"""
     post: Post = get_object_or_404(Post.objects.select_related(
@@ -90,12 +111,52 @@ def post_detail(request: HttpRequest, post_id: int) -> HttpResponse:
     context: Dict[str, Any] = {
         'post': post,
         'form': CommentForm(),
-        'comments': post.comments.all(),
+        'comments': get_comments_page(
+            post.comments,
+            request.GET.get('comments_after'),
+        ),
+        'comments_count': get_value(comments_scope(post.pk)),
+        'author_posts_count': get_value(author_scope(post.author_id)),
+        'post_version': get_version(post_page(post.pk)),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@scoped_condition(comments_scopes)
+def post_comments(request: HttpRequest, post_id: int) -> HttpResponse:
+    """Возвращает HTML-фрагмент со следующей порцией комментариев"""
+    post: Post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+
+    context: Dict[str, Any] = {
+        'post': post,
+        'comments': get_comments_page(
+            post.comments,
+            request.GET.get('after'),
+        ),
+        'post_version': get_version(post_page(post.pk)),
+    }
+    return render(request, 'posts/includes/comments.html', context)
+
+
+def search(request: HttpRequest) -> HttpResponse:
+    """Возвращает страницу поиска по постам"""
+    query: str = request.GET.get('q', '').strip()
+    posts, next_cursor = search_posts(
+        query,
+        request.GET.get('after'),
+        settings.SEARCH_RESULTS_PER_PAGE,
+    )
+
+    context: Dict[str, Any] = {
+        'query': query,
+        'posts': posts,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
+@transaction.atomic
 def post_create(request: HttpRequest) -> HttpResponse:
     """Возвращает страницу для создания публикации"""
     form: PostForm = PostForm(
@@ -107,12 +168,18 @@ def post_create(request: HttpRequest) -> HttpResponse:
         new_post: Post = form.save(commit=False)
         new_post.author = request.user
         new_post.save()
+        if new_post.image:
+            schedule_thumbnails(
+                new_post.image.name,
+                get_presets(settings.POST_IMAGE_PRESETS),
+            )
         return redirect('posts:profile', request.user)
 
     return render(request, 'posts/create_post.html', {'form': form})
 
 
 @login_required
+@transaction.atomic
 def post_edit(request: HttpRequest, post_id: int) -> HttpResponse:
     """Возвращает страницу для редактирования публикации"""
     post_for_edit: Post = get_object_or_404(Post.objects.select_related(
@@ -130,7 +197,12 @@ def post_edit(request: HttpRequest, post_id: int) -> HttpResponse:
     )
 
     if form_for_edit.is_valid():
-        form_for_edit.save()
+        post: Post = form_for_edit.save()
+        if post.image and 'image' in form_for_edit.changed_data:
+            schedule_thumbnails(
+                post.image.name,
+                get_presets(settings.POST_IMAGE_PRESETS),
+            )
         return redirect('posts:post_detail', post_id)
 
     return render(
@@ -141,6 +213,7 @@ def post_edit(request: HttpRequest, post_id: int) -> HttpResponse:
 
 
 @login_required
+@transaction.atomic
 def add_comment(request: HttpRequest, post_id: int) -> HttpResponse:
     """Функция для обработки отправленного комментария"""
     post: Post = get_object_or_404(Post, pk=post_id)
@@ -156,26 +229,30 @@ def add_comment(request: HttpRequest, post_id: int) -> HttpResponse:
 @login_required
 def follow_index(request):
     """Возвращает страницу с подписками пользователя."""
-    post_list: QuerySet = Post.objects.select_related(
-        'author',
-        'group',
-    ).filter(author__following__user=request.user.pk)
+    heavy_authors: List[int] = get_heavy_authors(request.user.pk)
+    post_list: Union[QuerySet, MergedQuerySet] = get_timeline(
+        request.user,
+        heavy_authors,
+    )
 
     page_obj: Page = get_page_obj(
         post_list,
-        request.GET.get('page'),
+        request.GET,
+        partial(get_timeline_count, request.user),
     )
 
     context: Dict[str, Union[str, Any]] = {
         'page_obj': page_obj,
         'index': True,
         'follow': True,
+        'feed_version': get_timeline_version(request.user, heavy_authors),
     }
 
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     """Подписаться на автора."""
     author: User = get_object_or_404(User, username=username)
@@ -188,6 +265,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     """Отписаться от автора."""
     author: User = get_object_or_404(User, username=username)
@@ -49,6 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.RepeatedQueriesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,7 +66,7 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates/')
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.timing.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -73,6 +76,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.year.year',
+                'core.context_processors.cache.fragment_cache_timeout',
             ],
         },
     },
@@ -130,12 +134,36 @@ USE_TZ = True
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Загрузки из этих каталогов хранятся по хешу содержимого, одинаковые
+# файлы сохраняются один раз (см. core.storage).
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+MEDIA_CONTENT_ADDRESSED_DIRS = ('posts/',)
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, "static")]
 # STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 LIMIT_OF_RECORDS: int = 10
+# Размер порции комментариев на странице поста.
+COMMENTS_PER_PAGE: int = 20
+# Размер порции результатов поиска.
+SEARCH_RESULTS_PER_PAGE: int = 10
+# Глубже этой страницы ссылки вида ?page=N не обслуживаются,
+# дальше лента листается курсорами ?after= / ?before=.
+PAGINATION_MAX_PAGE: int = 100
+# Если счетчик постов еще не заполнен, считается не больше этого числа
+# записей, а большее количество выводится приблизительно ("N+").
+# None - считать точно.
+COUNT_APPROXIMATE_ABOVE = None
+COUNTERS_BATCH_SIZE: int = 500
+
+# Авторы, у которых подписчиков больше этого числа, не раскладываются
+# по материализованным лентам и читаются в момент запроса.
+TIMELINE_FANOUT_LIMIT: int = 1000
+# Сколько "тяжелых" авторов ленты читается по своему индексу; посты
+# остальных сортируются вместе (SQLite допускает до 500 частей UNION).
+TIMELINE_MERGE_MAX_AUTHORS: int = 100
+TIMELINE_BATCH_SIZE: int = 500
 
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -145,9 +173,99 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
-CACHE = {
+# Локальный LRU-кэш воркера перед общим для всех воркеров файловым кэшем.
+CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': '127.0.0.1:8000',
-    }
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'LOCAL_MAX_ENTRIES': 500,
+            'LOCAL_TIMEOUT': 5,
+        },
+    },
+    # Версии кэшированных лент читаются из общего кэша напрямую.
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'versions'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+# Фрагменты лент инвалидируются по версиям, поэтому хранятся долго.
+FRAGMENT_CACHE_TIMEOUT: int = 60 * 60 * 24
+
+# Защита от одновременного пересчета кэша (core.cache.get_or_recompute):
+# сколько секунд отдавать устаревшее значение во время пересчета, сколько
+# держать блокировку пересчета и насколько рано обновлять значение.
+CACHE_STALE_TIMEOUT: int = 60 * 10
+CACHE_LOCK_TIMEOUT: int = 10
+CACHE_EARLY_REFRESH_BETA: float = 1.0
+
+# Миниатюры создаются в фоновом пуле потоков, страница до их появления
+# показывает исходное изображение.
+THUMBNAIL_BACKEND = 'core.thumbnails.AsyncThumbnailBackend'
+THUMBNAIL_WORKERS: int = 2
+# Выполнять фоновые задачи (миниатюры, раскладку лент) сразу в текущем
+# потоке, а не в пуле core.background; включается в тестах.
+BACKGROUND_TASKS_EAGER: bool = False
+# Размеры изображений и списки миниатюр sorl-thumbnail хранятся в общем
+# для воркеров файле SQLite; найденные ключи запоминаются в памяти
+# воркера на THUMBNAIL_KVSTORE_LOCAL_TIMEOUT секунд.
+THUMBNAIL_KVSTORE = 'core.kvstore.SQLiteKVStore'
+THUMBNAIL_KVSTORE_PATH = os.path.join(BASE_DIR, 'cache', 'thumbnails.sqlite3')
+THUMBNAIL_KVSTORE_TIMEOUT: float = 5
+THUMBNAIL_KVSTORE_LOCAL_TIMEOUT: float = 60
+THUMBNAIL_KVSTORE_LOCAL_MAX_ENTRIES: int = 5000
+# Загруженные изображения уменьшаются до IMAGE_MAX_DIMENSION по большей
+# стороне и перекодируются с качеством IMAGE_QUALITY; изображения больше
+# IMAGE_MAX_SOURCE_PIXELS не принимаются.
+IMAGE_MAX_DIMENSION: int = 1920
+IMAGE_MAX_SOURCE_PIXELS: int = 50_000_000
+IMAGE_QUALITY: int = 85
+# Именованные миниатюры: геометрия и параметры, как в теге {% thumbnail %}.
+THUMBNAIL_PRESETS = {
+    'post_card': ('960x339', {'crop': 'bottom', 'upscale': True}),
+    'post_detail': ('960x339', {'crop': 'bottom', 'upscale': True}),
+}
+# Ширины уменьшенных копий пресета для атрибута srcset; пропорции
+# берутся из геометрии пресета.
+THUMBNAIL_SRCSET_WIDTHS = {
+    'post_card': (320, 480, 640),
 }
+# Миниатюры изображений постов, создаваемые сразу после загрузки.
+POST_IMAGE_PRESETS = ('post_card', 'post_detail')
+
+# Поиск повторяющихся SQL-запросов (N+1): проверяется доля запросов
+# NPLUSONE_SAMPLE_RATE, о запросе, выполненном из одного места больше
+# NPLUSONE_THRESHOLD раз, пишется предупреждение в лог core.middleware.
+# Тестовый раннер проверяет каждый запрос и выбрасывает исключение.
+NPLUSONE_SAMPLE_RATE: float = 0.01
+NPLUSONE_THRESHOLD: int = 5
+NPLUSONE_RAISE: bool = False
+TEST_RUNNER = 'core.runner.TestRunner'
+
+# Длительности SQL, шаблонов, миниатюр и сессии в каждом ответе
+# (заголовок Server-Timing) и в логе core.timing на уровне INFO.
+SERVER_TIMING_HEADER: bool = DEBUG
+SESSION_ENGINE = 'core.sessions'
+
+# Метрики Prometheus по представлениям (/metrics). Воркеры раз в
+# METRICS_FLUSH_INTERVAL секунд добавляют свои счетчики в общий файл
+# SQLite METRICS_PATH. Если задан METRICS_TOKEN, страница отдается
+# только с заголовком "Authorization: Bearer <токен>" - так ее нужно
+# защищать за обратным прокси. Без токена она доступна напрямую с
+# адресов METRICS_ALLOWED_IPS, а запросы с заголовками прокси
+# (X-Forwarded-For и т.п.) отклоняются.
+METRICS_PATH = os.path.join(BASE_DIR, 'cache', 'metrics.sqlite3')
+METRICS_FLUSH_INTERVAL: float = 1
+METRICS_TIMEOUT: float = 5
+METRICS_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+METRICS_TOKEN: str = os.environ.get('METRICS_TOKEN', '')
@@ -28,6 +28,7 @@ urlpatterns = [
     path('', include('posts.urls', namespace='posts')),
     path('about/', include('about.urls', namespace='about')),
     path('admin/', admin.site.urls),
+    path('', include('core.urls', namespace='core')),
 ]
 
 if settings.DEBUG: